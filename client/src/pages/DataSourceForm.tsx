@@ -12,7 +12,8 @@ const DataSourceForm: React.FC = () => {
         port: 1433,
         database_name: '',
         username: '',
-        password: ''
+        password: '',
+        extraction_mode: 'CURSOR'
     });
 
     const handleSubmit = async (e: React.FormEvent) => {
@@ -53,6 +54,20 @@ const DataSourceForm: React.FC = () => {
                     </select>
                 </div>
 
+                {formData.engine === 'POSTGRES' && (
+                    <div className={styles.formGroup}>
+                        <label>Extraction Mode</label>
+                        <select
+                            value={formData.extraction_mode}
+                            onChange={e => setFormData({ ...formData, extraction_mode: e.target.value })}
+                        >
+                            <option value="CURSOR">Cursor fetch</option>
+                            <option value="COPY_BINARY">COPY, binary (fastest, numeric values)</option>
+                            <option value="COPY_CSV">COPY, CSV</option>
+                        </select>
+                    </div>
+                )}
+
                 <div className={styles.formGroup}>
                     <label>Host</label>
                     <input
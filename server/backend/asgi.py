@@ -3,6 +3,11 @@ ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve through an ASGI server (e.g. ``uvicorn backend.asgi:application``) for
+the live chart streams at /api/spc/charts/<pk>/stream/ and the async chart
+data view at /api/spc/charts/<pk>/data/async/; under WSGI each open stream
+or slow query would hold a worker thread.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
@@ -90,6 +90,19 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+# Per-process memory by default; use a shared backend (file, Redis, ...) to
+# share computed chart payloads between server processes.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "spc",
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -144,3 +157,97 @@ REST_FRAMEWORK = {
         "rest_framework.permissions.IsAuthenticated",
     ],
 }
+
+# SPC external data source connection pooling (see spc/connection_pool.py)
+SPC_CONNECTION_POOL = {
+    "MAX_SIZE": 5,
+    "IDLE_TIMEOUT": 300,
+    "CHECKOUT_TIMEOUT": 30,
+    "CONNECT_TIMEOUT": 5,
+}
+
+# Chart data requests without an explicit start_date look back this many days
+SPC_DEFAULT_LOOKBACK_DAYS = 30
+
+# Hard cap on rows fetched from a source table per chart request
+SPC_MAX_ROWS = 100000
+
+# Async chart data view (spc/async_executor.py): worker threads for blocking
+# source queries, concurrent queries per DataSource, per-request timeout
+SPC_ASYNC = {
+    "WORKERS": 32,
+    "SOURCE_CONCURRENCY": 4,
+    "QUERY_TIMEOUT": 60,
+}
+
+# Rows per chunk when streaming source results (server-side cursor / fetchmany)
+SPC_FETCH_CHUNK_SIZE = 10000
+
+# Seconds without a committed chunk after which a measurement cache sync
+# (spc/measurement_cache.py) is presumed dead and another sync may take over
+SPC_CACHE_SYNC_TIMEOUT = 120
+
+# Seconds a chart request waits for another sync of the same chart before
+# serving the cached rows as stale (the backfill command waits up to
+# SPC_CACHE_SYNC_TIMEOUT)
+SPC_CACHE_SYNC_WAIT = 5
+
+# Seconds a source table's column metadata (spc/query_builder.py) is cached
+SPC_COLUMN_METADATA_TTL = 300
+
+# Per-source schema catalog for the table browser (spc/schema_catalog.py)
+SPC_SCHEMA_CATALOG = {
+    "CACHE": "default",
+    "TTL": 600,
+    "MAX_AGE": 86400,
+    "PAGE_SIZE": 50,
+    "MAX_PAGE_SIZE": 500,
+    "VALUES_LIMIT": 1000,
+    "VALUES_TTL": 300,
+}
+
+# Computed chart payload cache (spc/result_cache.py)
+SPC_RESULT_CACHE = {
+    "CACHE": "default",
+    "TTL": 30,
+    "COALESCE_TIMEOUT": 60,
+}
+
+# Multi-chart data requests (spc/batch.py)
+SPC_BATCH = {
+    "WORKERS": 8,
+    "MAX_CHARTS": 100,
+}
+
+# Batch chart computation jobs (spc/parallel.py, manage.py spc_compute)
+SPC_PARALLEL = {
+    "PROCESSES": None,
+    "THREADS": 8,
+    "START_METHOD": "spawn",
+}
+
+# Precomputed snapshots of hot charts (spc/snapshots.py, manage.py spc_snapshots)
+SPC_SNAPSHOTS = {
+    "TICK": 5,
+    "WORKERS": 4,
+    "FULL_REFRESH": 3600,
+    "MAX_AGE_INTERVALS": 3,
+}
+
+# Request timing: Server-Timing header, metrics endpoint and slow request log
+# to the "spc.slow" logger (spc/instrumentation.py). The metrics endpoint is
+# open to staff users, and to scrapers sending METRICS_TOKEN as a bearer token
+SPC_INSTRUMENTATION = {
+    "SERVER_TIMING": True,
+    "METRICS": True,
+    "SLOW_REQUEST_SECONDS": 5,
+    "LOG_SQL": True,
+    "METRICS_TOKEN": None,
+}
+
+# Live chart streams (spc/streaming.py)
+SPC_STREAM = {
+    "POLL_INTERVAL": 5,
+    "KEEPALIVE": 15,
+    "QUEUE_SIZE": 100,
+}
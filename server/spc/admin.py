@@ -1,11 +1,17 @@
-from django.contrib import admin
-from .models import DataSource, ChartConfig
+from django.contrib import admin, messages
+from .models import (
+    DataSource,
+    ChartConfig,
+    ChartSnapshot,
+    ControlLimitBaseline,
+    MeasurementCache,
+)
 
 
 @admin.register(DataSource)
 class DataSourceAdmin(admin.ModelAdmin):
     list_display = ["name", "engine", "host", "database_name", "is_active"]
-    list_filter = ["engine", "is_active"]
+    list_filter = ["engine", "extraction_mode", "is_active"]
     search_fields = ["name", "host", "database_name"]
     actions = ["test_connection"]
 
@@ -38,10 +44,112 @@ class DataSourceAdmin(admin.ModelAdmin):
 @admin.register(ChartConfig)
 class ChartConfigAdmin(admin.ModelAdmin):
     list_display = ["__str__", "owner", "priority_display", "aggregation_type"]
-    list_filter = ["aggregation_type", "data_source"]
+    list_filter = ["aggregation_type", "precompute_snapshots", "data_source"]
     search_fields = ["product_identifier", "operation_identifier", "title"]
+    actions = ["check_indexes", "freeze_limits", "release_limits"]
 
     def priority_display(self, obj):
         return f"{obj.product_identifier} / {obj.operation_identifier}"
 
     priority_display.short_description = "Product / Operation"
+
+    def check_indexes(self, request, queryset):
+        from .index_advisor import IndexAdvisor
+
+        advisor = IndexAdvisor()
+        for config in queryset.select_related("data_source"):
+            try:
+                advice = advisor.advise(config)
+            except Exception as e:
+                self.message_user(request, f"{config}: {e}", level=messages.ERROR)
+                continue
+            message = f"{config}: {'; '.join(advice['findings'])}"
+            if advice["recommendation"]:
+                message += f". Suggested: {advice['recommendation']['sql']}"
+                self.message_user(request, message, level=messages.WARNING)
+            else:
+                self.message_user(request, message)
+
+    check_indexes.short_description = "Check source indexes"
+
+    def freeze_limits(self, request, queryset):
+        from .baselines import baseline_service
+
+        for config in queryset.select_related("data_source"):
+            try:
+                baseline = baseline_service.compute(config, user=request.user)
+            except Exception as e:
+                self.message_user(request, f"{config}: {e}", level=messages.ERROR)
+                continue
+            self.message_user(
+                request,
+                f"{config}: limits v{baseline.version} frozen at "
+                f"{baseline.center:.4g} ({baseline.lcl} .. {baseline.ucl})",
+            )
+
+    freeze_limits.short_description = (
+        "Freeze control limits from the last SPC_DEFAULT_LOOKBACK_DAYS"
+    )
+
+    def release_limits(self, request, queryset):
+        from .baselines import baseline_service
+
+        released = sum(baseline_service.release(config) for config in queryset)
+        self.message_user(request, f"Released {released} baselines.")
+
+    release_limits.short_description = "Release frozen control limits"
+
+
+@admin.register(MeasurementCache)
+class MeasurementCacheAdmin(admin.ModelAdmin):
+    list_display = ["chart", "row_count", "low_watermark", "watermark", "synced_at"]
+    readonly_fields = [f.name for f in MeasurementCache._meta.fields]
+    actions = ["purge"]
+
+    def purge(self, request, queryset):
+        from .measurement_cache import MeasurementCacheService
+
+        service = MeasurementCacheService()
+        for state in queryset.select_related("chart"):
+            service.purge(state.chart)
+        self.message_user(request, f"Purged {queryset.count()} measurement caches.")
+
+    purge.short_description = "Purge cached measurements"
+
+
+@admin.register(ChartSnapshot)
+class ChartSnapshotAdmin(admin.ModelAdmin):
+    list_display = ["chart", "computed_at", "full_computed_at", "duration", "error"]
+    exclude = ["payload"]
+    readonly_fields = [
+        f.name for f in ChartSnapshot._meta.fields if f.name != "payload"
+    ]
+    actions = ["refresh"]
+
+    def refresh(self, request, queryset):
+        from .snapshots import snapshot_service
+
+        for snapshot in queryset.select_related("chart__data_source"):
+            snapshot_service.refresh(snapshot.chart)
+        self.message_user(request, f"Refreshed {queryset.count()} snapshots.")
+
+    refresh.short_description = "Recompute snapshots now"
+
+
+@admin.register(ControlLimitBaseline)
+class ControlLimitBaselineAdmin(admin.ModelAdmin):
+    list_display = [
+        "chart",
+        "version",
+        "is_active",
+        "chart_type",
+        "center",
+        "lcl",
+        "ucl",
+        "start",
+        "end",
+        "computed_at",
+    ]
+    list_filter = ["is_active", "chart_type"]
+    # Baselines are computed and released through the chart's actions
+    readonly_fields = [f.name for f in ControlLimitBaseline._meta.fields]
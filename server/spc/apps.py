@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class SpcConfig(AppConfig):
     name = "spc"
+
+    def ready(self):
+        from . import signals  # noqa: F401
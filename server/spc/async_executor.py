@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ASYNC_SETTINGS = {
+    "WORKERS": 32,  # Threads running blocking source queries for async views
+    "SOURCE_CONCURRENCY": 4,  # Concurrent queries per DataSource
+    "QUERY_TIMEOUT": 60,  # Seconds a chart request may wait for a slot + its query
+}
+
+
+# Seconds between attempts to take a busy source's slot
+ACQUIRE_POLL_INTERVAL = 0.01
+
+
+def get_async_settings() -> Dict[str, Any]:
+    return {**DEFAULT_ASYNC_SETTINGS, **getattr(settings, "SPC_ASYNC", {})}
+
+
+class SourceBusy(Exception):
+    """
+    Raised when no per-source slot frees up before the timeout
+    """
+
+
+class SourceExecutor:
+    """
+    Runs blocking pyodbc / psycopg2 / pandas work for async views on a shared
+    thread pool, with at most SOURCE_CONCURRENCY calls in flight per DataSource
+    so one slow source can't take every worker thread.
+
+    A call that times out is abandoned by the caller but keeps its slot until
+    the thread actually returns; the driver-level query timeout makes sure it
+    does. Slots are thread semaphores released by the pool thread itself, so
+    they hold across the event loops async_to_sync creates per request and
+    don't depend on the caller's loop still running.
+    """
+
+    def __init__(self):
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._semaphores: Dict[int, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=get_async_settings()["WORKERS"],
+                    thread_name_prefix="spc-source",
+                )
+            return self._executor
+
+    def semaphore(self, source_id: int) -> threading.BoundedSemaphore:
+        with self._lock:
+            semaphore = self._semaphores.get(source_id)
+            if semaphore is None:
+                limit = get_async_settings()["SOURCE_CONCURRENCY"]
+                semaphore = threading.BoundedSemaphore(limit)
+                self._semaphores[source_id] = semaphore
+            return semaphore
+
+    async def run(
+        self, source_id: int, func: Callable, *args, timeout: float = None
+    ) -> Any:
+        """
+        Awaits func(*args) on the thread pool. Raises SourceBusy when no slot
+        frees up in time and asyncio.TimeoutError when the call itself
+        overruns the remaining time.
+        """
+        if timeout is None:
+            timeout = get_async_settings()["QUERY_TIMEOUT"]
+        deadline = time.monotonic() + timeout
+        semaphore = self.semaphore(source_id)
+        # Polled rather than awaited, there's no thread to block on it
+        while not semaphore.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                raise SourceBusy(f"Data source {source_id} is busy")
+            await asyncio.sleep(ACQUIRE_POLL_INTERVAL)
+        try:
+            future = self.executor.submit(self._call, semaphore, func, args)
+        except BaseException:
+            semaphore.release()
+            raise
+
+        remaining = max(deadline - time.monotonic(), 0)
+        # Shielded: cancelling a queued call would skip _call and its release
+        return await asyncio.wait_for(
+            asyncio.shield(asyncio.wrap_future(future)), remaining
+        )
+
+    @staticmethod
+    def _call(semaphore: threading.BoundedSemaphore, func: Callable, args) -> Any:
+        try:
+            return func(*args)
+        finally:
+            # The slot is held until the thread returns, even if the caller
+            # gave up (or its event loop is gone)
+            semaphore.release()
+            # Pool threads outlive requests, so the request_finished cleanup
+            # never runs for their Django DB connections
+            close_old_connections()
+
+
+source_executor = SourceExecutor()
@@ -0,0 +1,124 @@
+import math
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .calculation_service import CalculationService
+from .control_limits import SIGMAS
+from .models import ChartConfig, ControlLimitBaseline
+
+
+class BaselineError(ValueError):
+    pass
+
+
+def json_float(value) -> Optional[float]:
+    """
+    A float for a JSONField, with NaN (which JSON can't hold) as None
+    """
+    if value is None:
+        return None
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+def aware(value):
+    return timezone.make_aware(value) if timezone.is_naive(value) else value
+
+
+class BaselineService:
+    """
+    Freezes a chart's control limits from a baseline period (phase I), so
+    later windows are judged against them (phase II) instead of against
+    limits re-estimated from whatever window is displayed. Requests then
+    only need the display window (ChartConfig.display_days).
+
+    Computing or releasing a baseline saves the chart, which invalidates
+    its cached results and snapshots and restarts its live streams.
+    """
+
+    def __init__(self, calculation_service: CalculationService = None):
+        self.calculation_service = calculation_service or CalculationService()
+
+    def compute(
+        self, config: ChartConfig, start_date=None, end_date=None, user=None
+    ) -> ControlLimitBaseline:
+        """
+        Estimates the limits from start_date..end_date (by default the last
+        SPC_DEFAULT_LOOKBACK_DAYS) and makes them the chart's active
+        baseline, as a new version
+        """
+        service = self.calculation_service
+        start_date, end_date = service.resolve_window(start_date, end_date)
+        payload = service.compute_chart_data(config, start_date, end_date, frozen=False)
+        if "error" in payload:
+            raise BaselineError(payload["error"])
+        data = payload["data"]
+        if not isinstance(data, pd.DataFrame) or data.empty:
+            raise BaselineError("No measurements in the baseline period")
+        if payload["window"]["truncated"]:
+            raise BaselineError(
+                "The baseline period has more rows than SPC_MAX_ROWS; "
+                "choose a shorter period"
+            )
+
+        limits = payload["limits"]
+        if limits["chart"] == "xbar":
+            measurements = int(data["count"].sum())
+            # X̄ limits depend on the subgroup size; store them at the median
+            size = float(np.median(data["count"]))
+            half_width = SIGMAS * limits["sigma_s"] / math.sqrt(size)
+            ucl, lcl = limits["center"] + half_width, limits["center"] - half_width
+        else:
+            measurements = len(data)
+            ucl, lcl = limits["ucl"], limits["lcl"]
+
+        with transaction.atomic():
+            # Serializes concurrent recomputations of the same chart
+            ChartConfig.objects.select_for_update().filter(pk=config.pk).first()
+            version = (config.baselines.aggregate(last=Max("version"))["last"] or 0) + 1
+            config.baselines.filter(is_active=True).update(is_active=False)
+            baseline = ControlLimitBaseline.objects.create(
+                chart=config,
+                version=version,
+                start=aware(start_date),
+                end=aware(end_date),
+                aggregation_type=config.aggregation_type,
+                aggregation_size=config.aggregation_size,
+                chart_type=limits["chart"],
+                center=limits["center"],
+                ucl=json_float(ucl),
+                lcl=json_float(lcl),
+                sigma_within=json_float(limits["sigma_within"]),
+                sigma_overall=json_float(payload["statistics"]["sigma_overall"]),
+                limits=self.summary(limits),
+                subgroups=len(data),
+                measurements=measurements,
+                created_by=user,
+            )
+            config.save(update_fields=["updated_at"])
+        return baseline
+
+    def release(self, config: ChartConfig) -> int:
+        """
+        Deactivates the chart's baseline so its limits are estimated from
+        each window again. Returns the number of baselines deactivated.
+        """
+        released = config.baselines.filter(is_active=True).update(is_active=False)
+        if released:
+            config.save(update_fields=["updated_at"])
+        return released
+
+    @staticmethod
+    def summary(limits: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            name: value if isinstance(value, str) else json_float(value)
+            for name, value in limits.items()
+        }
+
+
+baseline_service = BaselineService()
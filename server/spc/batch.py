@@ -0,0 +1,184 @@
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+
+from .calculation_service import CalculationService
+from .models import ChartConfig
+from .pipeline import ChunkAggregator
+from .query_builder import chart_pairs
+from .result_cache import result_cache
+from .services import decode_series
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SETTINGS = {
+    "WORKERS": 8,  # Threads fetching groups / computing charts per request
+    "MAX_CHARTS": 100,  # Chart IDs accepted in one batch request
+}
+
+
+def get_batch_settings() -> Dict[str, Any]:
+    return {**DEFAULT_BATCH_SETTINGS, **getattr(settings, "SPC_BATCH", {})}
+
+
+def batch_key(config: ChartConfig) -> tuple:
+    """
+    Charts with the same key can be served by one query on their table
+    """
+    return (
+        config.data_source_id,
+        config.table_name,
+        config.datetime_column,
+        config.value_column,
+        config.product_column,
+        config.operation_column,
+    )
+
+
+class BatchChartService:
+    """
+    Chart data for many charts at once. Charts reading the same table share
+    one source query (matching each chart's product / operation pair) whose
+    rows are split per chart in memory; the charts are then computed in
+    parallel.
+
+    Charts with a local measurement cache or aggregate pushdown, and charts
+    alone in their group, go through the regular single-chart path.
+    Payloads are read from and stored in the chart result cache.
+    """
+
+    def __init__(self, calculation_service: CalculationService = None):
+        self.calculation_service = calculation_service or CalculationService()
+
+    def get_charts_data(
+        self, chart_ids: Iterable[int], start_date=None, end_date=None
+    ) -> Dict[int, Dict[str, Any]]:
+        service = self.calculation_service
+        requested_start, requested_end = start_date, end_date
+        # One end for every chart; the start follows each chart's display window
+        end_date = service.resolve_window(start_date, end_date)[1]
+        configs = ChartConfig.objects.select_related("data_source").in_bulk(
+            list(chart_ids)
+        )
+        windows = {
+            config.pk: service.chart_window(config, requested_start, end_date)
+            for config in configs.values()
+        }
+        results = {
+            chart_id: {"error": "Chart configuration not found"}
+            for chart_id in chart_ids
+            if chart_id not in configs
+        }
+
+        keys = {}
+        groups = defaultdict(list)
+        singles = []
+        for config in configs.values():
+            # Keyed on the requested window, like single-chart requests
+            keys[config.pk] = result_cache.key(config, requested_start, requested_end)
+            cached = result_cache.get(keys[config.pk])
+            if cached is not None:
+                results[config.pk] = cached
+            elif config.cache_measurements or (
+                config.aggregation_pushdown and service.supports_pushdown(config)
+            ):
+                # Fetching buckets alone beats sharing the raw rows
+                singles.append(config)
+            else:
+                groups[(batch_key(config), windows[config.pk])].append(config)
+        for key in [key for key, group in groups.items() if len(group) == 1]:
+            singles.extend(groups.pop(key))
+
+        with ThreadPoolExecutor(max_workers=get_batch_settings()["WORKERS"]) as pool:
+            fetches = {
+                pool.submit(self._call, self.fetch_group, group, *window): group
+                for (_, window), group in groups.items()
+            }
+            computes = {
+                config.pk: pool.submit(
+                    self._call,
+                    service.compute_chart_data,
+                    config,
+                    *windows[config.pk],
+                )
+                for config in singles
+            }
+            for future, group in fetches.items():
+                try:
+                    fetched = future.result()
+                except Exception as e:
+                    # Not cached: the next request queries the source again
+                    logger.exception(
+                        f"Batch query failed for charts {[c.pk for c in group]}"
+                    )
+                    for config in group:
+                        results[config.pk] = {"error": str(e)}
+                    continue
+                for config, df in fetched:
+                    computes[config.pk] = pool.submit(
+                        self._call,
+                        service.compute_chart_data,
+                        config,
+                        *windows[config.pk],
+                        df,
+                    )
+            for chart_id, future in computes.items():
+                try:
+                    results[chart_id] = future.result()
+                    result_cache.set(keys[chart_id], results[chart_id])
+                except Exception as e:
+                    # One broken chart shouldn't fail the whole dashboard
+                    logger.exception(f"Batch computation failed for chart {chart_id}")
+                    results[chart_id] = {"error": str(e)}
+
+        return results
+
+    def fetch_group(self, configs: List[ChartConfig], start_date, end_date):
+        """
+        Fetches the window for a group of charts with one query and returns
+        [(config, raw rows)]. The source caps every chart at its newest
+        SPC_MAX_ROWS rows, as the single-chart query would, and the rows are
+        streamed and decoded chunk by chunk into each chart's typed arrays.
+        The pair tag needs a cursor, so COPY extraction isn't used here.
+        """
+        service = self.calculation_service
+        max_rows = getattr(settings, "SPC_MAX_ROWS", 100000)
+        query, params = service.build_batch_query(
+            configs, start_date, end_date, max_rows
+        )
+        pairs = chart_pairs(configs)
+        parts = [ChunkAggregator(configs[0], keep_rows=True) for _ in pairs]
+        for _, rows in service.ds_service.fetch_rows(
+            configs[0].data_source, query, params
+        ):
+            chunk = decode_series(rows)
+            pair_ids = np.fromiter(
+                (row[2] for row in rows), dtype=np.int64, count=len(rows)
+            )
+            for pair_id, part in chunk.groupby(pair_ids, sort=False):
+                parts[pair_id].add(part)
+
+        pair_ids = {pair: i for i, pair in enumerate(pairs)}
+        return [
+            (
+                config,
+                # Same as fetch_raw: oldest first, non-numeric values dropped
+                parts[
+                    pair_ids[(config.product_identifier, config.operation_identifier)]
+                ].frame(reverse=True),
+            )
+            for config in configs
+        ]
+
+    @staticmethod
+    def _call(func, *args):
+        try:
+            return func(*args)
+        finally:
+            # Worker threads don't get the request_finished cleanup
+            close_old_connections()
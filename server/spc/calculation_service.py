@@ -1,126 +1,629 @@
+import logging
 import pandas as pd
 import numpy as np
-from typing import Dict, Any, List
-from .models import ChartConfig, DataSource
+from datetime import timedelta
+from typing import Dict, Any, List, Optional
+from django.conf import settings
+from django.utils import timezone
+from .models import ChartConfig, ControlLimitBaseline, DataSource
 from .services import DataSourceService
+from .control_limits import individuals_limits, subgroup_limits
+from .moments import (
+    BUCKET_ORIGIN,
+    BucketStatistics,
+    RunningMoments,
+    bucket_width,
+    moments_frame,
+)
+from .query_builder import TIME_BUCKETS, ChartQuery, QueryBuildError
+from .pipeline import ChunkAggregator
+from .result_cache import result_cache
+from .rollups import RollupPyramid
+from . import instrumentation, weco
+
+logger = logging.getLogger(__name__)
+
+AGGREGATE_COLUMNS = ["mean", "std", "count", "min", "max"]
+
+PUSHDOWN_TYPES = [*TIME_BUCKETS, "COUNT"]
 
 
 class CalculationService:
-    def __init__(self):
-        self.ds_service = DataSourceService()
+    def __init__(self, query_timeout: float = None):
+        self.ds_service = DataSourceService(query_timeout=query_timeout)
 
     def get_chart_data(
-        self, chart_id: int, start_date=None, end_date=None
+        self,
+        chart_id: int,
+        start_date=None,
+        end_date=None,
+        points: int = None,
+        resolution: str = None,
     ) -> Dict[str, Any]:
+        """
+        Cached payload of a chart. `resolution` plots a cached chart from its
+        rollups (see rollup_resolution) instead of its own series.
+        """
         try:
-            config = ChartConfig.objects.get(id=chart_id)
+            config = ChartConfig.objects.select_related("data_source").get(id=chart_id)
         except ChartConfig.DoesNotExist:
             return {"error": "Chart configuration not found"}
+        resolution = self.rollup_resolution(
+            config, start_date, end_date, points, resolution
+        )
+        if resolution is not None:
+            return result_cache.get_or_compute(
+                config,
+                start_date,
+                end_date,
+                lambda: self.compute_rollup_data(
+                    config, resolution, start_date, end_date
+                ),
+                resolution=resolution,
+            )
+        return result_cache.get_or_compute(
+            config,
+            start_date,
+            end_date,
+            lambda: self.compute_chart_data(config, start_date, end_date),
+        )
 
+    def rollup_resolution(
+        self,
+        config: ChartConfig,
+        start_date=None,
+        end_date=None,
+        points: int = None,
+        resolution: str = None,
+    ) -> Optional[str]:
+        """
+        The rollup resolution to serve the window at, or None for the chart's
+        own series. "auto" picks one for the point budget when the chart's
+        own series wouldn't fit in it. Only cached charts keep rollups.
+        """
+        if not config.cache_measurements or resolution is None:
+            return None
+        if resolution != "auto":
+            return resolution
+        if not points:
+            return None
+        start_date, end_date = self.chart_window(config, start_date, end_date)
+        return RollupPyramid().choose(config, start_date, end_date, points)
+
+    def compute_chart_data(
+        self,
+        config: ChartConfig,
+        start_date=None,
+        end_date=None,
+        df=None,
+        frozen: bool = True,
+    ) -> Dict[str, Any]:
+        """
+        Chart payload for a loaded config. `df` is the chart's raw rows for
+        the window when the caller already fetched them (batch requests);
+        otherwise they are fetched here. The points are returned as a
+        DataFrame under "data"; spc.renderers serializes them. Control
+        limits come from the chart's active baseline when it has one, unless
+        `frozen` is False.
+        """
         # 1. Construct Query
-        # Handle Date filters if provided
-        date_filter = ""
-        if start_date and end_date:
-            pass  # TODO: Add date filtering logic based on engine syntax (MSSQL vs Postgres)
+        # Resolve the date window; never pull unbounded history
+        start_date, end_date = self.chart_window(config, start_date, end_date)
+        max_rows = getattr(settings, "SPC_MAX_ROWS", 100000)
+        window = {
+            "start": start_date,
+            "end": end_date,
+            "row_limit": max_rows,
+            "truncated": False,
+            # Cached rows served while the source can't be synced; such
+            # payloads are not kept in the result cache
+            "stale": False,
+        }
 
-        # Basic query construction
-        # IMPORTANT: This is prone to SQL injection if fields are not sanitized.
-        # In a real app, rely on parametrized queries or strict validation of column names.
-        # Here we assume Admin (who sets up ChartConfig) is trusted.
+        # 2. Fetch Data
+        # Let the source database do the bucketing when it can, otherwise pull
+        # raw rows and aggregate in pandas.
+        grouped = None
+        if df is None:
+            if config.cache_measurements:
+                grouped, df, window["stale"] = self.fetch_cached(
+                    config, start_date, end_date, max_rows
+                )
+            elif config.aggregation_pushdown and self.supports_pushdown(config):
+                grouped = self.fetch_aggregated(config, start_date, end_date, max_rows)
+        window["cached"] = config.cache_measurements
+        window["pushdown"] = grouped is not None and not config.cache_measurements
 
-        query = f"""
-            SELECT {config.datetime_column} as timestamp, {config.value_column} as value
-            FROM {config.table_name}
-            WHERE {config.product_column} = '{config.product_identifier}'
-            AND {config.operation_column} = '{config.operation_identifier}'
+        if grouped is not None:
+            if config.aggregation_type == "COUNT":
+                window["truncated"] = grouped["count"].sum() >= max_rows
+            else:
+                window["truncated"] = len(grouped) >= max_rows
+            if grouped.empty:
+                return {"data": [], "statistics": {}, "window": window}
+            chart_data = grouped
+            with instrumentation.span("statistics"):
+                stats = self.grouped_statistics(config, grouped)
+        else:
+            if df is None:
+                # Streamed in chunks; time-bucketed charts are aggregated as
+                # the chunks arrive instead of holding every row
+                chunks = ChunkAggregator(config).extend(
+                    self.fetch_chunks(config, start_date, end_date, max_rows)
+                )
+                fetched = chunks.rows
+                with instrumentation.span("aggregate"):
+                    grouped = chunks.grouped()
+                    # Rows come back newest first because of the row cap
+                    df = chunks.frame(reverse=True)
+            else:
+                fetched = len(df)
+            window["truncated"] = fetched >= max_rows
+            if df.empty and (grouped is None or grouped.empty):
+                return {"data": [], "statistics": {}, "window": window}
+
+            # 3. Aggregate Data
+            # Default aggregation: Hourly mean/range? Or just raw points?
+            # User requested: "aggregation should be allowed by time such as hour or week, or also could be by number of part"
+            if grouped is None:
+                with instrumentation.span("aggregate"):
+                    grouped = self.aggregate(config, df)
+            with instrumentation.span("statistics"):
+                if grouped is not None:
+                    chart_data = grouped
+                    stats = self.grouped_statistics(config, grouped)
+                else:
+                    # Raw data
+                    chart_data = df
+                    stats = self.series_statistics(df["value"])
+
+        # 4. Calculate Statistics (Cpk, etc)
+        if config.cache_measurements and config.aggregation_type not in TIME_BUCKETS:
+            # Raw-value statistics over the whole window, merged from the
+            # persisted bucket moments rather than recomputed from the rows
+            with instrumentation.span("statistics"):
+                stats = (
+                    BucketStatistics()
+                    .window_moments(config, start_date, end_date)
+                    .as_statistics()
+                )
+        # Plotted series: subgroup means, or raw values
+        plotted = grouped["mean"] if grouped is not None else df["value"]
+        baseline = self.active_baseline(config) if frozen else None
+        return self.build_payload(config, chart_data, stats, plotted, window, baseline)
+
+    def compute_rollup_data(
+        self, config: ChartConfig, resolution: str, start_date=None, end_date=None
+    ) -> Dict[str, Any]:
+        """
+        Chart payload of a cached chart plotted from its rollups: one X̄
+        subgroup per bucket at `resolution`, with statistics over every
+        measurement in the window (not capped by SPC_MAX_ROWS). A frozen
+        baseline belongs to the chart's own subgrouping, so the limits are
+        estimated from the buckets.
+        """
+        start_date, end_date = self.chart_window(config, start_date, end_date)
+        window = {
+            "start": start_date,
+            "end": end_date,
+            "row_limit": None,
+            "truncated": False,
+            "cached": True,
+            "pushdown": False,
+            "resolution": resolution,
+        }
+        cache, window["stale"] = self.sync_cached(config, start_date, end_date)
+        with instrumentation.span("aggregate"):
+            moments = cache.rollups.window(config, resolution, start_date, end_date)
+        if not moments:
+            return {"data": [], "statistics": {}, "window": window}
+
+        grouped = moments_frame(moments)
+        with instrumentation.span("statistics"):
+            stats = RunningMoments.merge_all(moments.values()).as_statistics()
+        return self.build_payload(config, grouped, stats, grouped["mean"], window)
+
+    def build_payload(
+        self,
+        config: ChartConfig,
+        chart_data,
+        stats,
+        plotted,
+        window,
+        baseline: Optional[ControlLimitBaseline] = None,
+    ) -> Dict[str, Any]:
         """
+        Adds control limits, capability indices and WECO rule violations of
+        the plotted series to computed statistics and assembles the chart
+        payload. With a baseline, its frozen limits are applied and the
+        rules are evaluated against its centre and spread.
+        """
+        with instrumentation.span("limits"):
+            chart_data, limits = self.control_limits(chart_data, baseline)
+        with instrumentation.span("statistics"):
+            stats.update(self.limits_capability(config, stats, limits))
 
-        # 2. Fetch Data
-        df = self.ds_service.get_data(config.data_source, query)
-
-        if df.empty:
-            return {"data": [], "statistics": {}}
-
-        # Ensure types
-        df["value"] = pd.to_numeric(df["value"], errors="coerce")
-        df = df.dropna(subset=["value"])
-        # Sort by timestamp? df = df.sort_values(by='timestamp')
-
-        # 3. Aggregate Data
-        # Default aggregation: Hourly mean/range? Or just raw points?
-        # User requested: "aggregation should be allowed by time such as hour or week, or also could be by number of part"
-
-        if config.aggregation_type == "TIME_HOUR":
-            # Need to ensure timestamp is datetime
-            df["timestamp"] = pd.to_datetime(df["timestamp"])
-            df.set_index("timestamp", inplace=True)
-            grouped = df.resample("1h")["value"].agg(
-                ["mean", "std", "count", "min", "max"]
+        # 5. WECO Rules
+        center, sigma = self.rule_zones(chart_data, limits)
+        with instrumentation.span("rules"):
+            rules = weco.resolve_rules(config.weco_rules)
+            violations = {
+                rule: indices.tolist()
+                for rule, indices in weco.evaluate(
+                    plotted, center, sigma, rules
+                ).items()
+            }
+
+        return {
+            "config": {
+                "usl": config.upper_spec_limit,
+                "lsl": config.lower_spec_limit,
+                "target": config.target,
+            },
+            "data": chart_data,
+            "statistics": stats,
+            "limits": limits,
+            "violations": violations,
+            "rules": weco.describe(rules),
+            "window": window,
+        }
+
+    @staticmethod
+    def resolve_window(start_date=None, end_date=None, days: int = None):
+        """
+        Fills in a missing end (now) and start (end - `days`, by default
+        SPC_DEFAULT_LOOKBACK_DAYS).
+        Returned datetimes are naive in the server's time zone since source
+        databases store plain DATETIME / timestamp without time zone columns.
+        """
+        if end_date is None:
+            end_date = timezone.now()
+        if start_date is None:
+            lookback = days or getattr(settings, "SPC_DEFAULT_LOOKBACK_DAYS", 30)
+            start_date = end_date - timedelta(days=lookback)
+
+        if timezone.is_aware(start_date):
+            start_date = timezone.make_naive(start_date)
+        if timezone.is_aware(end_date):
+            end_date = timezone.make_naive(end_date)
+        return start_date, end_date
+
+    @classmethod
+    def chart_window(cls, config: ChartConfig, start_date=None, end_date=None):
+        """
+        resolve_window with the chart's own display window by default
+        """
+        return cls.resolve_window(start_date, end_date, config.display_days)
+
+    @staticmethod
+    def active_baseline(config: ChartConfig) -> Optional[ControlLimitBaseline]:
+        """
+        The chart's active control limit baseline, if it was computed for the
+        chart's current subgrouping. Unsaved charts (benchmarks) have none.
+        """
+        if config.pk is None:
+            return None
+        return config.baselines.filter(
+            is_active=True,
+            aggregation_type=config.aggregation_type,
+            aggregation_size=config.aggregation_size,
+        ).first()
+
+    def fetch_raw(
+        self, config: ChartConfig, start_date, end_date, max_rows: int
+    ) -> pd.DataFrame:
+        """
+        Fetches the newest max_rows measurements in the window as a
+        (timestamp, value) DataFrame sorted oldest first, with non-numeric
+        values dropped.
+        """
+        chunks = ChunkAggregator(config, keep_rows=True).extend(
+            self.fetch_chunks(config, start_date, end_date, max_rows)
+        )
+        # Rows come back newest first because of the row cap
+        return chunks.frame(reverse=True)
+
+    def fetch_chunks(self, config: ChartConfig, start_date, end_date, max_rows: int):
+        """
+        Yields the newest max_rows measurements in the window, newest first,
+        as typed chunks of SPC_FETCH_CHUNK_SIZE rows. Errors are logged and
+        raised, so a failed fetch is never computed (and cached) as a chart
+        with missing rows.
+        """
+        query, params = self.build_query(config, start_date, end_date, max_rows)
+        try:
+            yield from self.ds_service.stream_series(config.data_source, query, params)
+        except Exception:
+            logger.exception(f"Fetching data for chart {config.pk} failed")
+            raise
+
+    def fetch_cached(self, config: ChartConfig, start_date, end_date, max_rows: int):
+        """
+        Syncs the chart's local measurement cache with the source (fetching
+        only rows past the watermark) and reads the window from it. If the
+        source is unreachable the cached rows are still served, flagged stale.
+
+        Returns (grouped, None, stale) for time-bucketed charts, built from
+        the persisted bucket statistics, and (None, raw rows, stale)
+        otherwise.
+        """
+        cache, stale = self.sync_cached(config, start_date, end_date)
+        if config.aggregation_type in TIME_BUCKETS:
+            grouped = cache.buckets.window_buckets(config, start_date, end_date)
+            return grouped, None, stale
+        rows = cache.get_measurements(config, start_date, end_date, max_rows)
+        return None, rows, stale
+
+    def sync_cached(self, config: ChartConfig, start_date, end_date):
+        """
+        Syncs the chart's local measurement cache for the window and returns
+        (MeasurementCacheService, stale). Sync failures are logged, not
+        raised; stale is True when the window may miss source rows, as when
+        another sync (e.g. a long backfill) keeps the chart busy.
+        """
+        from .measurement_cache import MeasurementCacheService, SyncBusy
+
+        cache = MeasurementCacheService(self.ds_service)
+        try:
+            cache.sync(config, start_date, end_date)
+        except SyncBusy as e:
+            logger.info(f"{e}, serving cached rows")
+            return cache, True
+        except Exception as e:
+            logger.warning(f"Measurement cache sync failed for chart {config.pk}: {e}")
+            return cache, True
+        return cache, False
+
+    def fetch_aggregated(
+        self, config: ChartConfig, start_date, end_date, max_rows: int
+    ) -> Optional[pd.DataFrame]:
+        """
+        Runs the bucketed aggregate query on the source. Returns None when the
+        source can't run it (old server version, non-numeric value column, ...)
+        so the caller can fall back to aggregating raw rows in pandas.
+        """
+        try:
+            query, params = self.build_aggregate_query(
+                config, start_date, end_date, max_rows
             )
-            # Reset index to string for JSON
-            grouped.reset_index(inplace=True)
+            grouped = self.ds_service.query(config.data_source, query, params)
+        except Exception as e:
+            logger.warning(
+                f"Aggregate pushdown failed for chart {config.pk}, falling back to pandas: {e}"
+            )
+            return None
+
+        if grouped.empty:
+            return grouped
 
-            # Calculate Range (Max - Min) for R chart?
-            grouped["range"] = grouped["max"] - grouped["min"]
+        with instrumentation.span("decode"):
+            for column in AGGREGATE_COLUMNS:
+                grouped[column] = pd.to_numeric(grouped[column], errors="coerce")
+            grouped["timestamp"] = pd.to_datetime(grouped["timestamp"])
+        # Buckets come back newest first because of the row cap
+        grouped = grouped.iloc[::-1].reset_index(drop=True)
+        grouped["range"] = grouped["max"] - grouped["min"]
+        return grouped
+
+    @staticmethod
+    def aggregate(config: ChartConfig, df: pd.DataFrame) -> Optional[pd.DataFrame]:
+        """
+        Pandas equivalent of the pushdown queries. Returns None for charts that
+        plot raw points.
+        """
+        n = max(config.aggregation_size, 1)
 
-            chart_data = grouped.to_dict(orient="records")
-            stats_series = grouped[
-                "mean"
-            ]  # Calculate global stats on the aggregated means? Or raw? usually Raw for Cpk.
+        if config.aggregation_type in TIME_BUCKETS:
+            # A fixed width (72h rather than 3D): resample ignores the origin
+            # of calendar day frequencies, the pushdown queries count buckets
+            # from BUCKET_ORIGIN
+            df = df.assign(timestamp=pd.to_datetime(df["timestamp"]))
+            df = df.set_index("timestamp")
+            grouped = df.resample(
+                bucket_width(config), origin=pd.Timestamp(BUCKET_ORIGIN)
+            )["value"].agg(AGGREGATE_COLUMNS)
+            # Empty buckets are not returned by the SQL GROUP BY either
+            grouped = grouped[grouped["count"] > 0]
+            grouped = grouped.reset_index()
 
         elif config.aggregation_type == "COUNT":
             # Group by every N records
-            n = config.aggregation_size
-            df["group_id"] = np.arange(len(df)) // n
-            grouped = df.groupby("group_id")["value"].agg(
-                ["mean", "std", "count", "min", "max"]
+            group_id = np.arange(len(df)) // n
+            grouped = df.groupby(group_id)["value"].agg(AGGREGATE_COLUMNS)
+            # Pseudo timestamp: first timestamp of the group
+            grouped.insert(
+                0,
+                "timestamp",
+                pd.to_datetime(df.groupby(group_id)["timestamp"].first()),
             )
-            grouped["range"] = grouped["max"] - grouped["min"]
+            grouped = grouped.reset_index(drop=True)
 
-            # Add a pseudo timestamp (first timestamp of the group)
-            # df.groupby('group_id')['timestamp'].first() ...
+        else:
+            return None
 
-            chart_data = grouped.to_dict(orient="records")
-            stats_series = df["value"]  # Use raw data for Cpk
+        # Calculate Range (Max - Min) for R chart
+        grouped["range"] = grouped["max"] - grouped["min"]
+        return grouped
 
-        else:
-            # Raw data
-            chart_data = df.to_dict(orient="records")
-            stats_series = df["value"]
+    @staticmethod
+    def series_statistics(series: pd.Series) -> Dict[str, Any]:
+        return {
+            "mean": series.mean(),
+            "std_dev": series.std(),
+            "min": series.min(),
+            "max": series.max(),
+            "count": len(series),
+        }
 
-        # 4. Calculate Statistics (Cpk, etc)
-        mu = stats_series.mean()
-        sigma = stats_series.std()
+    @classmethod
+    def grouped_statistics(
+        cls, config: ChartConfig, grouped: pd.DataFrame
+    ) -> Dict[str, Any]:
+        """
+        Global statistics from per-bucket aggregates. Time-bucketed charts
+        describe the series of bucket means; COUNT charts describe the raw
+        measurements, recovered exactly by pooling the bucket moments.
+        """
+        if config.aggregation_type in TIME_BUCKETS:
+            return cls.series_statistics(grouped["mean"])
 
-        stats = {
+        count = grouped["count"].to_numpy(dtype=float)
+        mean = grouped["mean"].to_numpy(dtype=float)
+        std = np.nan_to_num(grouped["std"].to_numpy(dtype=float))
+        total = count.sum()
+        mu = (count * mean).sum() / total
+        # Within-bucket plus between-bucket sum of squares
+        m2 = ((count - 1) * std**2).sum() + (count * (mean - mu) ** 2).sum()
+        return {
             "mean": mu,
-            "std_dev": sigma,
-            "min": stats_series.min(),
-            "max": stats_series.max(),
-            "count": len(stats_series),
+            "std_dev": np.sqrt(m2 / (total - 1)) if total > 1 else np.nan,
+            "min": grouped["min"].min(),
+            "max": grouped["max"].max(),
+            "count": int(total),
         }
 
-        # Capability Indices (requires specs)
-        if config.upper_spec_limit is not None and config.lower_spec_limit is not None:
-            usl = config.upper_spec_limit
-            lsl = config.lower_spec_limit
-
-            cp = (usl - lsl) / (6 * sigma) if sigma > 0 else 0
-            cpu = (usl - mu) / (3 * sigma) if sigma > 0 else 0
-            cpl = (mu - lsl) / (3 * sigma) if sigma > 0 else 0
-            cpk = min(cpu, cpl)
+    @staticmethod
+    def control_limits(
+        chart_data: pd.DataFrame, baseline: Optional[ControlLimitBaseline] = None
+    ):
+        """
+        Control limits of the chart's series (see control_limits.py). Returns
+        the chart data with the per-subgroup X̄-R / X̄-S limit columns, or the
+        moving range column for raw points, and the limits summary.
 
-            stats.update({"Cp": cp, "Cpk": cpk, "Cpu": cpu, "Cpl": cpl})
+        With a baseline the summary holds its frozen limits, the baseline
+        under "baseline" and the window's own estimates under "window".
+        """
+        frozen = baseline.limits if baseline is not None else None
+        if "count" in chart_data:
+            columns, summary = subgroup_limits(chart_data, frozen)
+            chart_data = chart_data.assign(**columns)
+            limits = {"chart": "xbar", **summary}
+        else:
+            moving_range, summary = individuals_limits(chart_data["value"])
+            chart_data = chart_data.assign(moving_range=moving_range)
+            limits = {"chart": "i_mr", **summary}
+        if frozen is not None:
+            limits = {
+                **frozen,
+                "chart": limits["chart"],
+                "baseline": {
+                    "version": baseline.version,
+                    "start": baseline.start,
+                    "end": baseline.end,
+                    "computed_at": baseline.computed_at,
+                },
+                "window": summary,
+            }
+        return chart_data, limits
 
-        # 5. WECO Rules (Placeholder)
-        # TODO: Implement rule checking on the 'chart_data' means
+    @staticmethod
+    def rule_zones(chart_data: pd.DataFrame, limits: Dict[str, Any]):
+        """
+        Centre line and sigma the WECO zones are drawn with, from the control
+        limits (frozen, with a baseline): the within sigma over the square
+        root of each subgroup's size for X̄ charts, MR̄ / d2 for I-MR. The
+        overall sigma stands in when the subgroups have no spread.
+        """
+        sigma = limits.get("sigma_within")
+        if sigma is None or not sigma > 0:
+            sigma = limits.get("sigma_overall")
+        if sigma is not None and limits["chart"] == "xbar":
+            sigma = sigma / np.sqrt(chart_data["count"].to_numpy(dtype=np.float64))
+        return limits["center"], sigma
 
+    @classmethod
+    def limits_capability(
+        cls, config: ChartConfig, stats: Dict[str, Any], limits: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """
+        Cp / Cpk from the within-subgroup sigma of the limits (frozen, with a
+        baseline) and Pp / Ppk from the window's overall sigma.
+        Time-bucketed statistics describe the bucket means, so subgroup
+        charts take the process mean and overall sigma from the limits' own
+        estimates; raw charts from the statistics.
+        """
+        mu, overall = stats["mean"], stats["std_dev"]
+        if limits["chart"] == "xbar":
+            estimates = limits.get("window", limits)
+            mu, overall = estimates["center"], estimates["sigma_overall"]
+        within = limits["sigma_within"]
+        if within is None or not within > 0:
+            # No subgroup spread to estimate it from
+            within = overall
         return {
-            "config": {
-                "usl": config.upper_spec_limit,
-                "lsl": config.lower_spec_limit,
-                "target": config.target,
-            },
-            "data": chart_data,
-            "statistics": stats,
+            "sigma_within": within,
+            "sigma_overall": overall,
+            **cls.capability(config, mu, within, overall),
         }
+
+    @staticmethod
+    def capability(
+        config: ChartConfig, mu, sigma, overall_sigma=None
+    ) -> Dict[str, Any]:
+        """
+        Capability indices Cp / Cpk (with the within-subgroup sigma) and,
+        given the overall sigma, performance indices Pp / Ppk. Requires both
+        spec limits.
+        """
+        if config.upper_spec_limit is None or config.lower_spec_limit is None:
+            return {}
+
+        usl = config.upper_spec_limit
+        lsl = config.lower_spec_limit
+
+        def indices(prefix, sigma):
+            spread = (usl - lsl) / (6 * sigma) if sigma > 0 else 0
+            upper = (usl - mu) / (3 * sigma) if sigma > 0 else 0
+            lower = (mu - lsl) / (3 * sigma) if sigma > 0 else 0
+            return {
+                f"{prefix}p": spread,
+                f"{prefix}pk": min(upper, lower),
+                f"{prefix}pu": upper,
+                f"{prefix}pl": lower,
+            }
+
+        result = indices("C", sigma)
+        if overall_sigma is not None:
+            result.update(indices("P", overall_sigma))
+        return result
+
+    @staticmethod
+    def supports_pushdown(config: ChartConfig) -> bool:
+        return config.aggregation_type in PUSHDOWN_TYPES
+
+    @staticmethod
+    def build_query(
+        config: ChartConfig,
+        start_date,
+        end_date,
+        max_rows: int,
+        ascending: bool = False,
+        exclusive_start: bool = False,
+    ):
+        """
+        Returns (sql, params) selecting the newest max_rows measurements inside
+        the window (the oldest ones when ascending, for incremental syncs).
+        See spc.query_builder.
+        """
+        return ChartQuery(config).raw(
+            start_date, end_date, max_rows, ascending, exclusive_start
+        )
+
+    @staticmethod
+    def build_batch_query(
+        configs: List[ChartConfig], start_date, end_date, max_rows: int
+    ):
+        """
+        Like build_query, for charts reading the same table and columns with
+        different product / operation identifiers
+        """
+        return ChartQuery(configs[0]).batch(configs, start_date, end_date, max_rows)
+
+    @staticmethod
+    def build_aggregate_query(config: ChartConfig, start_date, end_date, max_rows: int):
+        """
+        Returns (sql, params) producing one row per bucket with the columns
+        timestamp, mean, std, count, min, max, newest bucket first
+        """
+        return ChartQuery(config).aggregate(start_date, end_date, max_rows)
@@ -0,0 +1,271 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SETTINGS = {
+    "MAX_SIZE": 5,  # Max open connections per DataSource (idle + checked out)
+    "IDLE_TIMEOUT": 300,  # Seconds an idle connection may sit before being recycled
+    "CHECKOUT_TIMEOUT": 30,  # Seconds to wait for a free connection before giving up
+    "CONNECT_TIMEOUT": 5,  # Seconds passed to the driver's connect()
+}
+
+
+def get_pool_settings() -> Dict[str, Any]:
+    """
+    Pool settings, overridable through settings.SPC_CONNECTION_POOL
+    """
+    return {**DEFAULT_POOL_SETTINGS, **getattr(settings, "SPC_CONNECTION_POOL", {})}
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PoolStats:
+    """
+    Counters for a single pool. Hits are checkouts served by an idle connection,
+    misses are checkouts that had to open a new one, waits are checkouts that
+    blocked because the pool was at MAX_SIZE.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.timeouts = 0
+        self.health_check_failures = 0
+        self.idle_expired = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        checkouts = self.hits + self.misses
+        return {
+            "checkouts": checkouts,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / checkouts if checkouts else 0.0,
+            "waits": self.waits,
+            "wait_time_total": self.wait_time_total,
+            "wait_time_max": self.wait_time_max,
+            "wait_time_avg": self.wait_time_total / self.waits if self.waits else 0.0,
+            "timeouts": self.timeouts,
+            "health_check_failures": self.health_check_failures,
+            "idle_expired": self.idle_expired,
+        }
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of DBAPI connections for one DataSource.
+    Idle connections are recycled after idle_timeout and health-checked
+    (SELECT 1) on checkout before being handed out.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Any],
+        max_size: int = 5,
+        idle_timeout: float = 300,
+        checkout_timeout: float = 30,
+        fingerprint: Any = None,
+    ):
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.fingerprint = fingerprint
+        self.stats = PoolStats()
+
+        self._idle: List[tuple] = []  # (connection, released_at) - LIFO
+        self._in_use = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    @property
+    def size(self) -> int:
+        return len(self._idle) + self._in_use
+
+    def acquire(self):
+        waited = 0.0
+        while True:
+            conn, expired = None, []
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolTimeout("Connection pool has been closed")
+
+                    while self._idle:
+                        conn, released_at = self._idle.pop()
+                        if time.monotonic() - released_at <= self.idle_timeout:
+                            break
+                        self.stats.idle_expired += 1
+                        expired.append(conn)
+                        conn = None
+
+                    if conn is not None or self.size < self.max_size:
+                        # Reserve the slot; connecting, health checks and
+                        # closing happen outside the lock so a slow source
+                        # doesn't block the pool's other callers
+                        self._in_use += 1
+                        if conn is None:
+                            self.stats.misses += 1
+                            self._record_wait(waited)
+                        break
+
+                    remaining = self.checkout_timeout - waited
+                    if remaining <= 0:
+                        self.stats.timeouts += 1
+                        self._record_wait(waited)
+                        raise PoolTimeout(
+                            f"Timed out after {self.checkout_timeout}s waiting for a connection"
+                        )
+                    started = time.monotonic()
+                    self._cond.wait(remaining)
+                    waited += time.monotonic() - started
+
+            for stale in expired:
+                self._close_quietly(stale)
+
+            if conn is None:
+                try:
+                    return self.factory()
+                except Exception:
+                    self._free_slot()
+                    raise
+
+            if self._is_healthy(conn):
+                with self._cond:
+                    self.stats.hits += 1
+                    self._record_wait(waited)
+                return conn
+            self._close_quietly(conn)
+            with self._cond:
+                self.stats.health_check_failures += 1
+            self._free_slot()
+
+    def release(self, conn, discard: bool = False):
+        if not discard:
+            try:
+                # Don't hand the next caller an open transaction / snapshot
+                conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard or self._closed:
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+        except Exception:
+            # The connection may be in an unknown state, don't reuse it
+            discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "max_size": self.max_size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                **self.stats.as_dict(),
+            }
+
+    def _free_slot(self):
+        with self._cond:
+            self._in_use -= 1
+            self._cond.notify()
+
+    def _record_wait(self, waited: float):
+        if waited > 0:
+            self.stats.waits += 1
+            self.stats.wait_time_total += waited
+            self.stats.wait_time_max = max(self.stats.wait_time_max, waited)
+
+    @staticmethod
+    def _is_healthy(conn) -> bool:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_pools: Dict[int, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(source, factory: Callable[[], Any]) -> ConnectionPool:
+    """
+    Returns the shared pool for a DataSource, creating it on first use.
+    The pool is rebuilt when the source's updated_at changes so that edits
+    made in another process are picked up as well.
+    """
+    fingerprint = source.updated_at
+    stale: Optional[ConnectionPool] = None
+    with _pools_lock:
+        pool = _pools.get(source.pk)
+        if pool is None or pool.fingerprint != fingerprint:
+            stale = pool
+            conf = get_pool_settings()
+            pool = ConnectionPool(
+                factory,
+                max_size=conf["MAX_SIZE"],
+                idle_timeout=conf["IDLE_TIMEOUT"],
+                checkout_timeout=conf["CHECKOUT_TIMEOUT"],
+                fingerprint=fingerprint,
+            )
+            _pools[source.pk] = pool
+    if stale is not None:
+        stale.close()
+    return pool
+
+
+def invalidate_pool(source_id: int):
+    with _pools_lock:
+        pool = _pools.pop(source_id, None)
+    if pool is not None:
+        logger.info(f"Closing connection pool for DataSource {source_id}")
+        pool.close()
+
+
+def pool_stats() -> Dict[int, Dict[str, Any]]:
+    with _pools_lock:
+        pools = dict(_pools)
+    return {source_id: pool.as_dict() for source_id, pool in pools.items()}
@@ -0,0 +1,164 @@
+import math
+from typing import Any, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Shewhart control limits (3 sigma) computed from a chart's series in one
+# vectorized pass: X̄-R and X̄-S from per-subgroup aggregates (count, mean,
+# std, range), I-MR from raw values. Subgroup sizes may vary (time buckets,
+# the last COUNT subgroup), so the constants are looked up per subgroup and
+# the X̄, R and S limits are per-subgroup arrays.
+
+# d2 (mean) and d3 (standard deviation) of the relative range W = R / sigma
+# of n normal observations, indexed by n. Range charts aren't used above 25;
+# larger subgroups only get X̄-S limits.
+D2 = np.array(
+    [np.nan, np.nan, 1.128, 1.693, 2.059, 2.326, 2.534, 2.704, 2.847, 2.970]
+    + [3.078, 3.173, 3.258, 3.336, 3.407, 3.472, 3.532, 3.588, 3.640, 3.689]
+    + [3.735, 3.778, 3.819, 3.858, 3.895, 3.931]
+)
+D3 = np.array(
+    [np.nan, np.nan, 0.853, 0.888, 0.880, 0.864, 0.848, 0.833, 0.820, 0.808]
+    + [0.797, 0.787, 0.778, 0.770, 0.763, 0.756, 0.750, 0.744, 0.739, 0.734]
+    + [0.729, 0.724, 0.720, 0.716, 0.712, 0.708]
+)
+MAX_RANGE_SIZE = len(D2) - 1
+SIGMAS = 3
+
+
+def _c4_exact(k: int) -> float:
+    return math.sqrt(2 / (k - 1)) * math.exp(
+        math.lgamma(k / 2) - math.lgamma((k - 1) / 2)
+    )
+
+
+# Exact c4 below C4_SERIES_FROM, the asymptotic series (error < 1e-8) above
+C4_SERIES_FROM = 64
+C4 = np.array([np.nan, np.nan] + [_c4_exact(k) for k in range(2, C4_SERIES_FROM)])
+
+
+def c4(n) -> np.ndarray:
+    """
+    Bias of the sample standard deviation, E[s] = c4(n) sigma, for an array
+    of subgroup sizes (NaN below 2)
+    """
+    n = np.asarray(n, dtype=np.float64)
+    series = 1 - 1 / (4 * n) - 7 / (32 * n**2) - 19 / (128 * n**3)
+    small = np.clip(n, 0, C4_SERIES_FROM - 1).astype(np.intp)
+    return np.where(n < C4_SERIES_FROM, C4[small], series)
+
+
+def frozen_value(frozen: Dict[str, Any], name: str) -> float:
+    """
+    A value of a stored limits summary, where NaN is saved as null
+    """
+    value = frozen.get(name)
+    return np.nan if value is None else float(value)
+
+
+def subgroup_limits(
+    grouped: pd.DataFrame, frozen: Dict[str, Any] = None
+) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """
+    X̄-R and X̄-S limits of per-subgroup aggregates. Returns the
+    per-subgroup limit columns (xbar_r_ucl, xbar_r_lcl, r_center, r_ucl,
+    r_lcl, xbar_s_ucl, xbar_s_lcl, s_center, s_ucl, s_lcl) and a summary
+    with the grand mean, the within-subgroup sigma estimates and the
+    overall sigma of all the measurements (pooled from the subgroups).
+
+    The X̄-S sigma is the pooled standard deviation corrected by c4; the
+    X̄-R sigma averages R / d2(n) over subgroups of 2 to 25. Subgroups of
+    one measurement have no R / S limits.
+
+    With `frozen`, the summary of a baseline period, the limits use its
+    centre and sigmas; the returned summary still describes `grouped`.
+    """
+    n = grouped["count"].to_numpy(dtype=np.float64)
+    mean = grouped["mean"].to_numpy(dtype=np.float64)
+    std = grouped["std"].to_numpy(dtype=np.float64)
+    spread = grouped["range"].to_numpy(dtype=np.float64)
+
+    total = n.sum()
+    grand = (n * mean).sum() / total if total else np.nan
+    dof = n - 1
+    within = (n >= 2) & np.isfinite(std)
+    ss_within = (dof[within] * std[within] ** 2).sum()
+    pooled_dof = dof[within].sum()
+    if pooled_dof > 0:
+        sigma_s = math.sqrt(ss_within / pooled_dof) / c4(pooled_dof + 1).item()
+    else:
+        sigma_s = np.nan
+    ss_between = (n * (mean - grand) ** 2).sum()
+    sigma_overall = (
+        math.sqrt((ss_within + ss_between) / (total - 1)) if total > 1 else np.nan
+    )
+
+    # Limits only depend on the subgroup size: evaluate them per size, then
+    # gather them for every subgroup
+    sizes = n.astype(np.intp)
+    k = np.arange(sizes.max() + 1, dtype=np.float64)
+    k[0] = 1  # No empty subgroups, keeps the size 0 entry finite
+    d2 = np.full(len(k), np.nan)
+    d3 = np.full(len(k), np.nan)
+    d2[: MAX_RANGE_SIZE + 1] = D2[: len(k)]
+    d3[: MAX_RANGE_SIZE + 1] = D3[: len(k)]
+    ranged = within & (sizes <= MAX_RANGE_SIZE)
+    if ranged.any():
+        sigma_r = (spread[ranged] / d2[sizes[ranged]]).mean()
+    else:
+        sigma_r = np.nan
+
+    summary = {
+        "center": grand,
+        "sigma_r": sigma_r,
+        "sigma_s": sigma_s,
+        "sigma_within": sigma_s,
+        "sigma_overall": sigma_overall,
+    }
+    if frozen is not None:
+        grand, sigma_r, sigma_s = (
+            frozen_value(frozen, name) for name in ("center", "sigma_r", "sigma_s")
+        )
+
+    root_k = np.sqrt(k)
+    c4_k = c4(k)
+    s_spread = np.sqrt(1 - c4_k**2)
+    tables = {
+        "xbar_r_ucl": grand + SIGMAS * sigma_r / root_k,
+        "xbar_r_lcl": grand - SIGMAS * sigma_r / root_k,
+        "r_center": d2 * sigma_r,
+        "r_ucl": (d2 + SIGMAS * d3) * sigma_r,
+        "r_lcl": np.maximum(d2 - SIGMAS * d3, 0) * sigma_r,
+        "xbar_s_ucl": grand + SIGMAS * sigma_s / root_k,
+        "xbar_s_lcl": grand - SIGMAS * sigma_s / root_k,
+        "s_center": c4_k * sigma_s,
+        "s_ucl": (c4_k + SIGMAS * s_spread) * sigma_s,
+        "s_lcl": np.maximum(c4_k - SIGMAS * s_spread, 0) * sigma_s,
+    }
+    columns = {name: table[sizes] for name, table in tables.items()}
+    return columns, summary
+
+
+def individuals_limits(values: pd.Series) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """
+    I-MR limits of raw values. Returns the moving ranges (NaN for the first
+    point) and the limits, with the within sigma estimated as MR̄ / d2(2).
+    """
+    x = values.to_numpy(dtype=np.float64)
+    moving_range = np.empty_like(x)
+    moving_range[:1] = np.nan
+    np.abs(np.diff(x), out=moving_range[1:])
+    mr_bar = np.nanmean(moving_range) if len(x) > 1 else np.nan
+    sigma = mr_bar / D2[2]
+    center = np.nanmean(x) if len(x) else np.nan
+    summary = {
+        "center": center,
+        "ucl": center + SIGMAS * sigma,
+        "lcl": center - SIGMAS * sigma,
+        "mr_center": mr_bar,
+        "mr_ucl": (D2[2] + SIGMAS * D3[2]) * sigma,
+        "mr_lcl": 0.0,
+        "sigma_within": sigma,
+    }
+    return moving_range, summary
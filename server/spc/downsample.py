@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+from typing import Any, Dict
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: indices of `threshold` points (first and
+    last always included) that keep the visual shape of the series. Bucket
+    averages are computed in one pass; only the per-bucket pick, which
+    depends on the previous pick, loops in Python.
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    # Bucket i covers [edges[i], edges[i + 1]) of the inner points
+    edges = np.floor(np.arange(threshold - 1) * every).astype(np.intp) + 1
+    edges[-1] = n - 1
+    sums_x = np.add.reduceat(x[1 : n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1 : n - 1], edges[:-1] - 1)
+    sizes = np.diff(edges)
+    # The last bucket's "next average" is the last point itself
+    avg_x = np.append(sums_x / sizes, x[n - 1])
+    avg_y = np.append(sums_y / sizes, y[n - 1])
+
+    sampled = np.empty(threshold, dtype=np.intp)
+    sampled[0], sampled[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs(
+            (x[a] - avg_x[i + 1]) * (y[lo:hi] - y[a])
+            - (x[a] - x[lo:hi]) * (avg_y[i + 1] - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        sampled[i + 1] = a
+    return sampled
+
+
+def min_max(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Per-bucket minimum and maximum (threshold // 2 buckets of consecutive
+    points, i.e. one bucket per pixel column), plus the first and last point
+    """
+    n = len(y)
+    buckets = threshold // 2
+    if threshold >= n or buckets < 1:
+        return np.arange(n)
+
+    bucket = (np.arange(n) * buckets) // n
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    picked = [np.array([0, n - 1])]
+    for reduce in (np.minimum, np.maximum):
+        extreme = reduce.reduceat(y, starts)
+        # First point of each bucket equal to its extreme
+        hits = np.flatnonzero(y == extreme[bucket])
+        _, first = np.unique(bucket[hits], return_index=True)
+        picked.append(hits[first])
+    return np.unique(np.concatenate(picked))
+
+
+METHODS = {"lttb": lttb, "minmax": min_max}
+
+
+def downsample_payload(
+    payload: Dict[str, Any], points: int, method: str = "lttb"
+) -> Dict[str, Any]:
+    """
+    Reduces a chart payload's plotted points to about `points`. Statistics
+    are left as computed over the full data, and every point flagged by a
+    rule survives the reduction (so the result may exceed the budget by
+    the number of violations). Violation indices are remapped to the
+    reduced series.
+    """
+    df = payload.get("data")
+    if not isinstance(df, pd.DataFrame) or len(df) <= points:
+        return payload
+
+    column = "value" if "value" in df.columns else "mean"
+    x = pd.to_datetime(df["timestamp"]).to_numpy("datetime64[ns]").astype(np.int64)
+    x = (x - x[0]) / 1e9
+    y = df[column].to_numpy(dtype=float)
+    keep = METHODS[method](x, y, points)
+
+    violations = payload.get("violations", {})
+    flagged = [np.asarray(indices, dtype=np.intp) for indices in violations.values()]
+    keep = np.unique(np.concatenate([keep, *flagged]))
+
+    return {
+        **payload,
+        "data": df.iloc[keep].reset_index(drop=True),
+        "violations": {
+            rule: np.searchsorted(keep, indices).tolist()
+            for rule, indices in violations.items()
+        },
+        "window": {
+            **payload.get("window", {}),
+            "downsampled": {"method": method, "points": len(keep), "total": len(df)},
+        },
+    }
@@ -0,0 +1,259 @@
+import io
+import queue
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from django.utils import timezone
+
+from . import instrumentation
+from .services import decode_timestamps, decode_values
+
+# COPY ... TO STDOUT extraction for PostgreSQL sources. psycopg2's
+# copy_expert writes the COPY stream into a file object; here that "file"
+# parses it as it arrives and hands typed (timestamp, value) chunks to the
+# consuming generator through a small queue, so memory stays bounded like
+# the cursor path.
+
+BINARY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+BINARY_TRAILER = b"\xff\xff"
+# Binary COPY tuple of (timestamp, float8): field count, then a length
+# prefix before each 8-byte field. NULL values are coalesced to NaN in the
+# query so every tuple has this fixed size.
+BINARY_ROW = np.dtype(
+    [
+        ("fields", ">i2"),
+        ("timestamp_length", ">i4"),
+        ("timestamp", ">i8"),
+        ("value_length", ">i4"),
+        ("value", ">f8"),
+    ]
+)
+# Binary timestamps are microseconds since the PostgreSQL epoch
+PG_EPOCH = np.datetime64("2000-01-01T00:00:00", "us")
+TIMESTAMPTZ_OID = 1184
+
+COPY_BUFFER_SIZE = 1 << 16
+# Rough size of a CSV row, to cut the text stream into chunks
+CSV_ROW_BYTES = 32
+QUEUE_SIZE = 2
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class CSVCopyParser:
+    """
+    Decodes complete lines of a CSV COPY stream with pandas' C parser
+    """
+
+    def __init__(self, chunk_size: int):
+        self.threshold = chunk_size * CSV_ROW_BYTES
+
+    def parse(self, buffer: bytearray):
+        end = buffer.rfind(b"\n") + 1
+        if not end:
+            return []
+        block = bytes(buffer[:end])
+        del buffer[:end]
+        return [self.decode(block)]
+
+    def finish(self, buffer: bytearray):
+        if not buffer.strip():
+            return []
+        block = bytes(buffer)
+        buffer.clear()
+        return [self.decode(block)]
+
+    @staticmethod
+    def decode(block: bytes) -> pd.DataFrame:
+        df = pd.read_csv(
+            io.BytesIO(block),
+            header=None,
+            names=["timestamp", "value"],
+            dtype={"timestamp": object},
+        )
+        return pd.DataFrame(
+            {
+                "timestamp": decode_timestamps(df["timestamp"].to_numpy()),
+                "value": decode_values(df["value"].to_numpy()),
+            },
+            copy=False,
+        )
+
+
+class BinaryCopyParser:
+    """
+    Reads the fixed-size (timestamp, float8) tuples of a binary COPY stream
+    straight into NumPy arrays with np.frombuffer
+    """
+
+    def __init__(self, chunk_size: int, aware: bool):
+        self.threshold = chunk_size * BINARY_ROW.itemsize
+        self.aware = aware
+        self.header = False
+
+    def parse(self, buffer: bytearray):
+        if not self.header:
+            # Signature, flags, then a header extension of the given length
+            if len(buffer) < 19:
+                return []
+            if bytes(buffer[:11]) != BINARY_SIGNATURE:
+                raise ValueError("Not a binary COPY stream")
+            extension = int.from_bytes(buffer[15:19], "big")
+            if len(buffer) < 19 + extension:
+                return []
+            del buffer[: 19 + extension]
+            self.header = True
+        rows = len(buffer) // BINARY_ROW.itemsize
+        return [self.decode(buffer, rows)] if rows else []
+
+    def finish(self, buffer: bytearray):
+        frames = self.parse(buffer)
+        if bytes(buffer) != BINARY_TRAILER:
+            raise ValueError("Truncated binary COPY stream")
+        return frames
+
+    def decode(self, buffer: bytearray, rows: int) -> pd.DataFrame:
+        tuples = np.frombuffer(buffer, dtype=BINARY_ROW, count=rows)
+        if (tuples["fields"] != 2).any() or (tuples["timestamp_length"] != 8).any():
+            raise ValueError("Unexpected tuple layout in binary COPY stream")
+        timestamps = PG_EPOCH + tuples["timestamp"].astype("timedelta64[us]")
+        values = tuples["value"].astype(np.float64)
+        # Release the view before the buffer is resized
+        del tuples
+        del buffer[: rows * BINARY_ROW.itemsize]
+
+        timestamps = timestamps.astype("datetime64[ns]")
+        if self.aware:
+            # timestamptz is sent in UTC; charts use naive server time
+            timestamps = (
+                pd.DatetimeIndex(timestamps)
+                .tz_localize("UTC")
+                .tz_convert(timezone.get_default_timezone())
+                .tz_localize(None)
+                .to_numpy("datetime64[ns]")
+            )
+        return pd.DataFrame({"timestamp": timestamps, "value": values}, copy=False)
+
+
+class _Sink:
+    """
+    File object handed to copy_expert, which writes one row at a time: rows
+    are buffered and parsed once about a chunk's worth has arrived. Once the
+    consumer has gone away the rest of the stream is discarded (the COPY is
+    also cancelled) so psycopg2 can still finish the protocol and leave the
+    connection usable.
+
+    Runs in the COPY thread, so it only totals the bytes received and the
+    time spent parsing; the consumer adds them to the request's trace.
+    """
+
+    def __init__(self, parser, chunks: queue.Queue, stop: threading.Event):
+        self.parser = parser
+        self.chunks = chunks
+        self.stop = stop
+        self.buffer = bytearray()
+        self.bytes = 0
+        self.decode_seconds = 0.0
+
+    def put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, data):
+        self.bytes += len(data)
+        self.buffer += data
+        if len(self.buffer) >= self.parser.threshold:
+            self.flush()
+
+    def flush(self, final: bool = False):
+        if self.stop.is_set():
+            self.buffer.clear()
+            return
+        parse = self.parser.finish if final else self.parser.parse
+        started = time.perf_counter()
+        frames = parse(self.buffer)
+        self.decode_seconds += time.perf_counter() - started
+        for frame in frames:
+            self.put(frame)
+
+
+_DONE = object()
+
+
+def copy_series(conn, query: str, params, chunk_size: int, binary: bool = False):
+    """
+    Streams a (timestamp, value) query through COPY (...) TO STDOUT on a
+    psycopg2 connection, yielding typed chunks like
+    DataSourceService.stream_series.
+
+    COPY can't take bind parameters, so they are inlined with psycopg2's
+    own quoting (mogrify). Binary mode first looks up the result columns
+    (whether the timestamp is timestamptz) and casts the value to float8,
+    so the value column must be numeric; CSV mode takes any column type.
+    """
+    cursor = conn.cursor()
+    try:
+        if binary:
+            cursor.execute(f"SELECT * FROM ({query}) AS q LIMIT 0", params)
+            timestamp, value = [
+                f"q.{quote(column.name)}" for column in cursor.description[:2]
+            ]
+            aware = cursor.description[0].type_code == TIMESTAMPTZ_OID
+            if not aware:
+                timestamp = f"CAST({timestamp} AS TIMESTAMP)"
+            query = (
+                f"SELECT {timestamp}, "
+                f"COALESCE(CAST({value} AS DOUBLE PRECISION), 'NaN') "
+                f"FROM ({query}) AS q"
+            )
+            parser = BinaryCopyParser(chunk_size, aware)
+        else:
+            parser = CSVCopyParser(chunk_size)
+        sql = cursor.mogrify(query, params).decode()
+        copy = f"COPY ({sql}) TO STDOUT WITH (FORMAT {'binary' if binary else 'csv'})"
+    except Exception:
+        cursor.close()
+        raise
+
+    chunks = queue.Queue(maxsize=QUEUE_SIZE)
+    stop = threading.Event()
+    sink = _Sink(parser, chunks, stop)
+
+    def run():
+        try:
+            cursor.copy_expert(copy, sink, size=COPY_BUFFER_SIZE)
+            sink.flush(final=True)
+            sink.put(_DONE)
+        except Exception as e:
+            sink.put(e)
+
+    thread = threading.Thread(target=run, name="spc-copy", daemon=True)
+    thread.start()
+    try:
+        while True:
+            # Waiting on the COPY thread, which reads and parses the stream
+            with instrumentation.span("fetch"):
+                item = chunks.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            instrumentation.count_fetched(rows=len(item))
+            yield item
+    finally:
+        stop.set()
+        if thread.is_alive():
+            # Closed early: stop the server sending the rest
+            conn.cancel()
+            thread.join()
+        cursor.close()
+        instrumentation.record("decode", sink.decode_seconds)
+        instrumentation.count_fetched(source_bytes=sink.bytes)
@@ -0,0 +1,281 @@
+import json
+import re
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, List
+
+from django.conf import settings
+
+from .models import ChartConfig, DataSource
+from .query_builder import ChartQuery, describe_table, get_dialect
+from .schema_catalog import schema_catalog
+
+# Index diagnostics for chart queries. Every chart query filters on
+# product = ? AND operation = ? AND datetime BETWEEN ? AND ? and orders by
+# datetime, so the index serving it is (product, operation, datetime), with
+# the value column included so the table itself is never read.
+
+SHOWPLAN_NS = "{http://schemas.microsoft.com/sqlserver/2004/07/showplan}"
+# Operators reading a whole table or index rather than a key range
+FULL_SCAN_OPERATORS = {"Seq Scan", "Table Scan", "Clustered Index Scan", "Index Scan"}
+# Source identifiers are capped at 63 (Postgres) and 128 (MSSQL) characters
+INDEX_NAME_LENGTH = 63
+
+
+def explain_postgres(conn, query: str, params) -> List[Dict[str, Any]]:
+    """
+    Scan nodes of the estimated plan (EXPLAIN without ANALYZE, so the query
+    isn't run), plus the plan's estimated result rows as the first item
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {query}", params)
+        plan = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return parse_postgres_plan(plan)
+
+
+def parse_postgres_plan(plan) -> List[Dict[str, Any]]:
+    root = plan[0]["Plan"]
+    scans = []
+
+    def walk(node):
+        relation = node.get("Relation Name")
+        if relation is not None:
+            scans.append(
+                {
+                    "operator": node["Node Type"],
+                    "schema": node.get("Schema"),
+                    "table": relation,
+                    "index": node.get("Index Name"),
+                    "estimated_rows": node.get("Plan Rows"),
+                    "condition": node.get("Index Cond") or node.get("Filter"),
+                }
+            )
+        for child in node.get("Plans", []):
+            # A bitmap heap scan's index lives in its Bitmap Index Scan child
+            if child["Node Type"] == "Bitmap Index Scan" and scans and relation:
+                scans[-1]["index"] = child.get("Index Name")
+            walk(child)
+
+    walk(root)
+    return [{"estimated_rows": root.get("Plan Rows")}, *scans]
+
+
+def explain_mssql(conn, query: str, params) -> List[Dict[str, Any]]:
+    """
+    Same as explain_postgres from SET SHOWPLAN_XML, which returns the
+    estimated plan instead of running the statement
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SET SHOWPLAN_XML ON")
+        try:
+            cursor.execute(query, params)
+            plan = cursor.fetchone()[0]
+        finally:
+            cursor.execute("SET SHOWPLAN_XML OFF")
+    finally:
+        cursor.close()
+    return parse_showplan(plan)
+
+
+def parse_showplan(plan: str) -> List[Dict[str, Any]]:
+    root = ET.fromstring(plan)
+    statement = root.find(f".//{SHOWPLAN_NS}StmtSimple")
+    returned = statement.get("StatementEstRows") if statement is not None else None
+    scans = []
+    for relop in root.iter(f"{SHOWPLAN_NS}RelOp"):
+        # The Object directly under this operator, not a nested one
+        obj = None
+        for child in relop:
+            obj = child.find(f"{SHOWPLAN_NS}Object")
+            if obj is not None:
+                break
+        if obj is None:
+            continue
+        # EstimatedRowsRead (SQL Server 2016 SP1+) is what the operator
+        # reads before its residual predicate; older plans only carry the
+        # table cardinality for scans
+        read = relop.get("EstimatedRowsRead") or relop.get("TableCardinality")
+        scans.append(
+            {
+                "operator": relop.get("PhysicalOp"),
+                "schema": (obj.get("Schema") or "").strip("[]") or None,
+                "table": (obj.get("Table") or "").strip("[]"),
+                "index": (obj.get("Index") or "").strip("[]") or None,
+                "estimated_rows": float(relop.get("EstimateRows", 0)),
+                "estimated_rows_read": float(read) if read is not None else None,
+            }
+        )
+    return [{"estimated_rows": float(returned) if returned else None}, *scans]
+
+
+EXPLAINERS = {
+    DataSource.Engine.POSTGRES: explain_postgres,
+    DataSource.Engine.MSSQL: explain_mssql,
+}
+
+
+def index_name(table: str, columns: List[str]) -> str:
+    name = "_".join(["ix", table, *columns]).lower()
+    return re.sub(r"\W+", "_", name)[:INDEX_NAME_LENGTH]
+
+
+def match_index(indexes: List[Dict[str, Any]], equality: List[str], range_column: str):
+    """
+    Returns (index, quality) for the index best serving the chart filter:
+    "seek" when its keys start with the equality columns (any order) then
+    the range column, "partial" when they start with some of them, or
+    (None, None)
+    """
+    wanted = {column.lower() for column in equality}
+    range_column = range_column.lower()
+    best, best_depth = None, 0
+    for index in indexes:
+        keys = [column.lower() for column in index["columns"]]
+        depth = 0
+        while depth < len(keys) and keys[depth] in wanted:
+            depth += 1
+        if depth == len(wanted) and keys[depth : depth + 1] == [range_column]:
+            return index, "seek"
+        if not depth and keys[:1] == [range_column]:
+            depth = 1
+        if depth > best_depth:
+            best, best_depth = index, depth
+    return (best, "partial") if best is not None else (None, None)
+
+
+class IndexAdvisor:
+    """
+    Explains the query each chart sends to its source and compares it with
+    the source table's indexes: full scans are flagged, estimated rows read
+    are compared with rows returned, and a covering index is recommended
+    when none matches the chart's filter.
+    """
+
+    def __init__(self, ds_service=None):
+        if ds_service is None:
+            from .services import DataSourceService
+
+            ds_service = DataSourceService()
+        self.ds_service = ds_service
+
+    def chart_query(self, config: ChartConfig):
+        """
+        The query compute_chart_data would send: the aggregate pushdown when
+        enabled, else the raw newest-rows query (the measurement cache sync
+        filters on the same columns)
+        """
+        from .calculation_service import CalculationService
+
+        start_date, end_date = CalculationService.chart_window(config)
+        max_rows = getattr(settings, "SPC_MAX_ROWS", 100000)
+        query = ChartQuery(config, self.ds_service)
+        if (
+            config.aggregation_pushdown
+            and not config.cache_measurements
+            and CalculationService.supports_pushdown(config)
+        ):
+            return query.aggregate(start_date, end_date, max_rows)
+        return query.raw(start_date, end_date, max_rows)
+
+    def explain(self, source: DataSource, query: str, params) -> List[Dict[str, Any]]:
+        explainer = EXPLAINERS[source.engine]
+        with self.ds_service.connection(source) as conn:
+            return explainer(conn, query, params)
+
+    def advise(self, config: ChartConfig) -> Dict[str, Any]:
+        """
+        Diagnostics for one chart. Raises QueryBuildError when its table or
+        columns don't exist, CatalogError / driver errors when the source
+        can't be read.
+        """
+        source = config.data_source
+        dialect = get_dialect(source)
+        described = describe_table(source, config.table_name, self.ds_service)
+        product = described.column(config.product_column)
+        operation = described.column(config.operation_column)
+        timestamp = described.column(config.datetime_column)
+        value = described.column(config.value_column)
+
+        table = schema_catalog.table(
+            source, f"{described.schema}.{described.table}"
+        ) or {"indexes": [], "row_estimate": None}
+        # reltuples is -1 on Postgres tables that were never analyzed
+        row_estimate = table["row_estimate"]
+        if row_estimate is not None and row_estimate < 0:
+            row_estimate = None
+        index, quality = match_index(table["indexes"], [product, operation], timestamp)
+
+        query, params = self.chart_query(config)
+        returned, *scans = self.explain(source, query, params)
+        scans = [
+            scan
+            for scan in scans
+            if scan["table"].lower() == described.table.lower()
+            and (
+                scan["schema"] is None
+                or scan["schema"].lower() == described.schema.lower()
+            )
+        ]
+        for scan in scans:
+            scan["full_scan"] = scan["operator"] in FULL_SCAN_OPERATORS
+            if scan.get("estimated_rows_read") is None:
+                # A full scan reads the whole table; a range scan reads
+                # what it returns (as far as the plan estimates)
+                scan["estimated_rows_read"] = (
+                    row_estimate if scan["full_scan"] else scan["estimated_rows"]
+                )
+        rows_read = sum(scan["estimated_rows_read"] or 0 for scan in scans)
+        full_scan = any(scan["full_scan"] for scan in scans)
+
+        findings = []
+        if full_scan:
+            findings.append(
+                f"Full scan of {described.schema}.{described.table} "
+                f"(~{rows_read:,.0f} rows read for ~{returned['estimated_rows'] or 0:,.0f} returned)"
+            )
+        if quality == "seek":
+            findings.append(f"Index {index['name']} matches the chart filter")
+        elif quality == "partial":
+            findings.append(
+                f"Index {index['name']} ({', '.join(index['columns'])}) only "
+                "partly matches the chart filter"
+            )
+        else:
+            findings.append("No index starts with the chart's filter columns")
+
+        recommendation = None
+        if quality != "seek" or full_scan:
+            columns = [product, operation, timestamp]
+            name = index_name(described.table, columns)
+            recommendation = {
+                "name": name,
+                "columns": columns,
+                "include": [value],
+                "sql": (
+                    f"CREATE INDEX {dialect.quote(name)} "
+                    f"ON {described.qualified(dialect)} "
+                    f"({', '.join(dialect.quote(c) for c in columns)}) "
+                    f"INCLUDE ({dialect.quote(value)})"
+                ),
+            }
+
+        return {
+            "chart": config.pk,
+            "table": f"{described.schema}.{described.table}",
+            "row_estimate": row_estimate,
+            "query": query,
+            "indexes": table["indexes"],
+            "matching_index": index["name"] if index else None,
+            "match": quality,
+            "full_scan": full_scan,
+            "estimated_rows_read": rows_read,
+            "estimated_rows_returned": returned["estimated_rows"],
+            "scans": scans,
+            "findings": findings,
+            "recommendation": recommendation,
+        }
@@ -0,0 +1,300 @@
+import contextvars
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+
+# Hot-path timing for chart requests. Code on the request path wraps each
+# stage in span(stage); the time is added to the request's Trace (when the
+# view started one, see trace()) and to the process-wide metrics served at
+# /api/spc/metrics/ in the Prometheus text format.
+#
+# Stages: connect (pool checkout / connecting), query (executing the source
+# query; with read_sql it includes fetching), fetch (reading result rows),
+# decode (coercing driver values to typed arrays), aggregate, statistics,
+# rules (WECO), cache (result cache lookup), downsample and render
+# (serializing the response).
+
+slow_logger = logging.getLogger("spc.slow")
+
+DEFAULT_INSTRUMENTATION_SETTINGS = {
+    "SERVER_TIMING": True,  # Server-Timing header on chart data responses
+    "METRICS": True,  # Serve the Prometheus metrics endpoint
+    "SLOW_REQUEST_SECONDS": None,  # Log slower requests to "spc.slow" (None: off)
+    "LOG_SQL": True,  # Include the generated SQL (never its parameters) in that log
+    "METRICS_TOKEN": None,  # Bearer token for scrapers; staff users need none
+}
+
+# Upper bounds (seconds) of the request duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def get_instrumentation_settings() -> Dict[str, Any]:
+    return {
+        **DEFAULT_INSTRUMENTATION_SETTINGS,
+        **getattr(settings, "SPC_INSTRUMENTATION", {}),
+    }
+
+
+class Trace:
+    """
+    Timings and volumes of one request: seconds and calls per stage, rows
+    fetched from the source, bytes read from the source (COPY streams;
+    cursor drivers don't report transfer sizes) and sent in the response,
+    and the SQL that was run
+    """
+
+    def __init__(self, name: str, label: str = ""):
+        self.name = name
+        self.label = label
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.stages: Dict[str, list] = {}
+        self.rows = 0
+        self.source_bytes = 0
+        self.response_bytes = 0
+        self.sql = []
+        self.notes: Dict[str, str] = {}
+
+    def add(self, stage: str, seconds: float):
+        totals = self.stages.setdefault(stage, [0.0, 0])
+        totals[0] += seconds
+        totals[1] += 1
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    def server_timing(self) -> str:
+        """
+        Server-Timing header value: one metric per stage in milliseconds,
+        the notes as descriptions and the total
+        """
+        parts = [
+            f"{stage};dur={seconds * 1000:.1f}"
+            for stage, (seconds, _) in self.stages.items()
+        ]
+        parts += [f'{name};desc="{value}"' for name, value in self.notes.items()]
+        parts.append(f"total;dur={self.elapsed * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar(
+    "spc_trace", default=None
+)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+class Metrics:
+    """
+    Process-wide totals for the metrics endpoint. Each server process keeps
+    its own; Prometheus adds them up across the scraped processes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages: Dict[str, list] = {}
+            self.requests: Dict[tuple, int] = {}
+            self.durations: Dict[str, list] = {}
+            self.counters: Dict[str, float] = {}
+
+    def observe_stage(self, stage: str, seconds: float):
+        with self._lock:
+            totals = self.stages.setdefault(stage, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += 1
+
+    def observe_request(self, name: str, status: int, seconds: float):
+        with self._lock:
+            key = (name, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.durations.setdefault(
+                name, [[0] * (len(DURATION_BUCKETS) + 1), 0.0]
+            )
+            histogram[0][bisect_left(DURATION_BUCKETS, seconds)] += 1
+            histogram[1] += seconds
+
+    def inc(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def render(self) -> str:
+        """
+        The metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            lines = [
+                "# HELP spc_stage_seconds Time spent in each chart computation stage",
+                "# TYPE spc_stage_seconds summary",
+            ]
+            for stage, (seconds, count) in sorted(self.stages.items()):
+                lines.append(f'spc_stage_seconds_sum{{stage="{stage}"}} {seconds}')
+                lines.append(f'spc_stage_seconds_count{{stage="{stage}"}} {count}')
+
+            lines += [
+                "# HELP spc_requests_total Instrumented requests by view and status",
+                "# TYPE spc_requests_total counter",
+            ]
+            for (name, status), count in sorted(self.requests.items()):
+                lines.append(
+                    f'spc_requests_total{{view="{name}",status="{status}"}} {count}'
+                )
+
+            lines += [
+                "# HELP spc_request_seconds Instrumented request durations",
+                "# TYPE spc_request_seconds histogram",
+            ]
+            for name, (buckets, seconds) in sorted(self.durations.items()):
+                cumulative = 0
+                for bound, count in zip((*DURATION_BUCKETS, "+Inf"), buckets):
+                    cumulative += count
+                    lines.append(
+                        f'spc_request_seconds_bucket{{view="{name}",le="{bound}"}} '
+                        f"{cumulative}"
+                    )
+                lines.append(f'spc_request_seconds_sum{{view="{name}"}} {seconds}')
+                lines.append(f'spc_request_seconds_count{{view="{name}"}} {cumulative}')
+
+            for name, help_text in COUNTERS.items():
+                lines += [
+                    f"# HELP spc_{name}_total {help_text}",
+                    f"# TYPE spc_{name}_total counter",
+                    f"spc_{name}_total {self.counters.get(name, 0)}",
+                ]
+        return "\n".join(lines) + "\n"
+
+
+COUNTERS = {
+    "rows_fetched": "Rows fetched from data sources",
+    "source_bytes": "Bytes read from data source COPY streams",
+    "response_bytes": "Bytes of rendered instrumented responses",
+    "source_queries": "Queries run on data sources",
+    "slow_requests": "Requests slower than SLOW_REQUEST_SECONDS",
+}
+
+metrics = Metrics()
+
+
+@contextmanager
+def trace(name: str, label: str = ""):
+    """
+    Makes a new Trace the current one for the block (and anything it calls
+    in the same thread or task)
+    """
+    current = Trace(name, label)
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        _current.reset(token)
+
+
+def record(stage: str, seconds: float):
+    metrics.observe_stage(stage, seconds)
+    current = _current.get()
+    if current is not None:
+        current.add(stage, seconds)
+
+
+@contextmanager
+def span(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+
+def count_fetched(rows: int = 0, source_bytes: int = 0):
+    """
+    Adds rows fetched and bytes read from a source
+    """
+    if rows:
+        metrics.inc("rows_fetched", rows)
+    if source_bytes:
+        metrics.inc("source_bytes", source_bytes)
+    current = _current.get()
+    if current is not None:
+        current.rows += rows
+        current.source_bytes += source_bytes
+
+
+def record_sql(query: str):
+    """
+    Counts a source query and keeps its SQL on the current trace. Parameters
+    are not recorded: they hold identifiers and filter values that don't
+    belong in logs.
+    """
+    metrics.inc("source_queries")
+    current = _current.get()
+    if current is not None:
+        current.sql.append(" ".join(query.split()))
+
+
+def note(name: str, value: str):
+    """
+    Tags the current request, e.g. note("cache", "hit"); shown as a
+    Server-Timing description
+    """
+    current = _current.get()
+    if current is not None:
+        current.notes[name] = value
+
+
+def finish(current: Trace, status: int, response_bytes: int = 0):
+    """
+    Closes a request's trace: adds it to the metrics and logs it to
+    "spc.slow" when slower than SLOW_REQUEST_SECONDS
+    """
+    current.finished = time.perf_counter()
+    current.response_bytes = response_bytes
+    metrics.observe_request(current.name, status, current.elapsed)
+    if response_bytes:
+        metrics.inc("response_bytes", response_bytes)
+
+    instrumentation_settings = get_instrumentation_settings()
+    threshold = instrumentation_settings["SLOW_REQUEST_SECONDS"]
+    if threshold is None or current.elapsed < threshold:
+        return
+    metrics.inc("slow_requests")
+    message = (
+        f"Slow request {current.name} {current.label}: "
+        f"{current.elapsed * 1000:.0f} ms, {current.rows} rows, "
+        f"{current.source_bytes} source bytes, {response_bytes} response bytes "
+        f"({current.server_timing()})"
+    )
+    if instrumentation_settings["LOG_SQL"]:
+        for query in current.sql:
+            message += f"\n  {query}"
+    slow_logger.warning(message)
+
+
+def instrument_response(current: Trace, response):
+    """
+    Finishes the trace once the (DRF) response is rendered: adds the render
+    time, the Server-Timing header and the response size
+    """
+    returned = time.perf_counter()
+
+    def rendered(response):
+        seconds = time.perf_counter() - returned
+        current.add("render", seconds)
+        metrics.observe_stage("render", seconds)
+        finish(current, response.status_code, len(response.content))
+        if get_instrumentation_settings()["SERVER_TIMING"]:
+            response["Server-Timing"] = current.server_timing()
+        return response
+
+    response.add_post_render_callback(rendered)
+    return response
@@ -0,0 +1,527 @@
+import json
+import os
+import platform
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory, override_settings
+from django.utils import timezone
+from rest_framework.test import force_authenticate
+from authentication.models import User
+from spc import weco
+from spc.calculation_service import CalculationService
+from spc.models import ChartConfig, DataSource
+from spc.parallel import ParallelChartService
+from spc.pipeline import ChunkAggregator
+from spc.renderers import (
+    ChartColumnarJSONRenderer,
+    ChartJSONRenderer,
+    ChartPackedRenderer,
+)
+from spc.services import DataSourceService, decode_timestamps, decode_values
+from spc.synthetic import (
+    drop_table,
+    generate_measurements,
+    iter_measurements,
+    write_table,
+)
+from spc.views import ChartDataView
+
+BENCHMARKS = [
+    "weco",
+    "extract",
+    "parallel",
+    "coerce",
+    "resample",
+    "count",
+    "capability",
+    "limits",
+    "serialize",
+    "fetch",
+    "view",
+]
+# Benchmarks that need --source
+SOURCE_BENCHMARKS = ["extract", "fetch", "view"]
+
+EXTRACT_TABLE = "spc_benchmark_extract"
+MEASUREMENT_TABLE = "spc_benchmark_measurements"
+BENCHMARK_USER = "spc-benchmark@example.invalid"
+# Synthetic data of the sized benchmarks: a drifting, shifting process
+# with NULLs and non-numeric junk, as a VARCHAR value column returns it
+SYNTHETIC = {"drift": 1.0, "shift": 1.5, "nan_ratio": 0.001, "junk_ratio": 0.001}
+# Source tables keep a numeric value column so pushdown and binary COPY
+# work; junk is covered by the coerce benchmark
+SOURCE_SYNTHETIC = {**SYNTHETIC, "junk_ratio": 0.0}
+START = datetime(2024, 1, 1)
+
+
+def timed(func, repeat: int):
+    """
+    Runs func `repeat` times and returns (best, median) wall time in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings), float(np.median(timings))
+
+
+def parse_size(value: str) -> int:
+    """
+    10000, 10k or 1m
+    """
+    value = value.strip().lower()
+    scale = {"k": 1_000, "m": 1_000_000}.get(value[-1:], 1)
+    return int(float(value.rstrip("km")) * scale)
+
+
+def chart(aggregation_type: str, size: int = 1, **fields) -> ChartConfig:
+    return ChartConfig(
+        aggregation_type=aggregation_type,
+        aggregation_size=size,
+        upper_spec_limit=27.0,
+        lower_spec_limit=23.0,
+        weco_rules={rule: True for rule in weco.RULES},
+        **fields,
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks for the SPC hot paths on synthetic data, optionally saved "
+        "to / compared with a JSON results file"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "benchmarks",
+            nargs="*",
+            help=f"Benchmarks to run: {', '.join(BENCHMARKS)} (default: all)",
+        )
+        parser.add_argument(
+            "--points", type=int, default=100_000, help="Rows of weco / parallel"
+        )
+        parser.add_argument(
+            "--sizes",
+            default="10k,1m",
+            help="Comma-separated row counts of the other benchmarks, e.g. 10k,1m,10m",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=20,
+            help="Runs per benchmark, fewer for large sizes (1M rows in total)",
+        )
+        parser.add_argument(
+            "--source",
+            type=int,
+            help="PostgreSQL / MSSQL data source id for extract, fetch and view "
+            f"(scratch tables {EXTRACT_TABLE} / {MEASUREMENT_TABLE} are created "
+            "and dropped on it)",
+        )
+        parser.add_argument(
+            "--charts",
+            type=int,
+            default=32,
+            help="Charts computed by the parallel benchmark (--points rows each)",
+        )
+        parser.add_argument("--save", help="Write the results to this JSON file")
+        parser.add_argument(
+            "--compare", help="Compare with results saved by an earlier --save"
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.1,
+            help="Slowdown (fraction of the baseline) reported as a regression",
+        )
+
+    def handle(self, *args, **options):
+        unknown = set(options["benchmarks"]) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+        options["sizes"] = [parse_size(size) for size in options["sizes"].split(",")]
+        self.source = None
+        if options["source"]:
+            self.source = DataSource.objects.filter(pk=options["source"]).first()
+            if self.source is None:
+                raise CommandError(f"Unknown data source: {options['source']}")
+        self.results = {}
+        self.frames = {}
+        self.tables = {}
+
+        try:
+            for name in options["benchmarks"] or BENCHMARKS:
+                if name in SOURCE_BENCHMARKS and self.source is None:
+                    self.stdout.write(f"{name}: skipped, needs --source")
+                    continue
+                getattr(self, f"bench_{name}")(options)
+        finally:
+            if self.tables:
+                drop_table(self.source, MEASUREMENT_TABLE)
+
+        if options["save"]:
+            with open(options["save"], "w") as f:
+                json.dump({"meta": self.meta(), "results": self.results}, f, indent=2)
+            self.stdout.write(f"Results saved to {options['save']}")
+        if options["compare"]:
+            self.compare(options["compare"], options["tolerance"])
+
+    def record(self, name: str, best: float, median: float, **info):
+        self.results[name] = {"best": best, "median": median, **info}
+        self.stdout.write(
+            f"  {name}: best {best * 1000:.2f} ms, median {median * 1000:.2f} ms"
+        )
+
+    @staticmethod
+    def repeats(options, n: int) -> int:
+        return max(1, min(options["repeat"], 1_000_000 // max(n, 1)))
+
+    @staticmethod
+    def meta():
+        return {
+            "date": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        }
+
+    def compare(self, path: str, tolerance: float):
+        with open(path) as f:
+            baseline = json.load(f)["results"]
+        regressions = []
+        self.stdout.write(f"Compared with {path} (best times):")
+        for name, result in self.results.items():
+            if name not in baseline:
+                continue
+            change = result["best"] / baseline[name]["best"] - 1
+            line = f"  {name}: {change:+.1%}"
+            if change > tolerance:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(f"{line} regression"))
+            else:
+                self.stdout.write(line)
+        if regressions:
+            raise CommandError(
+                f"{len(regressions)} benchmarks regressed by more than {tolerance:.0%}"
+            )
+
+    def frame(self, n: int) -> pd.DataFrame:
+        """
+        n synthetic rows as the source returns them (object values)
+        """
+        if n not in self.frames:
+            self.frames = {n: generate_measurements(n, **SYNTHETIC)}
+        return self.frames[n]
+
+    def typed(self, n: int) -> pd.DataFrame:
+        df = self.frame(n)
+        return pd.DataFrame(
+            {
+                "timestamp": df["timestamp"].to_numpy(),
+                "value": decode_values(df["value"].to_numpy(dtype=object)),
+            }
+        ).dropna(subset=["value"])
+
+    def table(self, n: int):
+        """
+        The scratch measurement table on --source, with n rows of a single
+        product / operation so a chart reads all of them
+        """
+        if self.tables.get("rows") != n:
+            started = time.perf_counter()
+            write_table(
+                self.source,
+                MEASUREMENT_TABLE,
+                iter_measurements(n, products=1, operations=1, **SOURCE_SYNTHETIC),
+            )
+            self.tables = {"rows": n}
+            self.stdout.write(
+                f"  ({MEASUREMENT_TABLE}: {n} rows written in "
+                f"{time.perf_counter() - started:.1f} s)"
+            )
+        return dict(
+            data_source=self.source,
+            table_name=MEASUREMENT_TABLE,
+            value_column="value",
+            datetime_column="ts",
+            product_column="product",
+            operation_column="operation",
+            product_identifier="P1",
+            operation_identifier="10",
+        )
+
+    def bench_weco(self, options):
+        n = options["points"]
+        rng = np.random.default_rng(42)
+        # In-control noise with a drift and a shift so every rule has hits
+        values = rng.normal(0.0, 1.0, n)
+        values[n // 3 :] += np.linspace(0, 1.5, n - n // 3)
+        values[2 * n // 3 :] += 1.0
+        rules = weco.resolve_rules({rule: True for rule in weco.RULES})
+
+        self.stdout.write(f"weco: {n} points, {len(rules)} rules")
+        best, median = timed(
+            lambda: weco.evaluate(values, 0.0, 1.0, rules), options["repeat"]
+        )
+        hits = weco.evaluate(values, 0.0, 1.0, rules)
+        self.record(
+            f"weco/{n}",
+            best,
+            median,
+            violations={rule: len(indices) for rule, indices in hits.items()},
+        )
+
+    def bench_extract(self, options):
+        source = self.source
+        if source.engine != DataSource.Engine.POSTGRES:
+            self.stdout.write("extract: skipped, needs a PostgreSQL source")
+            return
+
+        n = options["points"]
+        service = DataSourceService()
+        with service.connection(source) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"DROP TABLE IF EXISTS {EXTRACT_TABLE}")
+            cursor.execute(
+                f"CREATE TABLE {EXTRACT_TABLE} AS "
+                "SELECT TIMESTAMP '2024-01-01' + i * INTERVAL '1 second' AS ts, "
+                "random() AS value FROM generate_series(1, %s) AS i",
+                [n],
+            )
+            conn.commit()
+
+        query = (
+            f"SELECT ts AS timestamp, value AS value FROM {EXTRACT_TABLE} "
+            "ORDER BY ts DESC"
+        )
+
+        def read_sql():
+            # The pre-streaming path: one object DataFrame, then coerced
+            df = service.query(source, query)
+            df["value"] = pd.to_numeric(df["value"], errors="coerce")
+            df["timestamp"] = pd.to_datetime(df["timestamp"])
+
+        def stream(mode):
+            def run():
+                source.extraction_mode = mode
+                for _ in service.stream_series(source, query):
+                    pass
+
+            return run
+
+        try:
+            runs = [("read_sql", read_sql)] + [
+                (mode, stream(mode)) for mode in DataSource.ExtractionMode
+            ]
+            self.stdout.write(f"extract: {n} rows from {source.name}")
+            for label, func in runs:
+                best, median = timed(func, options["repeat"])
+                self.record(f"extract/{label.lower()}/{n}", best, median)
+        finally:
+            with service.connection(source) as conn:
+                conn.cursor().execute(f"DROP TABLE IF EXISTS {EXTRACT_TABLE}")
+                conn.commit()
+
+    def bench_parallel(self, options):
+        n, charts = options["points"], options["charts"]
+        rng = np.random.default_rng(42)
+        timestamps = pd.date_range(START, periods=n, freq="s").to_numpy()
+        end = timestamps[-1].astype("datetime64[us]").item()
+        items = []
+        for i in range(charts):
+            # Alternate hourly and subgroup charts
+            config = chart("TIME_HOUR") if i % 2 else chart("COUNT", 5)
+            config.pk = i + 1
+            df = pd.DataFrame({"timestamp": timestamps, "value": rng.normal(0, 1, n)})
+            items.append((config, df))
+        # A few rounds at most: each one computes every chart
+        repeat = min(options["repeat"], 3)
+
+        service = CalculationService()
+
+        def serial():
+            for config, df in items:
+                service.compute_chart_data(config, START, end, df)
+
+        self.stdout.write(f"parallel: {charts} charts x {n} rows")
+        serial_best, median = timed(serial, repeat)
+        self.record(f"parallel/serial/{charts}x{n}", serial_best, median)
+
+        counts = [1]
+        while counts[-1] * 2 <= (os.cpu_count() or 1):
+            counts.append(counts[-1] * 2)
+        for processes in counts:
+            parallel = ParallelChartService(processes=processes)
+            with parallel.pool() as pool:
+
+                def run():
+                    frames = ((config, df, 0.0, (START, end)) for config, df in items)
+                    for _ in parallel.compute_frames(frames, pool):
+                        pass
+
+                best, median = timed(run, repeat)
+            self.record(
+                f"parallel/{processes}p/{charts}x{n}",
+                best,
+                median,
+                speedup=serial_best / best,
+            )
+
+    def bench_coerce(self, options):
+        self.stdout.write("coerce: driver values / datetimes to typed arrays")
+        for n in options["sizes"]:
+            df = self.frame(n)
+            values = df["value"].to_numpy(dtype=object)
+            timestamps = list(df["timestamp"].dt.to_pydatetime())
+            repeat = self.repeats(options, n)
+            best, median = timed(lambda: decode_values(values), repeat)
+            self.record(f"coerce/values/{n}", best, median)
+            best, median = timed(lambda: decode_timestamps(timestamps), repeat)
+            self.record(f"coerce/timestamps/{n}", best, median)
+
+    def bench_resample(self, options):
+        self.stdout.write("resample: hourly buckets")
+        config = chart("TIME_HOUR")
+        for n in options["sizes"]:
+            df = self.typed(n)
+            chunk_size = 10_000
+            repeat = self.repeats(options, n)
+            best, median = timed(
+                lambda: CalculationService.aggregate(config, df), repeat
+            )
+            self.record(f"resample/pandas/{n}", best, median)
+
+            def streamed():
+                ChunkAggregator(config).extend(
+                    df.iloc[i : i + chunk_size] for i in range(0, len(df), chunk_size)
+                ).grouped()
+
+            best, median = timed(streamed, repeat)
+            self.record(f"resample/streamed/{n}", best, median)
+
+    def bench_count(self, options):
+        self.stdout.write("count: subgroups of 5")
+        config = chart("COUNT", 5)
+        for n in options["sizes"]:
+            df = self.typed(n)
+            best, median = timed(
+                lambda: CalculationService.aggregate(config, df),
+                self.repeats(options, n),
+            )
+            self.record(f"count/{n}", best, median)
+
+    def bench_capability(self, options):
+        self.stdout.write("capability: statistics, Cp / Cpk")
+        config = chart("RAW")
+
+        for n in options["sizes"]:
+            values = self.typed(n)["value"]
+
+            def run():
+                stats = CalculationService.series_statistics(values)
+                CalculationService.capability(config, stats["mean"], stats["std_dev"])
+
+            best, median = timed(run, self.repeats(options, n))
+            self.record(f"capability/{n}", best, median)
+
+    def bench_limits(self, options):
+        self.stdout.write("limits: X̄-R / X̄-S per subgroup (sizes 1-10), I-MR")
+        rng = np.random.default_rng(7)
+        for n in options["sizes"]:
+            count = rng.integers(1, 11, n)
+            std = np.where(count > 1, rng.gamma(4.0, 0.075, n), np.nan)
+            grouped = pd.DataFrame(
+                {
+                    "timestamp": pd.date_range(START, periods=n, freq="min"),
+                    "mean": rng.normal(25.0, 0.3, n),
+                    "std": std,
+                    "count": count,
+                    "range": np.nan_to_num(std) * 2.3,
+                }
+            )
+            best, median = timed(
+                lambda: CalculationService.control_limits(grouped),
+                self.repeats(options, n),
+            )
+            self.record(f"limits/subgroups/{n}", best, median)
+
+            df = self.typed(n)
+            best, median = timed(
+                lambda: CalculationService.control_limits(df),
+                self.repeats(options, n),
+            )
+            self.record(f"limits/individuals/{n}", best, median)
+
+    def bench_serialize(self, options):
+        self.stdout.write("serialize: raw chart payloads")
+        renderers = {
+            "json": ChartJSONRenderer(),
+            "columnar": ChartColumnarJSONRenderer(),
+            "packed": ChartPackedRenderer(),
+        }
+        config = chart("RAW")
+        for n in options["sizes"]:
+            df = self.typed(n).reset_index(drop=True)
+            end = df["timestamp"].iloc[-1].to_pydatetime()
+            payload = CalculationService().compute_chart_data(config, START, end, df)
+            repeat = self.repeats(options, n)
+            for label, renderer in renderers.items():
+                best, median = timed(lambda: renderer.render(payload), repeat)
+                size = len(renderer.render(payload))
+                self.record(f"serialize/{label}/{n}", best, median, bytes=size)
+
+    def bench_fetch(self, options):
+        self.stdout.write(f"fetch: newest rows from {self.source.name}")
+        for n in options["sizes"]:
+            config = chart("RAW", **self.table(n))
+            end = START + pd.Timedelta(seconds=n)
+            best, median = timed(
+                lambda: CalculationService().fetch_raw(config, START, end, n),
+                self.repeats(options, n),
+            )
+            self.record(f"fetch/{self.source.engine.lower()}/{n}", best, median)
+
+    def bench_view(self, options):
+        """
+        ChartDataView latency for an hourly chart over the whole table, with
+        the result cache off and the row cap raised to the table size
+        """
+        self.stdout.write(f"view: ChartDataView on {self.source.name}")
+        user, _ = User.objects.get_or_create(email=BENCHMARK_USER)
+        configs = []
+        try:
+            for n in options["sizes"]:
+                fields = self.table(n)
+                end = START + pd.Timedelta(seconds=n)
+                request = RequestFactory().get(
+                    "/",
+                    {"start_date": START.isoformat(), "end_date": end.isoformat()},
+                )
+                force_authenticate(request, user)
+                view = ChartDataView.as_view()
+                for pushdown in (False, True):
+                    config = chart("TIME_HOUR", owner=user, **fields)
+                    config.aggregation_pushdown = pushdown
+                    config.save()
+                    configs.append(config)
+
+                    def run():
+                        response = view(request, pk=config.pk)
+                        response.render()
+                        if response.status_code != 200:
+                            raise CommandError(response.content.decode())
+
+                    with override_settings(SPC_MAX_ROWS=n, SPC_RESULT_CACHE={"TTL": 0}):
+                        best, median = timed(run, self.repeats(options, n))
+                    label = "pushdown" if pushdown else "pandas"
+                    self.record(f"view/{label}/{n}", best, median)
+        finally:
+            for config in configs:
+                config.delete()
+            user.delete()
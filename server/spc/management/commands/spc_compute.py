@@ -0,0 +1,88 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from spc.models import ChartConfig
+from spc.parallel import ParallelChartService
+
+
+def ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.0f} ms"
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute many SPC charts in parallel (source reads in threads, "
+        "statistics in a process pool) and store them in the result cache"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chart",
+            type=int,
+            action="append",
+            dest="charts",
+            help="ChartConfig id (repeatable). Defaults to every chart.",
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=None,
+            help="Window length ending now (default SPC_DEFAULT_LOOKBACK_DAYS)",
+        )
+        parser.add_argument(
+            "--processes", type=int, help="Computation processes (SPC_PARALLEL)"
+        )
+        parser.add_argument(
+            "--threads", type=int, help="Source fetch threads (SPC_PARALLEL)"
+        )
+
+    def handle(self, *args, **options):
+        if options["charts"]:
+            chart_ids = options["charts"]
+            found = set(
+                ChartConfig.objects.filter(id__in=chart_ids).values_list(
+                    "id", flat=True
+                )
+            )
+            missing = set(chart_ids) - found
+            if missing:
+                raise CommandError(f"Unknown chart ids: {sorted(missing)}")
+        else:
+            chart_ids = list(ChartConfig.objects.values_list("id", flat=True))
+
+        start_date = end_date = None
+        if options["days"]:
+            end_date = timezone.make_naive(timezone.now())
+            start_date = end_date - timedelta(days=options["days"])
+
+        service = ParallelChartService(options["processes"], options["threads"])
+        started = time.perf_counter()
+        results, timings = service.get_charts_data(chart_ids, start_date, end_date)
+        elapsed = time.perf_counter() - started
+
+        configs = ChartConfig.objects.in_bulk(chart_ids)
+        for chart_id in sorted(
+            timings, key=lambda i: timings[i]["compute"] or 0, reverse=True
+        ):
+            timing = timings[chart_id]
+            line = (
+                f"{configs[chart_id]}: {timing['mode']}, "
+                f"{'-' if timing['rows'] is None else timing['rows']} rows, "
+                f"fetch {ms(timing['fetch'])}, compute {ms(timing['compute'])}"
+            )
+            if "error" in results[chart_id]:
+                self.stderr.write(
+                    self.style.ERROR(f"{line} - failed: {results[chart_id]['error']}")
+                )
+            else:
+                self.stdout.write(line)
+
+        compute = sum(timing["compute"] or 0 for timing in timings.values())
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{len(chart_ids)} charts in {elapsed:.2f} s with "
+                f"{service.processes} processes / {service.threads} threads "
+                f"({compute:.2f} s of computation)"
+            )
+        )
@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from spc.models import ChartConfig, DataSource
+from spc.synthetic import iter_measurements, write_table
+from authentication.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Create a synthetic measurement table (ts, value, product, operation) "
+        "on a data source, for benchmarks and local testing"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", type=int, help="DataSource id")
+        parser.add_argument("--table", default="spc_synthetic")
+        parser.add_argument("--rows", type=int, default=1_000_000)
+        parser.add_argument("--products", type=int, default=5)
+        parser.add_argument("--operations", type=int, default=3)
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1.0,
+            help="Seconds between rows; the table ends now",
+        )
+        parser.add_argument(
+            "--drift", type=float, default=0.0, help="Sigmas of linear drift"
+        )
+        parser.add_argument(
+            "--shift",
+            type=float,
+            default=0.0,
+            help="Sigmas of mean shift over the last third",
+        )
+        parser.add_argument("--nan-ratio", type=float, default=0.0)
+        parser.add_argument(
+            "--junk-ratio",
+            type=float,
+            default=0.0,
+            help="Share of non-numeric values; makes the value column text",
+        )
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--no-index",
+            action="store_true",
+            help="Skip the (product, operation, ts) index",
+        )
+        parser.add_argument(
+            "--charts",
+            metavar="OWNER_EMAIL",
+            help="Also create a ChartConfig per product / operation, owned by this user",
+        )
+
+    def handle(self, *args, **options):
+        source = DataSource.objects.filter(pk=options["source"]).first()
+        if source is None:
+            raise CommandError(f"Unknown data source: {options['source']}")
+        owner = None
+        if options["charts"]:
+            owner = User.objects.filter(email=options["charts"]).first()
+            if owner is None:
+                raise CommandError(f"Unknown user: {options['charts']}")
+
+        interval = timedelta(seconds=options["interval"])
+        start = datetime.now().replace(microsecond=0) - interval * options["rows"]
+        chunks = iter_measurements(
+            options["rows"],
+            products=options["products"],
+            operations=options["operations"],
+            start=start,
+            interval=interval,
+            drift=options["drift"],
+            shift=options["shift"],
+            nan_ratio=options["nan_ratio"],
+            junk_ratio=options["junk_ratio"],
+            seed=options["seed"],
+        )
+        written = write_table(
+            source,
+            options["table"],
+            chunks,
+            text_values=bool(options["junk_ratio"]),
+            index=not options["no_index"],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f"{options['table']}: {written} rows written")
+        )
+
+        if owner is None:
+            return
+        for p in range(options["products"]):
+            for o in range(options["operations"]):
+                config = ChartConfig.objects.create(
+                    owner=owner,
+                    data_source=source,
+                    table_name=options["table"],
+                    value_column="value",
+                    datetime_column="ts",
+                    product_column="product",
+                    operation_column="operation",
+                    product_identifier=f"P{p + 1}",
+                    operation_identifier=str((o + 1) * 10),
+                )
+                self.stdout.write(f"Chart {config.pk}: {config}")
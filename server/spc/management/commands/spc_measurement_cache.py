@@ -0,0 +1,71 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from spc.models import ChartConfig
+from spc.measurement_cache import MeasurementCacheService
+
+
+class Command(BaseCommand):
+    help = "Backfill, sync or purge the local measurement cache of SPC charts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["backfill", "sync", "purge"])
+        parser.add_argument(
+            "--chart",
+            type=int,
+            action="append",
+            dest="charts",
+            help="ChartConfig id (repeatable). Defaults to every chart with cache_measurements enabled.",
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=None,
+            help="How far back to backfill (default SPC_DEFAULT_LOOKBACK_DAYS)",
+        )
+
+    def handle(self, *args, **options):
+        if options["charts"]:
+            charts = ChartConfig.objects.filter(id__in=options["charts"])
+            missing = set(options["charts"]) - set(charts.values_list("id", flat=True))
+            if missing:
+                raise CommandError(f"Unknown chart ids: {sorted(missing)}")
+        else:
+            charts = ChartConfig.objects.filter(cache_measurements=True)
+
+        service = MeasurementCacheService()
+        now = timezone.make_naive(timezone.now())
+        days = options["days"] or getattr(settings, "SPC_DEFAULT_LOOKBACK_DAYS", 30)
+
+        for config in charts.select_related("data_source"):
+            if options["action"] == "purge":
+                service.purge(config)
+                self.stdout.write(f"{config}: purged")
+                continue
+
+            if options["action"] == "backfill":
+                start_date = now - timedelta(days=days)
+            else:
+                # Only fetch past the watermark; an empty cache starts from the default lookback
+                start_date = now - timedelta(
+                    days=getattr(settings, "SPC_DEFAULT_LOOKBACK_DAYS", 30)
+                )
+                cached = getattr(config, "measurement_cache", None)
+                if cached is not None and cached.low_watermark is not None:
+                    start_date = max(
+                        start_date, timezone.make_naive(cached.low_watermark)
+                    )
+
+            try:
+                # Not a request: waits out another sync unless it is stuck
+                added = service.sync(
+                    config,
+                    start_date,
+                    now,
+                    wait=getattr(settings, "SPC_CACHE_SYNC_TIMEOUT", 120),
+                )
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(f"{config}: failed - {e}"))
+                continue
+            self.stdout.write(self.style.SUCCESS(f"{config}: {added} rows added"))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from spc.snapshots import get_snapshot_settings, snapshot_service
+
+
+class Command(BaseCommand):
+    help = (
+        "Precompute snapshots of hot charts (precompute_snapshots) on their "
+        "snapshot_interval. Runs until interrupted; run one per deployment."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Refresh the charts that are due and exit (for cron)",
+        )
+
+    def handle(self, *args, **options):
+        if options["once"]:
+            refreshed = snapshot_service.run_pending()
+            self.stdout.write(self.style.SUCCESS(f"{refreshed} snapshots refreshed"))
+            return
+
+        self.stdout.write(
+            f"Snapshot scheduler running, checking every "
+            f"{get_snapshot_settings()['TICK']} s (Ctrl+C to stop)"
+        )
+        try:
+            snapshot_service.run_forever()
+        except KeyboardInterrupt:
+            pass
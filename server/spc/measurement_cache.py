@@ -0,0 +1,362 @@
+import hashlib
+import logging
+import time
+import uuid
+from datetime import timedelta
+
+import pandas as pd
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import (
+    ChartConfig,
+    Measurement,
+    MeasurementCache,
+    RollupBucket,
+    StatisticsBucket,
+)
+from .services import DataSourceService
+from .moments import BucketStatistics
+from .rollups import RollupPyramid
+
+logger = logging.getLogger(__name__)
+
+# Seconds between attempts to take a sync claim held by another sync
+CLAIM_POLL_INTERVAL = 0.2
+
+
+class SyncClaimLost(Exception):
+    """
+    The cache was purged, or the sync taken over, while a sync was copying
+    """
+
+
+class SyncBusy(Exception):
+    """
+    Another sync kept the chart's claim for longer than the caller waits
+    """
+
+
+def source_key(config: ChartConfig) -> str:
+    """
+    Fingerprint of everything that decides which rows a chart reads from its
+    source. A change means the cached measurements belong to another series.
+    """
+    source = config.data_source
+    parts = [
+        source.engine,
+        source.host,
+        source.port,
+        source.database_name,
+        config.table_name,
+        config.value_column,
+        config.datetime_column,
+        config.product_column,
+        config.product_identifier,
+        config.operation_column,
+        config.operation_identifier,
+    ]
+    return hashlib.sha256("\x1f".join(str(p) for p in parts).encode()).hexdigest()
+
+
+def to_naive(value):
+    if value is not None and timezone.is_aware(value):
+        return timezone.make_naive(value)
+    return value
+
+
+def naive_timestamps(series: pd.Series) -> pd.Series:
+    series = pd.to_datetime(series)
+    if series.dt.tz is not None:
+        series = series.dt.tz_convert(timezone.get_default_timezone()).dt.tz_localize(
+            None
+        )
+    return series
+
+
+class MeasurementCacheService:
+    """
+    Keeps a local copy of each cached chart's measurements. The covered range
+    [low_watermark, watermark] only ever grows: newer rows are fetched after
+    the watermark and older windows are backfilled below the low watermark.
+    Added rows are folded into the chart's bucket statistics and rollups.
+    """
+
+    def __init__(self, ds_service: DataSourceService = None):
+        self.ds_service = ds_service or DataSourceService()
+        self.buckets = BucketStatistics()
+        self.rollups = RollupPyramid()
+
+    def sync(self, config: ChartConfig, start_date, end_date, wait=None) -> int:
+        """
+        Makes sure the window is covered locally, fetching only the missing
+        rows from the source. Returns the number of rows added.
+
+        Only one sync copies rows for a chart at a time: it claims the cache
+        row, then commits every chunk together with the watermark it moves,
+        so a failed sync keeps what it copied and the next one resumes there.
+        The row lock is only held to claim, release and commit. Raises
+        SyncBusy when another sync holds the claim for more than `wait`
+        seconds (SPC_CACHE_SYNC_WAIT by default).
+        """
+        if wait is None:
+            wait = getattr(settings, "SPC_CACHE_SYNC_WAIT", 5)
+        token = self._claim(config, wait)
+        added = 0
+        try:
+            state = MeasurementCache.objects.get(chart=config)
+            key = source_key(config)
+            if state.source_key != key:
+                if state.source_key:
+                    logger.info(f"Source changed for chart {config.pk}, purging cache")
+                self._reset(config, state)
+                state.source_key = key
+            self.buckets.ensure_width(config, state)
+            self.rollups.ensure_built(config, state)
+            state.save(
+                update_fields=[
+                    "source_key",
+                    "low_watermark",
+                    "watermark",
+                    "row_count",
+                    "bucket_seconds",
+                    "synced_at",
+                ]
+            )
+
+            low = to_naive(state.low_watermark)
+            high = to_naive(state.watermark)
+            if low is None or high is None:
+                # Nothing cached yet
+                added += self._copy_forward(config, token, start_date, end_date)
+            else:
+                if start_date < low:
+                    added += self._copy_backward(config, token, start_date, low)
+                if end_date > high:
+                    added += self._copy_forward(
+                        config, token, high, end_date, exclusive_start=True
+                    )
+        except SyncClaimLost:
+            logger.info(f"Cache sync of chart {config.pk} lost its claim, stopping")
+            return added
+        except BaseException:
+            self._release(config, token)
+            raise
+        self._release(config, token, synced=True)
+        return added
+
+    def _claim(self, config: ChartConfig, wait: float) -> str:
+        """
+        Takes the chart's sync claim, waiting up to `wait` seconds while
+        another sync holds it unless that one has not committed for
+        SPC_CACHE_SYNC_TIMEOUT seconds
+        """
+        timeout = timedelta(seconds=getattr(settings, "SPC_CACHE_SYNC_TIMEOUT", 120))
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + wait
+        while True:
+            with transaction.atomic():
+                state, _ = MeasurementCache.objects.select_for_update().get_or_create(
+                    chart=config
+                )
+                now = timezone.now()
+                held = (
+                    state.sync_token
+                    and state.sync_heartbeat is not None
+                    and now - state.sync_heartbeat < timeout
+                )
+                if not held:
+                    if state.sync_token:
+                        logger.warning(
+                            f"Taking over the stale cache sync of chart {config.pk}"
+                        )
+                    state.sync_token = token
+                    state.sync_heartbeat = now
+                    state.save(update_fields=["sync_token", "sync_heartbeat"])
+                    return token
+            if time.monotonic() >= deadline:
+                raise SyncBusy(f"Chart {config.pk} is being synced by another request")
+            time.sleep(CLAIM_POLL_INTERVAL)
+
+    @staticmethod
+    def _release(config: ChartConfig, token: str, synced: bool = False):
+        fields = {"sync_token": "", "sync_heartbeat": None}
+        if synced:
+            fields["synced_at"] = timezone.now()
+        MeasurementCache.objects.filter(chart=config, sync_token=token).update(**fields)
+
+    def backfill(self, config: ChartConfig, start_date, end_date=None) -> int:
+        if end_date is None:
+            end_date = to_naive(timezone.now())
+        return self.sync(config, start_date, end_date)
+
+    def purge(self, config: ChartConfig):
+        with transaction.atomic():
+            state = (
+                MeasurementCache.objects.select_for_update()
+                .filter(chart=config)
+                .first()
+            )
+            if state is None:
+                Measurement.objects.filter(chart=config).delete()
+                return
+            self._reset(config, state)
+            # A sync still copying stops at its next chunk
+            state.sync_token = ""
+            state.sync_heartbeat = None
+            state.save()
+
+    def get_measurements(
+        self, config: ChartConfig, start_date, end_date, max_rows: int
+    ) -> pd.DataFrame:
+        """
+        Reads the newest max_rows cached measurements in the window as a
+        (timestamp, value) DataFrame sorted oldest first.
+        """
+        rows = (
+            Measurement.objects.filter(
+                chart=config,
+                timestamp__gte=timezone.make_aware(start_date),
+                timestamp__lte=timezone.make_aware(end_date),
+            )
+            .order_by("-timestamp")
+            .values_list("timestamp", "value")[:max_rows]
+        )
+        df = pd.DataFrame.from_records(list(rows), columns=["timestamp", "value"])
+        if df.empty:
+            return df
+        df["timestamp"] = naive_timestamps(df["timestamp"])
+        return df.iloc[::-1].reset_index(drop=True)
+
+    def _copy_forward(
+        self,
+        config: ChartConfig,
+        token: str,
+        start_date,
+        end_date,
+        exclusive_start: bool = False,
+    ) -> int:
+        """
+        Streams source rows in the window into the local table oldest first,
+        in chunks of SPC_FETCH_CHUNK_SIZE so memory stays flat however wide
+        the window is. Each chunk is committed with the watermark moved to
+        its last timestamp; rows sharing that timestamp are held back to the
+        next chunk so a resumed sync can start strictly after the watermark.
+        """
+        # Avoid the circular import, CalculationService reads from this cache
+        from .calculation_service import CalculationService
+
+        query, params = CalculationService.build_query(
+            config,
+            start_date,
+            end_date,
+            None,
+            ascending=True,
+            exclusive_start=exclusive_start,
+        )
+        low = None if exclusive_start else start_date
+        added = 0
+        pending = None
+        for chunk in self.ds_service.stream_series(config.data_source, query, params):
+            if pending is not None:
+                chunk = pd.concat([pending, chunk], ignore_index=True)
+            last = chunk["timestamp"].iloc[-1]
+            ready = chunk["timestamp"] < last
+            pending = chunk[~ready]
+            if ready.any():
+                done = chunk[ready]
+                added += self._commit(
+                    config, token, done, watermark=done["timestamp"].iloc[-1], low=low
+                )
+        if pending is not None:
+            added += self._commit(
+                config, token, pending, watermark=pending["timestamp"].iloc[-1], low=low
+            )
+        elif low is not None:
+            self._commit(config, token, pending, low=low)
+        return added
+
+    def _copy_backward(
+        self, config: ChartConfig, token: str, start_date, before
+    ) -> int:
+        """
+        Backfills the rows from start_date up to (excluding) `before`, the
+        low watermark, newest first so each committed chunk extends the
+        covered range downwards
+        """
+        # Avoid the circular import, CalculationService reads from this cache
+        from .calculation_service import CalculationService
+
+        query, params = CalculationService.build_query(config, start_date, before, None)
+        added = 0
+        pending = None
+        for chunk in self.ds_service.stream_series(config.data_source, query, params):
+            chunk = chunk[chunk["timestamp"] < before]
+            if pending is not None:
+                chunk = pd.concat([pending, chunk], ignore_index=True)
+            if chunk.empty:
+                continue
+            first = chunk["timestamp"].iloc[-1]
+            ready = chunk["timestamp"] > first
+            pending = chunk[~ready]
+            if ready.any():
+                done = chunk[ready]
+                added += self._commit(
+                    config, token, done, low=done["timestamp"].iloc[-1]
+                )
+        added += self._commit(config, token, pending, low=start_date)
+        return added
+
+    def _commit(
+        self, config: ChartConfig, token: str, df, watermark=None, low=None
+    ) -> int:
+        """
+        Stores a chunk and moves the watermarks in one transaction, provided
+        the sync still holds the chart's claim
+        """
+        with transaction.atomic():
+            state = MeasurementCache.objects.select_for_update().get(chart=config)
+            if state.sync_token != token:
+                raise SyncClaimLost()
+            added = self._store(config, df) if df is not None else 0
+            state.row_count += added
+            if watermark is not None:
+                state.watermark = timezone.make_aware(
+                    pd.Timestamp(watermark).to_pydatetime()
+                )
+            if low is not None:
+                state.low_watermark = timezone.make_aware(
+                    pd.Timestamp(low).to_pydatetime()
+                )
+            state.sync_heartbeat = timezone.now()
+            state.save()
+        return added
+
+    def _store(self, config: ChartConfig, df: pd.DataFrame) -> int:
+        values = pd.to_numeric(df["value"], errors="coerce")
+        df = df.assign(value=values).dropna(subset=["timestamp", "value"])
+        Measurement.objects.bulk_create(
+            [
+                Measurement(
+                    chart=config,
+                    timestamp=timezone.make_aware(ts.to_pydatetime()),
+                    value=value,
+                )
+                for ts, value in zip(df["timestamp"], df["value"])
+            ],
+            batch_size=5000,
+        )
+        self.buckets.add(config, df)
+        self.rollups.add(config, df)
+        return len(df)
+
+    @staticmethod
+    def _reset(config: ChartConfig, state: MeasurementCache):
+        Measurement.objects.filter(chart=config).delete()
+        StatisticsBucket.objects.filter(chart=config).delete()
+        RollupBucket.objects.filter(chart=config).delete()
+        state.low_watermark = None
+        state.watermark = None
+        state.row_count = 0
+        state.bucket_seconds = 0
+        state.synced_at = None
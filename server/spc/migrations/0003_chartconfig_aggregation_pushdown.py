@@ -0,0 +1,21 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spc", "0002_chartconfig_datetime_column_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chartconfig",
+            name="aggregation_pushdown",
+            field=models.BooleanField(
+                default=True,
+                help_text="Aggregate in the source database; falls back to pandas if the query fails",
+            ),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spc", "0003_chartconfig_aggregation_pushdown"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chartconfig",
+            name="cache_measurements",
+            field=models.BooleanField(
+                default=False,
+                help_text="Keep fetched measurements locally and only fetch new rows from the source",
+            ),
+        ),
+        migrations.CreateModel(
+            name="MeasurementCache",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("source_key", models.CharField(blank=True, max_length=64)),
+                ("low_watermark", models.DateTimeField(blank=True, null=True)),
+                ("watermark", models.DateTimeField(blank=True, null=True)),
+                ("row_count", models.IntegerField(default=0)),
+                ("synced_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "chart",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="measurement_cache",
+                        to="spc.chartconfig",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="Measurement",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("timestamp", models.DateTimeField()),
+                ("value", models.FloatField()),
+                (
+                    "chart",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="measurements",
+                        to="spc.chartconfig",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["chart", "timestamp"],
+                        name="spc_measure_chart_i_34c774_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spc", "0004_measurement_cache"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="measurementcache",
+            name="bucket_seconds",
+            field=models.IntegerField(
+                default=0, help_text="Width of the chart's StatisticsBucket rows"
+            ),
+        ),
+        migrations.CreateModel(
+            name="StatisticsBucket",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("bucket_start", models.DateTimeField()),
+                ("count", models.IntegerField(default=0)),
+                ("mean", models.FloatField(default=0.0)),
+                ("m2", models.FloatField(default=0.0)),
+                ("min", models.FloatField(default=0.0)),
+                ("max", models.FloatField(default=0.0)),
+                (
+                    "chart",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="statistics_buckets",
+                        to="spc.chartconfig",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("chart", "bucket_start")},
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spc", "0005_statistics_bucket"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="datasource",
+            name="extraction_mode",
+            field=models.CharField(
+                choices=[
+                    ("CURSOR", "Cursor fetch"),
+                    ("COPY_CSV", "COPY, CSV"),
+                    ("COPY_BINARY", "COPY, binary"),
+                ],
+                default="CURSOR",
+                help_text="How measurements are read from PostgreSQL sources; COPY is faster for large pulls",
+                max_length=20,
+            ),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 6.0.2 on 2026-10-18 14:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spc", "0006_datasource_extraction_mode"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chartconfig",
+            name="precompute_snapshots",
+            field=models.BooleanField(
+                default=False,
+                help_text="Hot chart: keep a precomputed snapshot of its default window",
+            ),
+        ),
+        migrations.AddField(
+            model_name="chartconfig",
+            name="snapshot_interval",
+            field=models.PositiveIntegerField(
+                default=60, help_text="Seconds between precomputed snapshots"
+            ),
+        ),
+        migrations.CreateModel(
+            name="ChartSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("config_key", models.CharField(blank=True, max_length=255)),
+                ("payload", models.BinaryField(blank=True, null=True)),
+                ("computed_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "full_computed_at",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="Last recomputation of the whole window",
+                        null=True,
+                    ),
+                ),
+                (
+                    "duration",
+                    models.FloatField(default=0.0, help_text="Seconds spent computing"),
+                ),
+                ("error", models.TextField(blank=True)),
+                (
+                    "chart",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="snapshot",
+                        to="spc.chartconfig",
+                    ),
+                ),
+            ],
+        ),
+    ]
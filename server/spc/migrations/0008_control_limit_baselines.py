@@ -0,0 +1,99 @@
+# Generated by Django 6.0.2 on 2026-10-18 14:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spc", "0007_chart_snapshots"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chartconfig",
+            name="display_days",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="Days shown by default (SPC_DEFAULT_LOOKBACK_DAYS if empty); with frozen control limits only this window is fetched",
+                null=True,
+            ),
+        ),
+        migrations.CreateModel(
+            name="ControlLimitBaseline",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("version", models.PositiveIntegerField()),
+                ("is_active", models.BooleanField(default=True)),
+                (
+                    "start",
+                    models.DateTimeField(help_text="Start of the baseline period"),
+                ),
+                ("end", models.DateTimeField(help_text="End of the baseline period")),
+                ("aggregation_type", models.CharField(max_length=50)),
+                ("aggregation_size", models.IntegerField()),
+                (
+                    "chart_type",
+                    models.CharField(
+                        choices=[("xbar", "X̄-R / X̄-S"), ("i_mr", "I-MR")],
+                        max_length=10,
+                    ),
+                ),
+                ("center", models.FloatField(help_text="Frozen centre line")),
+                (
+                    "ucl",
+                    models.FloatField(
+                        help_text="Upper control limit (X̄ at the median subgroup size)",
+                        null=True,
+                    ),
+                ),
+                (
+                    "lcl",
+                    models.FloatField(
+                        help_text="Lower control limit (X̄ at the median subgroup size)",
+                        null=True,
+                    ),
+                ),
+                ("sigma_within", models.FloatField(null=True)),
+                ("sigma_overall", models.FloatField(null=True)),
+                ("limits", models.JSONField(default=dict)),
+                ("plotted_mean", models.FloatField(null=True)),
+                ("plotted_std", models.FloatField(null=True)),
+                ("subgroups", models.IntegerField(default=0)),
+                ("measurements", models.IntegerField(default=0)),
+                ("computed_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "chart",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="baselines",
+                        to="spc.chartconfig",
+                    ),
+                ),
+                (
+                    "created_by",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["chart", "-version"],
+                "unique_together": {("chart", "version")},
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 6.0.2 on 2026-10-18 14:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spc", "0008_control_limit_baselines"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RollupBucket",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "resolution",
+                    models.CharField(
+                        choices=[
+                            ("minute", "Minute"),
+                            ("hour", "Hour"),
+                            ("day", "Day"),
+                            ("week", "Week"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("bucket_start", models.DateTimeField()),
+                ("count", models.IntegerField(default=0)),
+                ("mean", models.FloatField(default=0.0)),
+                ("m2", models.FloatField(default=0.0)),
+                ("min", models.FloatField(default=0.0)),
+                ("max", models.FloatField(default=0.0)),
+                (
+                    "chart",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="rollup_buckets",
+                        to="spc.chartconfig",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("chart", "resolution", "bucket_start")},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-18 16:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spc", "0009_rollup_buckets"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="measurementcache",
+            name="sync_heartbeat",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="measurementcache",
+            name="sync_token",
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
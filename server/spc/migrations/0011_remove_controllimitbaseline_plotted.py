@@ -0,0 +1,21 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:11
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spc", "0010_measurementcache_sync_claim"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="controllimitbaseline",
+            name="plotted_mean",
+        ),
+        migrations.RemoveField(
+            model_name="controllimitbaseline",
+            name="plotted_std",
+        ),
+    ]
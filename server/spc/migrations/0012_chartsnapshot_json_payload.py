@@ -0,0 +1,24 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spc", "0011_remove_controllimitbaseline_plotted"),
+    ]
+
+    # Pickled payloads can't be converted in SQL; the scheduler recomputes
+    # the snapshots on its next pass
+    operations = [
+        migrations.RemoveField(
+            model_name="chartsnapshot",
+            name="payload",
+        ),
+        migrations.AddField(
+            model_name="chartsnapshot",
+            name="payload",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -8,6 +8,11 @@ class DataSource(models.Model):
         MSSQL = "MSSQL", _("Microsoft SQL Server")
         POSTGRES = "POSTGRES", _("PostgreSQL")
 
+    class ExtractionMode(models.TextChoices):
+        CURSOR = "CURSOR", _("Cursor fetch")
+        COPY_CSV = "COPY_CSV", _("COPY, CSV")
+        COPY_BINARY = "COPY_BINARY", _("COPY, binary")
+
     name = models.CharField(max_length=100)
     engine = models.CharField(
         max_length=20, choices=Engine.choices, default=Engine.MSSQL
@@ -20,6 +25,12 @@ class DataSource(models.Model):
         max_length=255, help_text="Stored as plain text for now"
     )  # TODO: Encrypt
     is_active = models.BooleanField(default=True)
+    extraction_mode = models.CharField(
+        max_length=20,
+        choices=ExtractionMode.choices,
+        default=ExtractionMode.CURSOR,
+        help_text="How measurements are read from PostgreSQL sources; COPY is faster for large pulls",
+    )
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -77,6 +88,27 @@ class ChartConfig(models.Model):
     aggregation_size = models.IntegerField(
         default=1, help_text="e.g. 1 Hour or 30 parts"
     )
+    aggregation_pushdown = models.BooleanField(
+        default=True,
+        help_text="Aggregate in the source database; falls back to pandas if the query fails",
+    )
+    cache_measurements = models.BooleanField(
+        default=False,
+        help_text="Keep fetched measurements locally and only fetch new rows from the source",
+    )
+    precompute_snapshots = models.BooleanField(
+        default=False,
+        help_text="Hot chart: keep a precomputed snapshot of its default window",
+    )
+    snapshot_interval = models.PositiveIntegerField(
+        default=60, help_text="Seconds between precomputed snapshots"
+    )
+    display_days = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Days shown by default (SPC_DEFAULT_LOOKBACK_DAYS if empty); "
+        "with frozen control limits only this window is fetched",
+    )
 
     weco_rules = models.JSONField(
         default=dict, help_text="Enabled WECO rules configuration"
@@ -87,3 +119,178 @@ class ChartConfig(models.Model):
 
     def __str__(self):
         return f"{self.title or self.product_identifier} - {self.operation_identifier}"
+
+
+class Measurement(models.Model):
+    """
+    Local copy of a measurement fetched from the chart's source table
+    """
+
+    chart = models.ForeignKey(
+        ChartConfig, on_delete=models.CASCADE, related_name="measurements"
+    )
+    timestamp = models.DateTimeField()
+    value = models.FloatField()
+
+    class Meta:
+        indexes = [models.Index(fields=["chart", "timestamp"])]
+
+    def __str__(self):
+        return f"{self.chart_id} @ {self.timestamp}: {self.value}"
+
+
+class MeasurementCache(models.Model):
+    """
+    Sync state of a chart's local measurements. Rows between low_watermark and
+    watermark have been copied; source_key fingerprints the source table and
+    filters so the cache is dropped when they change. sync_token is held by
+    the one sync copying rows for the chart, which beats sync_heartbeat with
+    every chunk it commits.
+    """
+
+    chart = models.OneToOneField(
+        ChartConfig, on_delete=models.CASCADE, related_name="measurement_cache"
+    )
+    source_key = models.CharField(max_length=64, blank=True)
+    low_watermark = models.DateTimeField(null=True, blank=True)
+    watermark = models.DateTimeField(null=True, blank=True)
+    row_count = models.IntegerField(default=0)
+    bucket_seconds = models.IntegerField(
+        default=0, help_text="Width of the chart's StatisticsBucket rows"
+    )
+    synced_at = models.DateTimeField(null=True, blank=True)
+    sync_token = models.CharField(max_length=32, blank=True)
+    sync_heartbeat = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.chart} cache ({self.row_count} rows)"
+
+
+class StatisticsBucket(models.Model):
+    """
+    Running moments (count, mean, M2, min, max) of a cached chart's
+    measurements within one time bucket
+    """
+
+    chart = models.ForeignKey(
+        ChartConfig, on_delete=models.CASCADE, related_name="statistics_buckets"
+    )
+    bucket_start = models.DateTimeField()
+    count = models.IntegerField(default=0)
+    mean = models.FloatField(default=0.0)
+    m2 = models.FloatField(default=0.0)
+    min = models.FloatField(default=0.0)
+    max = models.FloatField(default=0.0)
+
+    class Meta:
+        unique_together = [("chart", "bucket_start")]
+
+    def __str__(self):
+        return f"{self.chart_id} @ {self.bucket_start} (n={self.count})"
+
+
+class RollupBucket(models.Model):
+    """
+    Running moments of a cached chart's measurements in one bucket of the
+    rollup pyramid (spc/rollups.py). Unlike StatisticsBucket the widths are
+    fixed, independent of the chart's own aggregation.
+    """
+
+    class Resolution(models.TextChoices):
+        MINUTE = "minute", _("Minute")
+        HOUR = "hour", _("Hour")
+        DAY = "day", _("Day")
+        WEEK = "week", _("Week")
+
+    chart = models.ForeignKey(
+        ChartConfig, on_delete=models.CASCADE, related_name="rollup_buckets"
+    )
+    resolution = models.CharField(max_length=10, choices=Resolution.choices)
+    bucket_start = models.DateTimeField()
+    count = models.IntegerField(default=0)
+    mean = models.FloatField(default=0.0)
+    m2 = models.FloatField(default=0.0)
+    min = models.FloatField(default=0.0)
+    max = models.FloatField(default=0.0)
+
+    class Meta:
+        unique_together = [("chart", "resolution", "bucket_start")]
+
+    def __str__(self):
+        return (
+            f"{self.chart_id} {self.resolution} @ {self.bucket_start} (n={self.count})"
+        )
+
+
+class ChartSnapshot(models.Model):
+    """
+    Precomputed payload of a hot chart's default window, written by the
+    snapshot scheduler (spc/snapshots.py). config_key is the chart's result
+    cache key when it was computed, so edits to the chart or its source
+    invalidate it.
+    """
+
+    chart = models.OneToOneField(
+        ChartConfig, on_delete=models.CASCADE, related_name="snapshot"
+    )
+    config_key = models.CharField(max_length=255, blank=True)
+    # Payload with its points in the columnar JSON form (see snapshots.py)
+    payload = models.JSONField(null=True, blank=True)
+    computed_at = models.DateTimeField(null=True, blank=True)
+    full_computed_at = models.DateTimeField(
+        null=True, blank=True, help_text="Last recomputation of the whole window"
+    )
+    duration = models.FloatField(default=0.0, help_text="Seconds spent computing")
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.chart} snapshot ({self.computed_at})"
+
+
+class ControlLimitBaseline(models.Model):
+    """
+    Control limits frozen from a baseline period of a chart (see
+    spc/baselines.py). The active baseline's limits are applied to every
+    window of the chart instead of limits estimated from the window itself.
+    Each recomputation adds a new version; older ones are kept inactive.
+    """
+
+    chart = models.ForeignKey(
+        ChartConfig, on_delete=models.CASCADE, related_name="baselines"
+    )
+    version = models.PositiveIntegerField()
+    is_active = models.BooleanField(default=True)
+    start = models.DateTimeField(help_text="Start of the baseline period")
+    end = models.DateTimeField(help_text="End of the baseline period")
+    # Subgrouping the limits were computed for; not applied once it changes
+    aggregation_type = models.CharField(max_length=50)
+    aggregation_size = models.IntegerField()
+    chart_type = models.CharField(
+        max_length=10, choices=[("xbar", "X̄-R / X̄-S"), ("i_mr", "I-MR")]
+    )
+
+    center = models.FloatField(help_text="Frozen centre line")
+    ucl = models.FloatField(
+        null=True, help_text="Upper control limit (X̄ at the median subgroup size)"
+    )
+    lcl = models.FloatField(
+        null=True, help_text="Lower control limit (X̄ at the median subgroup size)"
+    )
+    sigma_within = models.FloatField(null=True)
+    sigma_overall = models.FloatField(null=True)
+    # Full limits summary (sigma estimates, R / S / MR limits)
+    limits = models.JSONField(default=dict)
+    subgroups = models.IntegerField(default=0)
+    measurements = models.IntegerField(default=0)
+
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL
+    )
+    computed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [("chart", "version")]
+        ordering = ["chart", "-version"]
+
+    def __str__(self):
+        return f"{self.chart} limits v{self.version}"
@@ -0,0 +1,352 @@
+import math
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, Iterable
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import ChartConfig, Measurement, MeasurementCache, StatisticsBucket
+
+# Fixed origin for multi-hour/day buckets so SQL and pandas agree on edges
+BUCKET_ORIGIN = "2000-01-01"
+
+
+class RunningMoments:
+    """
+    Mergeable count / mean / M2 / min / max accumulator. Batches are folded
+    in with Chan's parallel update, so merging the moments of two disjoint
+    sets gives the same result as computing them over the union.
+    """
+
+    __slots__ = ("count", "mean", "m2", "min", "max")
+
+    def __init__(self, count=0, mean=0.0, m2=0.0, min=math.inf, max=-math.inf):
+        self.count = int(count)
+        self.mean = float(mean)
+        self.m2 = float(m2)
+        self.min = float(min)
+        self.max = float(max)
+
+    @classmethod
+    def from_values(cls, values) -> "RunningMoments":
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return cls()
+        mean = values.mean()
+        return cls(
+            count=len(values),
+            mean=mean,
+            m2=((values - mean) ** 2).sum(),
+            min=values.min(),
+            max=values.max(),
+        )
+
+    @classmethod
+    def by_group(cls, values: pd.Series, keys) -> Dict[Any, "RunningMoments"]:
+        """
+        {key: moments of the values with that key} from one vectorised groupby
+        """
+        stats = values.groupby(keys).agg(["count", "mean", "var", "min", "max"])
+        stats = stats[stats["count"] > 0]
+        m2 = (stats["var"].fillna(0.0) * (stats["count"] - 1)).to_numpy()
+        return {
+            key: cls(count, mean, m2_, min_, max_)
+            for key, count, mean, m2_, min_, max_ in zip(
+                stats.index,
+                stats["count"].to_numpy(),
+                stats["mean"].to_numpy(),
+                m2,
+                stats["min"].to_numpy(),
+                stats["max"].to_numpy(),
+            )
+        }
+
+    @classmethod
+    def merge_all(cls, moments: Iterable["RunningMoments"]) -> "RunningMoments":
+        total = cls()
+        for m in moments:
+            total.merge(m)
+        return total
+
+    def update(self, values) -> "RunningMoments":
+        return self.merge(RunningMoments.from_values(values))
+
+    def merge(self, other: "RunningMoments") -> "RunningMoments":
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.min, self.max = other.min, other.max
+            return self
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def variance(self) -> float:
+        # Sample variance (ddof=1) to match pandas
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance) if self.count > 1 else np.nan
+
+    def as_statistics(self) -> Dict[str, Any]:
+        """
+        Same keys as CalculationService.series_statistics
+        """
+        if self.count == 0:
+            return {
+                "mean": np.nan,
+                "std_dev": np.nan,
+                "min": np.nan,
+                "max": np.nan,
+                "count": 0,
+            }
+        return {
+            "mean": self.mean,
+            "std_dev": self.std,
+            "min": self.min,
+            "max": self.max,
+            "count": self.count,
+        }
+
+
+def bucket_width(config: ChartConfig) -> pd.Timedelta:
+    """
+    Time charts keep one bucket per plotted bucket. COUNT and raw charts need
+    statistics over raw measurements only, hourly buckets are enough for that.
+    """
+    n = max(config.aggregation_size, 1)
+    if config.aggregation_type == "TIME_HOUR":
+        return pd.Timedelta(hours=n)
+    if config.aggregation_type == "TIME_DAY":
+        return pd.Timedelta(days=n)
+    return pd.Timedelta(hours=1)
+
+
+def bucket_starts(
+    timestamps: pd.Series, width: pd.Timedelta, origin: str = BUCKET_ORIGIN
+) -> pd.Series:
+    origin = pd.Timestamp(origin)
+    return origin + ((timestamps - origin) // width) * width
+
+
+def merge_moments(keys, count, mean, m2, min, max):
+    """
+    Vectorised Chan merge: the moments sharing a key combined into one per
+    key, as arrays (keys, count, mean, m2, min, max) sorted by key. Raw
+    values are moments of count 1 (m2 0, min = max = mean).
+    """
+    keys = np.asarray(keys)
+    if len(keys) == 0:
+        return keys, count, mean, m2, min, max
+    order = np.argsort(keys, kind="stable")
+    keys, count, mean, m2 = keys[order], count[order], mean[order], m2[order]
+    min, max = min[order], max[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    total = np.add.reduceat(count, starts)
+    merged = np.add.reduceat(count * mean, starts) / total
+    # Spread within the parts plus that of the part means around the merged mean
+    delta = mean - np.repeat(merged, np.diff(np.r_[starts, len(keys)]))
+    merged_m2 = np.add.reduceat(m2 + count * delta**2, starts)
+    return (
+        keys[starts],
+        total,
+        merged,
+        merged_m2,
+        np.minimum.reduceat(min, starts),
+        np.maximum.reduceat(max, starts),
+    )
+
+
+def moments_frame(moments: Dict[Any, RunningMoments]) -> pd.DataFrame:
+    """
+    {bucket start: moments} in time order, in the same shape as
+    CalculationService.aggregate
+    """
+    records = [
+        {
+            "timestamp": pd.Timestamp(start),
+            "mean": m.mean,
+            "std": m.std,
+            "count": m.count,
+            "min": m.min,
+            "max": m.max,
+        }
+        for start, m in moments.items()
+    ]
+    grouped = pd.DataFrame.from_records(
+        records, columns=["timestamp", "mean", "std", "count", "min", "max"]
+    )
+    grouped["range"] = grouped["max"] - grouped["min"]
+    return grouped
+
+
+def measurement_frame(rows) -> pd.DataFrame:
+    """
+    (timestamp, value) rows of cached measurements as a DataFrame with naive
+    server-time timestamps
+    """
+    df = pd.DataFrame.from_records(list(rows), columns=["timestamp", "value"])
+    if not df.empty:
+        df["timestamp"] = (
+            pd.to_datetime(df["timestamp"], utc=True)
+            .dt.tz_convert(timezone.get_default_timezone())
+            .dt.tz_localize(None)
+        )
+    return df
+
+
+class BucketStatistics:
+    """
+    Persists RunningMoments per chart and time bucket for cached charts, so
+    new measurements only touch the buckets they fall in and statistics for
+    a window are merged from stored buckets instead of rescanning raw rows.
+    """
+
+    def add(self, config: ChartConfig, df: pd.DataFrame):
+        """
+        Folds newly cached (timestamp, value) rows into their buckets
+        """
+        if df.empty:
+            return
+        width = bucket_width(config)
+        grouped = df.groupby(bucket_starts(df["timestamp"], width))["value"]
+        batch = {start: RunningMoments.from_values(values) for start, values in grouped}
+        starts = [timezone.make_aware(start.to_pydatetime()) for start in batch]
+
+        with transaction.atomic():
+            existing = {
+                timezone.make_naive(b.bucket_start): b
+                for b in StatisticsBucket.objects.select_for_update().filter(
+                    chart=config, bucket_start__in=starts
+                )
+            }
+            created, updated = [], []
+            for start, moments in batch.items():
+                start = start.to_pydatetime()
+                bucket = existing.get(start)
+                if bucket is None:
+                    bucket = StatisticsBucket(
+                        chart=config, bucket_start=timezone.make_aware(start)
+                    )
+                    created.append(bucket)
+                else:
+                    moments = self._moments(bucket).merge(moments)
+                    updated.append(bucket)
+                self._store_moments(bucket, moments)
+
+            StatisticsBucket.objects.bulk_create(created, batch_size=5000)
+            StatisticsBucket.objects.bulk_update(
+                updated, ["count", "mean", "m2", "min", "max"], batch_size=5000
+            )
+
+    def ensure_width(self, config: ChartConfig, state: MeasurementCache):
+        """
+        Rebuilds the buckets from cached measurements when the chart's bucket
+        width changed (aggregation_type / aggregation_size edited).
+        """
+        seconds = int(bucket_width(config).total_seconds())
+        if state.bucket_seconds == seconds:
+            return
+        self.rebuild(config)
+        state.bucket_seconds = seconds
+
+    def rebuild(self, config: ChartConfig, chunk_size: int = 100000):
+        StatisticsBucket.objects.filter(chart=config).delete()
+        rows = (
+            Measurement.objects.filter(chart=config)
+            .order_by("timestamp")
+            .values_list("timestamp", "value")
+            .iterator(chunk_size=chunk_size)
+        )
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                self.add(config, measurement_frame(chunk))
+                chunk = []
+        if chunk:
+            self.add(config, measurement_frame(chunk))
+
+    def window_buckets(self, config: ChartConfig, start_date, end_date) -> pd.DataFrame:
+        """
+        Per-bucket aggregates for the window, in the same shape as
+        CalculationService.aggregate.
+        """
+        return moments_frame(self._window(config, start_date, end_date))
+
+    def window_moments(
+        self, config: ChartConfig, start_date, end_date
+    ) -> RunningMoments:
+        """
+        Moments of every cached raw measurement in the window
+        """
+        return RunningMoments.merge_all(
+            self._window(config, start_date, end_date).values()
+        )
+
+    def _window(self, config: ChartConfig, start_date, end_date):
+        """
+        Buckets entirely inside the window come from the stored moments; the
+        (at most two) buckets cut by the window edges are recomputed from the
+        cached raw rows. Returns {bucket_start: RunningMoments} in time order.
+        """
+        width = bucket_width(config)
+        stored = StatisticsBucket.objects.filter(
+            chart=config,
+            bucket_start__gte=timezone.make_aware(start_date),
+            bucket_start__lte=timezone.make_aware(end_date - width.to_pytimedelta()),
+        )
+        moments = {
+            pd.Timestamp(timezone.make_naive(b.bucket_start)): self._moments(b)
+            for b in stored
+        }
+
+        rows = Measurement.objects.filter(
+            chart=config,
+            timestamp__gte=timezone.make_aware(start_date),
+            timestamp__lte=timezone.make_aware(end_date),
+        )
+        if moments:
+            # Only rows outside the run of stored buckets
+            inner_start = min(moments).to_pydatetime()
+            inner_end = (max(moments) + width).to_pydatetime()
+            rows = rows.filter(
+                Q(timestamp__lt=timezone.make_aware(inner_start))
+                | Q(timestamp__gte=timezone.make_aware(inner_end))
+            )
+        df = measurement_frame(rows.values_list("timestamp", "value"))
+        if not df.empty:
+            for start, values in df.groupby(bucket_starts(df["timestamp"], width))[
+                "value"
+            ]:
+                moments[start] = RunningMoments.from_values(values)
+
+        return {start: moments[start] for start in sorted(moments)}
+
+    @staticmethod
+    def _moments(bucket: StatisticsBucket) -> RunningMoments:
+        return RunningMoments(
+            count=bucket.count,
+            mean=bucket.mean,
+            m2=bucket.m2,
+            min=bucket.min,
+            max=bucket.max,
+        )
+
+    @staticmethod
+    def _store_moments(bucket: StatisticsBucket, moments: RunningMoments):
+        bucket.count = moments.count
+        bucket.mean = moments.mean
+        bucket.m2 = moments.m2
+        bucket.min = moments.min
+        bucket.max = moments.max
@@ -0,0 +1,234 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from contextlib import contextmanager
+from multiprocessing import resource_tracker
+from typing import Any, Dict, Iterable, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .calculation_service import CalculationService
+from .models import ChartConfig
+from .parallel_worker import (
+    SHARED_ROWS,
+    compute_chart,
+    init_worker,
+    ping,
+    share_frame,
+)
+from .result_cache import result_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARALLEL_SETTINGS = {
+    "PROCESSES": None,  # Computation processes (default: one per CPU)
+    "THREADS": 8,  # Threads fetching chart data from the sources
+    # "spawn" is safe alongside the fetch threads and on every platform;
+    # "forkserver" starts workers faster on Linux
+    "START_METHOD": "spawn",
+}
+
+
+def get_parallel_settings() -> Dict[str, Any]:
+    return {**DEFAULT_PARALLEL_SETTINGS, **getattr(settings, "SPC_PARALLEL", {})}
+
+
+class ParallelChartService:
+    """
+    Computes many charts for batch jobs (nightly reports, cache warming).
+    Source reads run in a thread pool; the CPU-bound part of charts that
+    pull raw rows (aggregation, statistics, WECO rules) runs in a process
+    pool, each chart's rows handed over in a shared memory block rather
+    than as a pickled DataFrame. Charts aggregated by the source (pushdown)
+    or by the measurement cache are I/O-bound and stay in the threads.
+
+    Every chart gets a timing record: fetch and compute seconds, rows and
+    the worker process it ran in.
+    """
+
+    def __init__(
+        self,
+        processes: int = None,
+        threads: int = None,
+        calculation_service: CalculationService = None,
+    ):
+        parallel_settings = get_parallel_settings()
+        self.processes = (
+            processes or parallel_settings["PROCESSES"] or os.cpu_count() or 1
+        )
+        self.threads = threads or parallel_settings["THREADS"]
+        self.start_method = parallel_settings["START_METHOD"]
+        self.calculation_service = calculation_service or CalculationService()
+
+    @contextmanager
+    def pool(self):
+        """
+        A started process pool. Workers are all started up front, before any
+        fetch thread exists.
+        """
+        # Started first so forked workers share it instead of starting
+        # their own, which would unlink shared blocks when they exit
+        resource_tracker.ensure_running()
+        with ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context(self.start_method),
+            initializer=init_worker,
+            initargs=(settings.SETTINGS_MODULE,),
+        ) as pool:
+            for future in [pool.submit(ping) for _ in range(self.processes)]:
+                future.result()
+            yield pool
+
+    def get_charts_data(
+        self, chart_ids: Iterable[int], start_date=None, end_date=None
+    ) -> Tuple[Dict[int, Dict[str, Any]], Dict[int, Dict[str, Any]]]:
+        """
+        Returns (payloads, timings) keyed by chart id. Payloads are stored in
+        the chart result cache, keyed like the regular chart requests.
+        """
+        chart_ids = list(chart_ids)
+        service = self.calculation_service
+        requested_start, requested_end = start_date, end_date
+        # One end for every chart; the start follows each chart's display window
+        end_date = service.resolve_window(start_date, end_date)[1]
+        max_rows = getattr(settings, "SPC_MAX_ROWS", 100000)
+        configs = ChartConfig.objects.select_related("data_source").in_bulk(chart_ids)
+        results = {
+            chart_id: {"error": "Chart configuration not found"}
+            for chart_id in chart_ids
+            if chart_id not in configs
+        }
+        windows = {
+            config.pk: service.chart_window(config, requested_start, end_date)
+            for config in configs.values()
+        }
+        timings = {}
+
+        def fetch(config):
+            started = time.perf_counter()
+            try:
+                df = service.fetch_raw(config, *windows[config.pk], max_rows)
+            finally:
+                close_old_connections()
+            return config, df, time.perf_counter() - started, windows[config.pk]
+
+        def compute(config):
+            started = time.perf_counter()
+            try:
+                payload = service.compute_chart_data(config, *windows[config.pk])
+            except Exception as e:
+                logger.exception(f"Parallel computation failed for chart {config.pk}")
+                payload = {"error": str(e)}
+            finally:
+                close_old_connections()
+            return config, payload, time.perf_counter() - started
+
+        with self.pool() as pool, ThreadPoolExecutor(self.threads) as threads:
+            fetches, computes = {}, []
+            for config in configs.values():
+                if config.cache_measurements or (
+                    config.aggregation_pushdown and service.supports_pushdown(config)
+                ):
+                    computes.append(threads.submit(compute, config))
+                else:
+                    fetches[threads.submit(fetch, config)] = config
+
+            def fetched():
+                pending = set(fetches)
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        try:
+                            frame = future.result()
+                        except Exception as e:
+                            # Left out of the result cache with the other errors
+                            config = fetches[future]
+                            logger.exception(
+                                f"Parallel fetch failed for chart {config.pk}"
+                            )
+                            results[config.pk] = {"error": str(e)}
+                            timings[config.pk] = {
+                                "mode": "process",
+                                "rows": None,
+                                "fetch": None,
+                                "compute": None,
+                                "process": None,
+                            }
+                            continue
+                        yield frame
+
+            frames = self.compute_frames(fetched(), pool)
+            for config, payload, timing in frames:
+                results[config.pk] = payload
+                timings[config.pk] = timing
+
+            for future in computes:
+                config, payload, elapsed = future.result()
+                results[config.pk] = payload
+                timings[config.pk] = {
+                    "mode": "thread",
+                    "rows": None,
+                    "fetch": None,
+                    "compute": elapsed,
+                    "process": None,
+                }
+
+        for config in configs.values():
+            if "error" not in results[config.pk]:
+                key = result_cache.key(config, requested_start, requested_end)
+                result_cache.set(key, results[config.pk])
+        return results, timings
+
+    def compute_frames(self, frames: Iterable[tuple], pool: ProcessPoolExecutor):
+        """
+        Computes charts from already fetched rows in the process pool.
+        `frames` yields (config, raw rows, fetch seconds, (start, end)) and
+        is consumed as it goes, so computation overlaps the remaining
+        fetches. Yields (config, payload, timing) as the charts finish.
+        """
+        running = {}
+        try:
+            for config, df, fetch_seconds, (start_date, end_date) in frames:
+                timing = {
+                    "mode": "process",
+                    "rows": len(df),
+                    "fetch": fetch_seconds,
+                    "compute": None,
+                    "process": None,
+                }
+                shm, spec = share_frame(df)
+                future = pool.submit(compute_chart, config, spec, start_date, end_date)
+                running[future] = (config, df, shm, timing)
+
+            for future in as_completed(list(running)):
+                config, df, shm, timing = running.pop(future)
+                try:
+                    payload, timing["compute"], timing["process"] = future.result()
+                    data = payload.get("data")
+                    if isinstance(data, tuple) and data[0] == SHARED_ROWS:
+                        payload["data"] = df.assign(
+                            **{name: data[1][name].to_numpy() for name in data[1]}
+                        )
+                except Exception as e:
+                    # One broken chart shouldn't fail the whole job
+                    logger.exception(
+                        f"Parallel computation failed for chart {config.pk}"
+                    )
+                    payload = {"error": str(e)}
+                finally:
+                    shm.close()
+                    shm.unlink()
+                yield config, payload, timing
+        finally:
+            for config, df, shm, timing in running.values():
+                shm.close()
+                shm.unlink()
@@ -0,0 +1,107 @@
+import os
+import time
+from multiprocessing import shared_memory
+from typing import Any, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Code run inside the chart computation processes (spc/parallel.py). This
+# module is imported by the workers before Django is set up, so it must not
+# import models at module level.
+
+# Tags a payload's "data" sent back as (SHARED_ROWS, computed columns) when
+# it is the chart's own input rows plus columns such as the moving range
+# (raw charts): the parent already holds the rows, so they aren't sent back.
+SHARED_ROWS = "__shared_rows__"
+
+
+def init_worker(settings_module: str):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    import django
+
+    django.setup()
+
+
+def ping() -> int:
+    return os.getpid()
+
+
+def share_frame(df: pd.DataFrame) -> Tuple[shared_memory.SharedMemory, Dict[str, Any]]:
+    """
+    Copies the frame's columns into one shared memory block. Returns the
+    block (the caller unlinks it) and the spec attach_frame needs to map it.
+    """
+    columns = [(name, np.ascontiguousarray(df[name].to_numpy())) for name in df]
+    size = sum(array.nbytes for _, array in columns)
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    offset = 0
+    spec = {"name": shm.name, "length": len(df), "columns": []}
+    for name, array in columns:
+        view = np.ndarray(array.shape, array.dtype, buffer=shm.buf, offset=offset)
+        view[:] = array
+        del view
+        spec["columns"].append((name, array.dtype.str, offset))
+        offset += array.nbytes
+    return shm, spec
+
+
+def attach_frame(
+    spec: Dict[str, Any],
+) -> Tuple[shared_memory.SharedMemory, pd.DataFrame]:
+    """
+    Maps a block written by share_frame as a DataFrame without copying.
+    Every reference to the frame must be dropped before shm.close().
+    """
+    # Pool workers share the parent's resource tracker (see
+    # ParallelChartService.pool), which already tracks the block
+    shm = shared_memory.SharedMemory(name=spec["name"])
+    df = pd.DataFrame(
+        {
+            name: np.ndarray(
+                spec["length"], np.dtype(dtype), buffer=shm.buf, offset=offset
+            )
+            for name, dtype, offset in spec["columns"]
+        },
+        copy=False,
+    )
+    return shm, df
+
+
+def is_shared(data: pd.DataFrame, df: pd.DataFrame) -> bool:
+    """
+    Whether `data` holds the rows of `df` (a frame mapped by attach_frame)
+    as views of the shared block, e.g. df.assign(...) of it
+    """
+    return len(data) == len(df) and all(
+        name in data and np.shares_memory(data[name].to_numpy(), df[name].to_numpy())
+        for name in df
+    )
+
+
+def compute_chart(config, spec: Dict[str, Any], start_date, end_date):
+    """
+    Computes a chart payload from rows in shared memory. Returns
+    (payload, compute seconds, worker pid).
+    """
+    from .calculation_service import CalculationService
+
+    started = time.perf_counter()
+    shm, df = attach_frame(spec)
+    try:
+        payload = CalculationService().compute_chart_data(
+            config, start_date, end_date, df
+        )
+        data = payload.get("data")
+        if isinstance(data, pd.DataFrame) and is_shared(data, df):
+            payload["data"] = (SHARED_ROWS, data.drop(columns=list(df.columns)))
+        elapsed = time.perf_counter() - started
+    finally:
+        del df
+        try:
+            shm.close()
+        except BufferError:
+            # A view is still referenced (e.g. from a traceback); the
+            # mapping goes away with it
+            pass
+    return payload, elapsed, os.getpid()
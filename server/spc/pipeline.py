@@ -0,0 +1,125 @@
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from . import instrumentation
+from .models import ChartConfig
+from .moments import BUCKET_ORIGIN, bucket_width, merge_moments
+from .query_builder import TIME_BUCKETS
+
+# Per-chunk bucket moments held before they are merged into one set
+PENDING_PARTS = 64
+
+
+class ChunkAggregator:
+    """
+    Folds typed (timestamp, value) chunks, as streamed by
+    DataSourceService.stream_series, into a chart's series without keeping
+    the rows. Time-bucketed charts reduce each chunk to per-bucket moment
+    arrays, merged with vectorised Chan updates, so memory is bounded by the
+    number of buckets; COUNT and raw charts need the rows themselves
+    (ordered) and keep them as compact NumPy arrays.
+
+    `rows` counts every fetched row, including non-numeric ones, to compare
+    against the row cap.
+    """
+
+    def __init__(self, config: ChartConfig, keep_rows: bool = False):
+        self.config = config
+        self.rows = 0
+        self.bucketed = config.aggregation_type in TIME_BUCKETS and not keep_rows
+        if self.bucketed:
+            self.width = bucket_width(config)
+            self.origin = pd.Timestamp(BUCKET_ORIGIN)
+        # (bucket starts, count, mean, m2, min, max) arrays per chunk
+        self.parts: List[tuple] = []
+        self.timestamps = []
+        self.values = []
+
+    def add(self, chunk: pd.DataFrame):
+        with instrumentation.span("aggregate"):
+            self._add(chunk)
+
+    def _add(self, chunk: pd.DataFrame):
+        self.rows += len(chunk)
+        if not self.bucketed:
+            chunk = chunk.dropna(subset=["value"])
+            if not chunk.empty:
+                self.timestamps.append(chunk["timestamp"].to_numpy())
+                self.values.append(chunk["value"].to_numpy())
+            return
+
+        # Plain NumPy from here: pandas overhead dominates 10k-row chunks
+        values = chunk["value"].to_numpy(np.float64)
+        numeric = ~np.isnan(values)
+        if not numeric.all():
+            values = values[numeric]
+        if len(values) == 0:
+            return
+        timestamps = chunk["timestamp"].to_numpy("datetime64[ns]").view(np.int64)
+        if len(timestamps) != len(values):
+            timestamps = timestamps[numeric]
+        origin, width = self.origin.value, self.width.value
+        starts = origin + (timestamps - origin) // width * width
+        self.parts.append(
+            merge_moments(
+                starts,
+                np.ones(len(values)),
+                values,
+                np.zeros(len(values)),
+                values,
+                values,
+            )
+        )
+        if len(self.parts) >= PENDING_PARTS:
+            self.parts = [self._merged()]
+
+    def _merged(self) -> tuple:
+        return merge_moments(*(np.concatenate(column) for column in zip(*self.parts)))
+
+    def extend(self, chunks: Iterable[pd.DataFrame]) -> "ChunkAggregator":
+        for chunk in chunks:
+            self.add(chunk)
+        return self
+
+    def grouped(self) -> Optional[pd.DataFrame]:
+        """
+        Per-bucket aggregates for time-bucketed charts, in the same shape as
+        moments_frame, None otherwise
+        """
+        if not self.bucketed:
+            return None
+        columns = ["timestamp", "mean", "std", "count", "min", "max", "range"]
+        if not self.parts:
+            return pd.DataFrame(columns=columns)
+        starts, count, mean, m2, min_, max_ = self._merged()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            std = np.where(count > 1, np.sqrt(m2 / (count - 1)), np.nan)
+        return pd.DataFrame(
+            {
+                "timestamp": starts.view("datetime64[ns]"),
+                "mean": mean,
+                "std": std,
+                "count": count.astype(np.int64),
+                "min": min_,
+                "max": max_,
+                "range": max_ - min_,
+            },
+            columns=columns,
+        )
+
+    def frame(self, reverse: bool = False) -> pd.DataFrame:
+        """
+        The collected rows (COUNT / raw charts, or keep_rows) in arrival
+        order, or reversed for newest-first chart queries
+        """
+        if not self.values:
+            return pd.DataFrame(columns=["timestamp", "value"])
+        df = pd.DataFrame(
+            {
+                "timestamp": np.concatenate(self.timestamps),
+                "value": np.concatenate(self.values),
+            }
+        )
+        return df.iloc[::-1].reset_index(drop=True) if reverse else df
@@ -0,0 +1,369 @@
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from .models import ChartConfig, DataSource
+from .moments import BUCKET_ORIGIN
+
+# aggregation_type -> (pandas frequency, MSSQL DATEPART, Postgres interval unit)
+TIME_BUCKETS = {
+    "TIME_HOUR": ("h", "hour", "hours"),
+    "TIME_DAY": ("D", "day", "days"),
+}
+
+
+class QueryBuildError(ValueError):
+    """
+    A chart's table or columns don't exist on its source
+    """
+
+
+class Dialect:
+    """
+    Engine-specific SQL pieces. Every value that varies between requests
+    (filters, date bounds, row caps) is a bound parameter, so the statement
+    text is the same for every request of a chart and the source can reuse
+    its cached plan.
+    """
+
+    placeholder = "%s"
+    default_schema = ""
+    float_type = "DOUBLE PRECISION"
+    text_type = "TEXT"
+    stddev = "STDDEV_SAMP"
+
+    def quote(self, name: str) -> str:
+        return '"' + name.replace('"', '""') + '"'
+
+    def top(self) -> str:
+        """
+        Row cap in the SELECT list; takes one parameter when not empty
+        """
+        return ""
+
+    def limit(self) -> str:
+        """
+        Row cap after ORDER BY; takes one parameter when not empty
+        """
+        return f"LIMIT {self.placeholder}"
+
+    def bucket(self, aggregation_type: str, n: int, column: str) -> str:
+        _, datepart, unit = TIME_BUCKETS[aggregation_type]
+        if n == 1:
+            return f"date_trunc('{datepart}', {column})"
+        # PostgreSQL 14+ (and TimescaleDB, where this matches time_bucket)
+        return f"date_bin(INTERVAL '{n} {unit}', {column}, TIMESTAMP '{BUCKET_ORIGIN}')"
+
+
+class MSSQLDialect(Dialect):
+    placeholder = "?"
+    default_schema = "dbo"
+    float_type = "FLOAT"
+    text_type = "NVARCHAR(4000)"
+    stddev = "STDEV"
+
+    def quote(self, name: str) -> str:
+        return "[" + name.replace("]", "]]") + "]"
+
+    def top(self) -> str:
+        return f"TOP ({self.placeholder}) "
+
+    def limit(self) -> str:
+        return ""
+
+    def bucket(self, aggregation_type: str, n: int, column: str) -> str:
+        _, datepart, _ = TIME_BUCKETS[aggregation_type]
+        return (
+            f"DATEADD({datepart}, (DATEDIFF({datepart}, '{BUCKET_ORIGIN}', "
+            f"{column}) / {n}) * {n}, '{BUCKET_ORIGIN}')"
+        )
+
+
+DIALECTS = {
+    DataSource.Engine.MSSQL: MSSQLDialect(),
+    DataSource.Engine.POSTGRES: Dialect(),
+}
+
+
+def get_dialect(source: DataSource) -> Dialect:
+    try:
+        return DIALECTS[source.engine]
+    except KeyError:
+        raise QueryBuildError(f"Unsupported engine: {source.engine}")
+
+
+class TableSchema:
+    """
+    A source table's real schema / table / column names, looked up from
+    INFORMATION_SCHEMA. Configured names are matched case-insensitively.
+    """
+
+    def __init__(self, schema: str, table: str, columns: List[str]):
+        self.schema = schema
+        self.table = table
+        self.columns = {name.lower(): name for name in columns}
+
+    def column(self, name: str) -> str:
+        try:
+            return self.columns[name.strip().lower()]
+        except KeyError:
+            raise QueryBuildError(
+                f"Column {name!r} not found in {self.schema}.{self.table}"
+            )
+
+    def qualified(self, dialect: Dialect) -> str:
+        return f"{dialect.quote(self.schema)}.{dialect.quote(self.table)}"
+
+
+_schemas: Dict[tuple, Tuple[float, TableSchema]] = {}
+_schemas_lock = threading.Lock()
+
+
+def split_table_name(table_name: str) -> Tuple[Optional[str], str]:
+    parts = [part.strip().strip('[]"') for part in table_name.split(".")]
+    if len(parts) == 1:
+        return None, parts[0]
+    if len(parts) == 2:
+        return parts[0], parts[1]
+    raise QueryBuildError(f"Invalid table name: {table_name!r}")
+
+
+def describe_table(source: DataSource, table_name: str, ds_service=None) -> TableSchema:
+    """
+    Column metadata for a source table, cached per process for
+    SPC_COLUMN_METADATA_TTL seconds (and dropped when the source is edited)
+    """
+    key = (source.pk, source.updated_at, table_name)
+    ttl = getattr(settings, "SPC_COLUMN_METADATA_TTL", 300)
+    with _schemas_lock:
+        cached = _schemas.get(key)
+    if cached is not None and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+
+    if ds_service is None:
+        from .services import DataSourceService
+
+        ds_service = DataSourceService()
+
+    dialect = get_dialect(source)
+    schema, table = split_table_name(table_name)
+    query = f"""
+        SELECT table_schema AS table_schema, table_name AS table_name, column_name AS column_name
+        FROM information_schema.columns
+        WHERE LOWER(table_name) = LOWER({dialect.placeholder})
+        ORDER BY table_schema, ordinal_position
+    """
+    df = ds_service.query(source, query, [table])
+    if schema is not None:
+        df = df[df["table_schema"].str.lower() == schema.lower()]
+    if df.empty:
+        raise QueryBuildError(f"Table {table_name!r} not found")
+
+    schemas = list(dict.fromkeys(df["table_schema"]))
+    if len(schemas) > 1:
+        if dialect.default_schema and dialect.default_schema in schemas:
+            schemas = [dialect.default_schema]
+        else:
+            raise QueryBuildError(
+                f"Table {table_name!r} exists in several schemas "
+                f"({', '.join(schemas)}); qualify it as schema.table"
+            )
+    df = df[df["table_schema"] == schemas[0]]
+    # An exact-case match wins over other tables differing only in case
+    names = list(dict.fromkeys(df["table_name"]))
+    name = table if table in names else names[0]
+    df = df[df["table_name"] == name]
+
+    described = TableSchema(schemas[0], name, df["column_name"].tolist())
+    with _schemas_lock:
+        _schemas[key] = (time.monotonic(), described)
+    return described
+
+
+def invalidate_schemas(source_id: int):
+    with _schemas_lock:
+        for key in [key for key in _schemas if key[0] == source_id]:
+            del _schemas[key]
+
+
+def chart_pairs(configs: List[ChartConfig]) -> List[Tuple[str, str]]:
+    """
+    Distinct (product, operation) identifiers of charts, in order
+    """
+    return list(
+        dict.fromkeys((c.product_identifier, c.operation_identifier) for c in configs)
+    )
+
+
+class ChartQuery:
+    """
+    Builds the source queries of one chart from validated, quoted
+    identifiers. Each method returns (sql, params) with params in the order
+    their placeholders appear.
+    """
+
+    def __init__(self, config: ChartConfig, ds_service=None):
+        self.config = config
+        self.dialect = dialect = get_dialect(config.data_source)
+        table = describe_table(config.data_source, config.table_name, ds_service)
+        self.table = table.qualified(dialect)
+        self.timestamp = dialect.quote(table.column(config.datetime_column))
+        self.value = dialect.quote(table.column(config.value_column))
+        self.product = dialect.quote(table.column(config.product_column))
+        self.operation = dialect.quote(table.column(config.operation_column))
+
+    def _top(self, max_rows: Optional[int], params: list) -> str:
+        top = self.dialect.top() if max_rows is not None else ""
+        if top:
+            params.append(int(max_rows))
+        return top
+
+    def _limit(self, max_rows: Optional[int], params: list) -> str:
+        limit = self.dialect.limit() if max_rows is not None else ""
+        if limit:
+            params.append(int(max_rows))
+        return limit
+
+    def _match(self) -> str:
+        p = self.dialect.placeholder
+        return f"{self.product} = {p} AND {self.operation} = {p}"
+
+    def _where(
+        self,
+        configs: List[ChartConfig],
+        start_date,
+        end_date,
+        params: list,
+        exclusive_start: bool = False,
+    ) -> str:
+        p = self.dialect.placeholder
+        pairs = chart_pairs(configs)
+        params.extend([value for pair in pairs for value in pair])
+        params.extend([start_date, end_date])
+        if len(pairs) == 1:
+            match = self._match()
+        else:
+            # Only the requested pairs, not every product x operation
+            match = "(" + " OR ".join([f"({self._match()})"] * len(pairs)) + ")"
+        return f"""
+            WHERE {match}
+            AND {self.timestamp} {">" if exclusive_start else ">="} {p}
+            AND {self.timestamp} <= {p}
+        """
+
+    def raw(
+        self,
+        start_date,
+        end_date,
+        max_rows: int,
+        ascending: bool = False,
+        exclusive_start: bool = False,
+    ):
+        """
+        Newest max_rows measurements inside the window (the oldest ones when
+        ascending, for incremental syncs). max_rows=None reads the whole
+        window, for streamed fetches.
+        """
+        params = []
+        top = self._top(max_rows, params)
+        where = self._where(
+            [self.config], start_date, end_date, params, exclusive_start
+        )
+        query = f"""
+            SELECT {top}{self.timestamp} AS timestamp, {self.value} AS value
+            FROM {self.table}
+            {where}
+            ORDER BY {self.timestamp} {"ASC" if ascending else "DESC"}
+            {self._limit(max_rows, params)}
+        """
+        return query, params
+
+    def batch(self, configs: List[ChartConfig], start_date, end_date, max_rows: int):
+        """
+        Like raw, for charts reading the same table and columns with different
+        product / operation identifiers. Rows are tagged with the index of
+        their pair in chart_pairs(configs), matched by the source itself, so
+        they can be split per chart whatever the columns' types. Each pair
+        keeps its newest max_rows rows, numbered with ROW_NUMBER; rows come
+        back grouped by pair, newest first.
+        """
+        p = self.dialect.placeholder
+        params = []
+        pairs = chart_pairs(configs)
+        cases = " ".join(f"WHEN {self._match()} THEN {i}" for i in range(len(pairs)))
+        params.extend([value for pair in pairs for value in pair])
+        where = self._where(configs, start_date, end_date, params)
+        params.append(int(max_rows))
+        query = f"""
+            SELECT ts AS timestamp, v AS value, pair_id
+            FROM (
+                SELECT ts, v, pair_id,
+                    ROW_NUMBER() OVER (PARTITION BY pair_id ORDER BY ts DESC) AS rn
+                FROM (
+                    SELECT {self.timestamp} AS ts, {self.value} AS v,
+                        CASE {cases} END AS pair_id
+                    FROM {self.table}
+                    {where}
+                ) AS src
+            ) AS ranked
+            WHERE rn <= {p}
+            ORDER BY pair_id, ts DESC
+        """
+        return query, params
+
+    def aggregate(self, start_date, end_date, max_rows: int):
+        """
+        One row per bucket with the columns timestamp, mean, std, count, min,
+        max, newest bucket first.
+
+        TIME_* buckets use DATEADD/DATEDIFF on MSSQL and date_trunc/date_bin
+        on Postgres. COUNT subgroups number the newest max_rows measurements
+        with ROW_NUMBER so the result matches grouping the capped raw rows.
+        """
+        config, dialect = self.config, self.dialect
+        value = f"CAST({self.value} AS {dialect.float_type})"
+        n = max(int(config.aggregation_size), 1)
+        aggregates = (
+            f"AVG(v) AS mean, {dialect.stddev}(v) AS std, COUNT(v) AS count, "
+            "MIN(v) AS min, MAX(v) AS max"
+        )
+
+        params = []
+        if config.aggregation_type in TIME_BUCKETS:
+            bucket = dialect.bucket(config.aggregation_type, n, self.timestamp)
+            top = self._top(max_rows, params)
+            where = self._where([config], start_date, end_date, params)
+            query = f"""
+                SELECT {top}bucket AS timestamp, {aggregates}
+                FROM (
+                    SELECT {bucket} AS bucket, {value} AS v
+                    FROM {self.table}
+                    {where}
+                ) AS src
+                WHERE v IS NOT NULL
+                GROUP BY bucket
+                ORDER BY bucket DESC
+                {self._limit(max_rows, params)}
+            """
+        else:
+            top = self._top(max_rows, params)
+            where = self._where([config], start_date, end_date, params)
+            query = f"""
+                SELECT MIN(ts) AS timestamp, {aggregates}
+                FROM (
+                    SELECT ts, v, (ROW_NUMBER() OVER (ORDER BY ts) - 1) / {n} AS group_id
+                    FROM (
+                        SELECT {top}{self.timestamp} AS ts, {value} AS v
+                        FROM {self.table}
+                        {where}
+                        AND {self.value} IS NOT NULL
+                        ORDER BY {self.timestamp} DESC
+                        {self._limit(max_rows, params)}
+                    ) AS recent
+                ) AS numbered
+                GROUP BY group_id
+                ORDER BY group_id DESC
+            """
+        return query, params
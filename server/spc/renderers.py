@@ -0,0 +1,212 @@
+import json
+import struct
+from typing import Any, Dict
+
+import numpy as np
+import pandas as pd
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .streaming import json_safe
+
+# Chart payloads carry their points as a DataFrame under "data"; the
+# renderers below turn it into records, columns or packed buffers at the edge
+# so the per-point Python objects are only built for the records format.
+
+COLUMNAR_MEDIA_TYPE = "application/vnd.spc.columnar+json"
+PACKED_MEDIA_TYPE = "application/vnd.spc.packed"
+
+# Header length prefix of the packed format, before the JSON header
+PACKED_PREFIX = struct.Struct("<4sI")
+PACKED_MAGIC = b"SPC1"
+
+
+def map_frames(obj, convert):
+    """
+    Applies convert to every DataFrame found in nested dicts (chart
+    payloads, or {"charts": {id: payload}} batches)
+    """
+    if isinstance(obj, pd.DataFrame):
+        return convert(obj)
+    if isinstance(obj, dict):
+        return {key: map_frames(value, convert) for key, value in obj.items()}
+    return obj
+
+
+def frame_records(df: pd.DataFrame):
+    return df.to_dict(orient="records")
+
+
+def frame_arrays(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """
+    Column name -> NumPy array. Timestamps become int64 milliseconds since
+    the epoch (naive, server time, like the records format), so every column
+    is a plain numeric array.
+    """
+    arrays = {}
+    for name in df.columns:
+        column = df[name]
+        if name == "timestamp":
+            arrays[name] = (
+                pd.to_datetime(column).to_numpy("datetime64[ms]").astype(np.int64)
+            )
+        elif name == "count":
+            arrays[name] = column.to_numpy(dtype=np.int64)
+        else:
+            arrays[name] = column.to_numpy(dtype=np.float64)
+    return arrays
+
+
+def frame_columns(df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Columnar JSON: {"length": n, "timestamp": [...], "mean": [...], ...}
+    with NaN sent as null
+    """
+    columns = {"length": len(df)}
+    for name, array in frame_arrays(df).items():
+        if array.dtype.kind == "f":
+            missing = np.isnan(array)
+            if missing.any():
+                array = array.astype(object)
+                array[missing] = None
+        columns[name] = array.tolist()
+    return columns
+
+
+def columns_frame(columns: Dict[str, Any], names=None) -> pd.DataFrame:
+    """
+    Inverse of frame_columns: the DataFrame with naive datetime64
+    timestamps, int64 counts and float64 values (NaN for null). `names`
+    orders the columns.
+    """
+    if names is None:
+        names = [name for name in columns if name != "length"]
+    data = {}
+    for name in names:
+        values = columns[name]
+        if name == "timestamp":
+            data[name] = pd.to_datetime(np.asarray(values, dtype=np.int64), unit="ms")
+        elif name == "count":
+            data[name] = np.asarray(values, dtype=np.int64)
+        else:
+            data[name] = np.asarray(values, dtype=np.float64)
+    return pd.DataFrame(data, columns=names)
+
+
+def pack_payload(payload: Dict[str, Any]) -> bytes:
+    """
+    Binary chart payload:
+
+        4s   magic "SPC1"
+        u32  header length (little endian)
+        ...  UTF-8 JSON header, space padded to a multiple of 8 bytes
+        ...  column buffers, little endian, back to back
+
+    The header is the payload without its points, plus "length" and
+    "columns": [{"name", "dtype" ("int64" | "float64"), "offset"}] with
+    offsets counted from the end of the header. Every buffer starts 8-byte
+    aligned, so a browser can wrap it in a Float64Array / BigInt64Array
+    without copying.
+    """
+    df = payload.get("data")
+    arrays = frame_arrays(df) if isinstance(df, pd.DataFrame) else {}
+    header = json_safe({key: value for key, value in payload.items() if key != "data"})
+    header["length"] = len(df) if isinstance(df, pd.DataFrame) else 0
+
+    header["columns"] = []
+    offset = 0
+    for name, array in arrays.items():
+        header["columns"].append(
+            {"name": name, "dtype": array.dtype.name, "offset": offset}
+        )
+        offset += array.nbytes
+
+    encoded = json.dumps(header, cls=JSONEncoder).encode()
+    encoded = encoded.ljust(len(encoded) + (-len(encoded) % 8), b" ")
+    return b"".join(
+        [PACKED_PREFIX.pack(PACKED_MAGIC, len(encoded)), encoded]
+        + [
+            array.astype(array.dtype.newbyteorder("<")).tobytes()
+            for array in arrays.values()
+        ]
+    )
+
+
+class ChartJSONRenderer(JSONRenderer):
+    """
+    Default format: points as a list of records
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(
+            json_safe(map_frames(data, frame_records)),
+            accepted_media_type,
+            renderer_context,
+        )
+
+
+class ChartColumnarJSONRenderer(JSONRenderer):
+    """
+    Points as one array per column instead of one object per point
+    """
+
+    media_type = COLUMNAR_MEDIA_TYPE
+    format = "columnar"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(
+            # NaN in the columns is already null; don't walk every point
+            map_frames(json_safe(data), frame_columns),
+            accepted_media_type,
+            renderer_context,
+        )
+
+
+class ChartPackedRenderer(BaseRenderer):
+    """
+    Single chart payload as packed little-endian column buffers (pack_payload)
+    """
+
+    media_type = PACKED_MEDIA_TYPE
+    format = "packed"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if "error" in data or "detail" in data:
+            # Errors are small; keep them readable
+            return json.dumps(data, cls=JSONEncoder).encode()
+        return pack_payload(data)
+
+
+CHART_RENDERERS = [ChartJSONRenderer, ChartColumnarJSONRenderer, ChartPackedRenderer]
+
+
+class PrometheusRenderer(BaseRenderer):
+    """
+    The metrics endpoint's text exposition format (Metrics.render)
+    """
+
+    media_type = "text/plain"
+    format = "txt"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if not isinstance(data, str):
+            # Errors are small; keep them readable
+            return json.dumps(data, cls=JSONEncoder).encode()
+        return data.encode(self.charset)
+
+
+def render_chart_payload(data, accept: str = ""):
+    """
+    Content negotiation for the plain async views: returns (body, content
+    type) for the first chart format named in the Accept header
+    """
+    for renderer_class in (ChartPackedRenderer, ChartColumnarJSONRenderer):
+        if renderer_class.media_type in accept:
+            renderer = renderer_class()
+            return renderer.render(data), renderer_class.media_type
+    return ChartJSONRenderer().render(data), "application/json"
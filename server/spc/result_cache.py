@@ -0,0 +1,149 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import instrumentation
+from .models import ChartConfig
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESULT_CACHE_SETTINGS = {
+    "CACHE": "default",  # Django cache alias holding computed payloads
+    "TTL": 30,  # Seconds a payload is served before being recomputed (0 disables)
+    "COALESCE_TIMEOUT": 60,  # Seconds a request waits for an identical one in flight
+}
+
+
+def get_result_cache_settings() -> Dict[str, Any]:
+    return {
+        **DEFAULT_RESULT_CACHE_SETTINGS,
+        **getattr(settings, "SPC_RESULT_CACHE", {}),
+    }
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class ChartResultCache:
+    """
+    Caches computed chart payloads in Django's cache framework, keyed on the
+    chart, its config version, the requested window and the aggregation (or
+    rollup resolution).
+
+    Saving a ChartConfig or DataSource bumps a version counter that is part
+    of the key, so stale payloads are never read again and simply expire.
+    Concurrent misses for the same key in one process are coalesced: the
+    first request computes, the others wait for its result.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[get_result_cache_settings()["CACHE"]]
+
+    @staticmethod
+    def _chart_version_key(chart_id: int) -> str:
+        return f"spc:chart-version:{chart_id}"
+
+    @staticmethod
+    def _source_version_key(source_id: int) -> str:
+        return f"spc:source-version:{source_id}"
+
+    def key(
+        self, config: ChartConfig, start_date=None, end_date=None, resolution=None
+    ) -> str:
+        chart_version = self._chart_version_key(config.pk)
+        source_version = self._source_version_key(config.data_source_id)
+        versions = self.cache.get_many([chart_version, source_version])
+        window = ":".join(
+            value.isoformat() if value else "default"
+            for value in (start_date, end_date)
+        )
+        key = (
+            f"spc:chart-data:{config.pk}:{config.updated_at.timestamp()}"
+            f":{versions.get(chart_version, 0)}.{versions.get(source_version, 0)}"
+            f":{window}:{config.aggregation_type}:{config.aggregation_size}"
+        )
+        if resolution is not None:
+            # Plotted from the chart's rollups (spc/rollups.py)
+            key += f":rollup-{resolution}"
+        return key
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if get_result_cache_settings()["TTL"] <= 0:
+            return None
+        return self.cache.get(key)
+
+    def set(self, key: str, data: Dict[str, Any]):
+        """
+        Keeps the payload for TTL seconds, unless it is an error or was
+        served stale from a chart's local cache
+        """
+        ttl = get_result_cache_settings()["TTL"]
+        stale = data.get("window", {}).get("stale", False)
+        if ttl > 0 and "error" not in data and not stale:
+            self.cache.set(key, data, ttl)
+
+    def get_or_compute(
+        self,
+        config: ChartConfig,
+        start_date,
+        end_date,
+        compute: Callable[[], Dict[str, Any]],
+        resolution: str = None,
+    ) -> Dict[str, Any]:
+        with instrumentation.span("cache"):
+            key = self.key(config, start_date, end_date, resolution)
+            data = self.get(key)
+        if data is not None:
+            instrumentation.note("cache", "hit")
+            return data
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            if flight.done.wait(get_result_cache_settings()["COALESCE_TIMEOUT"]):
+                if flight.result is not None:
+                    return flight.result
+            return compute()
+
+        try:
+            flight.result = compute()
+            self.set(key, flight.result)
+            return flight.result
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def invalidate_chart(self, chart_id: int):
+        self._bump(self._chart_version_key(chart_id))
+
+    def invalidate_source(self, source_id: int):
+        self._bump(self._source_version_key(source_id))
+
+    def _bump(self, key: str):
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            # Not set yet (or evicted): start from a value never used before
+            self.cache.set(key, time.time_ns(), None)
+        except Exception as e:
+            logger.warning(f"Could not invalidate chart results ({key}): {e}")
+
+
+result_cache = ChartResultCache()
@@ -0,0 +1,246 @@
+from datetime import timedelta
+from typing import Dict, Optional
+
+import pandas as pd
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ChartConfig, Measurement, MeasurementCache, RollupBucket
+from .moments import (
+    BUCKET_ORIGIN,
+    RunningMoments,
+    bucket_starts,
+    bucket_width,
+    measurement_frame,
+)
+from .query_builder import TIME_BUCKETS
+
+# Rollup pyramid of cached charts: running moments of the measurements per
+# minute, hour, day and week, finest first. Each bucket nests in one bucket
+# of the next level, so a window is read from the coarsest buckets it fully
+# covers and only its edges descend to finer levels (and finally to the
+# cached rows), touching O(levels) buckets per edge however wide it is.
+RESOLUTIONS = {
+    RollupBucket.Resolution.MINUTE: pd.Timedelta(minutes=1),
+    RollupBucket.Resolution.HOUR: pd.Timedelta(hours=1),
+    RollupBucket.Resolution.DAY: pd.Timedelta(days=1),
+    RollupBucket.Resolution.WEEK: pd.Timedelta(weeks=1),
+}
+LEVELS = list(RESOLUTIONS)
+# Weeks start on Monday, the first one after BUCKET_ORIGIN (a Saturday)
+WEEK_ORIGIN = "2000-01-03"
+
+
+def rollup_origin(resolution: str) -> str:
+    return WEEK_ORIGIN if resolution == RollupBucket.Resolution.WEEK else BUCKET_ORIGIN
+
+
+def rollup_starts(timestamps, resolution: str):
+    return bucket_starts(timestamps, RESOLUTIONS[resolution], rollup_origin(resolution))
+
+
+class RollupPyramid:
+    """
+    Maintains the rollup pyramid of cached charts as measurements are added
+    to the local cache, and serves a window at any of its resolutions.
+    """
+
+    def add(self, config: ChartConfig, df: pd.DataFrame):
+        """
+        Folds newly cached (timestamp, value) rows into their bucket at every
+        resolution
+        """
+        if df.empty:
+            return
+        with transaction.atomic():
+            for resolution in LEVELS:
+                batch = RunningMoments.by_group(
+                    df["value"], rollup_starts(df["timestamp"], resolution)
+                )
+                self._merge(config, resolution, batch)
+
+    def ensure_built(self, config: ChartConfig, state: MeasurementCache):
+        """
+        Builds the pyramid from the cached measurements of a chart cached
+        before rollups were kept
+        """
+        if state.row_count and not config.rollup_buckets.exists():
+            self.rebuild(config)
+
+    def rebuild(self, config: ChartConfig, chunk_size: int = 100000):
+        RollupBucket.objects.filter(chart=config).delete()
+        rows = (
+            Measurement.objects.filter(chart=config)
+            .order_by("timestamp")
+            .values_list("timestamp", "value")
+            .iterator(chunk_size=chunk_size)
+        )
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                self.add(config, measurement_frame(chunk))
+                chunk = []
+        if chunk:
+            self.add(config, measurement_frame(chunk))
+
+    def window(
+        self, config: ChartConfig, resolution: str, start_date, end_date
+    ) -> Dict[pd.Timestamp, RunningMoments]:
+        """
+        {bucket start: moments} of the window at `resolution`, in time order
+        """
+        # Half-open from here on; stored timestamps have microsecond resolution
+        stop = end_date + timedelta(microseconds=1)
+        moments = self._window(
+            config,
+            LEVELS.index(resolution),
+            pd.Timestamp(start_date),
+            pd.Timestamp(stop),
+        )
+        return {start: moments[start] for start in sorted(moments)}
+
+    def choose(
+        self, config: ChartConfig, start_date, end_date, points: int
+    ) -> Optional[str]:
+        """
+        The resolution to plot the window with in about `points` points: the
+        finest whose buckets fit (week when none does), or None when the
+        chart's own series is expected to fit
+        """
+        span = pd.Timestamp(end_date) - pd.Timestamp(start_date)
+        if self.chart_points(config, span) <= points:
+            return None
+        for resolution, width in RESOLUTIONS.items():
+            if span / width <= points:
+                return resolution
+        return LEVELS[-1]
+
+    @staticmethod
+    def chart_points(config: ChartConfig, span: pd.Timedelta) -> float:
+        """
+        Expected number of points of the chart's own series over `span`. Raw
+        and COUNT charts are estimated from the cache's average row rate; an
+        empty cache counts as fitting.
+        """
+        if config.aggregation_type in TIME_BUCKETS:
+            return span / bucket_width(config)
+        state = MeasurementCache.objects.filter(chart=config).first()
+        if state is None or state.watermark is None or state.low_watermark is None:
+            return 0
+        covered = (state.watermark - state.low_watermark).total_seconds()
+        rate = state.row_count / max(covered, 1)
+        return rate * span.total_seconds() / max(config.aggregation_size, 1)
+
+    def _window(
+        self, config: ChartConfig, level: int, start: pd.Timestamp, stop: pd.Timestamp
+    ) -> Dict[pd.Timestamp, RunningMoments]:
+        """
+        Buckets fully inside [start, stop) come from the stored level; the
+        partial buckets at the edges are merged from the next finer level,
+        or from the cached rows below the finest one
+        """
+        resolution = LEVELS[level]
+        width = RESOLUTIONS[resolution]
+        first = rollup_starts(start, resolution)
+        if first < start:
+            first += width
+        last = rollup_starts(stop, resolution)
+
+        moments = {}
+        edges = [(start, stop)]
+        if first < last:
+            stored = RollupBucket.objects.filter(
+                chart=config,
+                resolution=resolution,
+                bucket_start__gte=timezone.make_aware(first.to_pydatetime()),
+                bucket_start__lt=timezone.make_aware(last.to_pydatetime()),
+            )
+            moments = {
+                pd.Timestamp(timezone.make_naive(b.bucket_start)): self._moments(b)
+                for b in stored
+            }
+            edges = [(start, first), (last, stop)]
+
+        for edge_start, edge_stop in edges:
+            if edge_start >= edge_stop:
+                continue
+            if level == 0:
+                finer = self._raw(config, edge_start, edge_stop)
+            else:
+                finer = self._window(config, level - 1, edge_start, edge_stop)
+            for finer_start, finer_moments in finer.items():
+                key = rollup_starts(finer_start, resolution)
+                if key in moments:
+                    moments[key].merge(finer_moments)
+                else:
+                    moments[key] = finer_moments
+        return moments
+
+    @staticmethod
+    def _raw(
+        config: ChartConfig, start: pd.Timestamp, stop: pd.Timestamp
+    ) -> Dict[pd.Timestamp, RunningMoments]:
+        rows = Measurement.objects.filter(
+            chart=config,
+            timestamp__gte=timezone.make_aware(start.to_pydatetime()),
+            timestamp__lt=timezone.make_aware(stop.to_pydatetime()),
+        ).values_list("timestamp", "value")
+        df = measurement_frame(rows)
+        if df.empty:
+            return {}
+        return RunningMoments.by_group(
+            df["value"], rollup_starts(df["timestamp"], LEVELS[0])
+        )
+
+    def _merge(
+        self,
+        config: ChartConfig,
+        resolution: str,
+        batch: Dict[pd.Timestamp, RunningMoments],
+    ):
+        if not batch:
+            return
+        existing = {
+            timezone.make_naive(b.bucket_start): b
+            for b in RollupBucket.objects.select_for_update().filter(
+                chart=config,
+                resolution=resolution,
+                bucket_start__gte=timezone.make_aware(min(batch).to_pydatetime()),
+                bucket_start__lte=timezone.make_aware(max(batch).to_pydatetime()),
+            )
+        }
+        created, updated = [], []
+        for start, moments in batch.items():
+            start = start.to_pydatetime()
+            bucket = existing.get(start)
+            if bucket is None:
+                bucket = RollupBucket(
+                    chart=config,
+                    resolution=resolution,
+                    bucket_start=timezone.make_aware(start),
+                )
+                created.append(bucket)
+            else:
+                moments = self._moments(bucket).merge(moments)
+                updated.append(bucket)
+            bucket.count = moments.count
+            bucket.mean = moments.mean
+            bucket.m2 = moments.m2
+            bucket.min = moments.min
+            bucket.max = moments.max
+
+        RollupBucket.objects.bulk_create(created, batch_size=5000)
+        RollupBucket.objects.bulk_update(
+            updated, ["count", "mean", "m2", "min", "max"], batch_size=5000
+        )
+
+    @staticmethod
+    def _moments(bucket: RollupBucket) -> RunningMoments:
+        return RunningMoments(
+            count=bucket.count,
+            mean=bucket.mean,
+            m2=bucket.m2,
+            min=bucket.min,
+            max=bucket.max,
+        )
@@ -0,0 +1,354 @@
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from .models import DataSource
+from .query_builder import QueryBuildError, get_dialect, split_table_name
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATALOG_SETTINGS = {
+    "CACHE": "default",  # Django cache alias holding the catalogs
+    "TTL": 600,  # Seconds before a catalog is refreshed in the background
+    "MAX_AGE": 86400,  # Seconds a stale catalog may still be served while refreshing
+    "PAGE_SIZE": 50,  # Default page size of the table / value listings
+    "MAX_PAGE_SIZE": 500,
+    "VALUES_LIMIT": 1000,  # Max distinct values read from a column
+    "VALUES_TTL": 300,  # Seconds distinct column values are cached
+}
+
+
+def get_catalog_settings() -> Dict[str, Any]:
+    return {
+        **DEFAULT_CATALOG_SETTINGS,
+        **getattr(settings, "SPC_SCHEMA_CATALOG", {}),
+    }
+
+
+class CatalogError(Exception):
+    """
+    The source's catalog couldn't be read
+    """
+
+
+# Every engine returns the same columns, so the catalog is assembled the
+# same way. System schemas are left out.
+CATALOG_QUERIES = {
+    DataSource.Engine.POSTGRES: {
+        "tables": """
+            SELECT n.nspname AS table_schema, c.relname AS table_name,
+                CASE WHEN c.relkind IN ('v', 'm') THEN 'VIEW' ELSE 'TABLE' END AS table_type,
+                c.reltuples AS row_estimate
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind IN ('r', 'p', 'v', 'm', 'f')
+            AND n.nspname <> 'information_schema' AND n.nspname !~ '^pg_'
+        """,
+        "columns": """
+            SELECT table_schema, table_name, column_name, data_type, is_nullable
+            FROM information_schema.columns
+            WHERE table_schema <> 'information_schema' AND table_schema !~ '^pg_'
+            ORDER BY table_schema, table_name, ordinal_position
+        """,
+        # Key columns only (not INCLUDE ones); expression keys have no column
+        "indexes": """
+            SELECT n.nspname AS table_schema, t.relname AS table_name,
+                i.relname AS index_name, ix.indisunique AS is_unique,
+                a.attname AS column_name, k.ord AS key_ordinal
+            FROM pg_index ix
+            JOIN pg_class t ON t.oid = ix.indrelid
+            JOIN pg_class i ON i.oid = ix.indexrelid
+            JOIN pg_namespace n ON n.oid = t.relnamespace
+            CROSS JOIN LATERAL unnest(ix.indkey) WITH ORDINALITY AS k(attnum, ord)
+            JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+            WHERE k.ord <= ix.indnkeyatts
+            AND n.nspname <> 'information_schema' AND n.nspname !~ '^pg_'
+            ORDER BY 1, 2, 3, 6
+        """,
+    },
+    DataSource.Engine.MSSQL: {
+        "tables": """
+            SELECT s.name AS table_schema, o.name AS table_name,
+                CASE o.type WHEN 'V' THEN 'VIEW' ELSE 'TABLE' END AS table_type,
+                (
+                    SELECT SUM(p.rows) FROM sys.partitions p
+                    WHERE p.object_id = o.object_id AND p.index_id IN (0, 1)
+                ) AS row_estimate
+            FROM sys.objects o
+            JOIN sys.schemas s ON s.schema_id = o.schema_id
+            WHERE o.type IN ('U', 'V') AND o.is_ms_shipped = 0
+        """,
+        "columns": """
+            SELECT TABLE_SCHEMA AS table_schema, TABLE_NAME AS table_name,
+                COLUMN_NAME AS column_name, DATA_TYPE AS data_type,
+                IS_NULLABLE AS is_nullable
+            FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_SCHEMA NOT IN ('INFORMATION_SCHEMA', 'sys')
+            ORDER BY TABLE_SCHEMA, TABLE_NAME, ORDINAL_POSITION
+        """,
+        "indexes": """
+            SELECT s.name AS table_schema, t.name AS table_name,
+                i.name AS index_name, i.is_unique AS is_unique,
+                c.name AS column_name, ic.key_ordinal AS key_ordinal
+            FROM sys.indexes i
+            JOIN sys.objects t ON t.object_id = i.object_id
+            JOIN sys.schemas s ON s.schema_id = t.schema_id
+            JOIN sys.index_columns ic
+                ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+            JOIN sys.columns c
+                ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+            WHERE t.type IN ('U', 'V') AND t.is_ms_shipped = 0
+            AND i.type > 0 AND ic.is_included_column = 0
+            ORDER BY s.name, t.name, i.name, ic.key_ordinal
+        """,
+    },
+}
+
+
+def build_catalog(source: DataSource, ds_service=None) -> Dict[str, Any]:
+    """
+    Reads every table and view of the source with its columns (and types),
+    indexes and estimated row count: three catalog queries however many
+    tables there are. Raises CatalogError when the source can't be read.
+    """
+    if source.engine not in CATALOG_QUERIES:
+        raise CatalogError(f"Unsupported engine: {source.engine}")
+    if ds_service is None:
+        from .services import DataSourceService
+
+        ds_service = DataSourceService()
+    try:
+        frames = {
+            name: ds_service.query(source, query)
+            for name, query in CATALOG_QUERIES[source.engine].items()
+        }
+    except Exception as e:
+        raise CatalogError(str(e))
+
+    tables = {}
+    for row in frames["tables"].itertuples(index=False):
+        estimate = row.row_estimate
+        tables[(row.table_schema, row.table_name)] = {
+            "schema": row.table_schema,
+            "name": row.table_name,
+            "qualified_name": f"{row.table_schema}.{row.table_name}",
+            "type": row.table_type,
+            # Postgres reports -1 for tables never analyzed
+            "row_estimate": (
+                int(estimate) if pd.notna(estimate) and estimate >= 0 else None
+            ),
+            "columns": [],
+            "indexes": [],
+        }
+
+    for row in frames["columns"].itertuples(index=False):
+        table = tables.get((row.table_schema, row.table_name))
+        if table is not None:
+            table["columns"].append(
+                {
+                    "name": row.column_name,
+                    "type": row.data_type,
+                    "nullable": str(row.is_nullable).upper() == "YES",
+                }
+            )
+
+    for row in frames["indexes"].itertuples(index=False):
+        table = tables.get((row.table_schema, row.table_name))
+        if table is None:
+            continue
+        indexes = table["indexes"]
+        if not indexes or indexes[-1]["name"] != row.index_name:
+            indexes.append(
+                {"name": row.index_name, "unique": bool(row.is_unique), "columns": []}
+            )
+        indexes[-1]["columns"].append(row.column_name)
+
+    for table in tables.values():
+        # Columns an index can seek on: the leading key of some index
+        leading = {index["columns"][0] for index in table["indexes"]}
+        for column in table["columns"]:
+            column["indexed"] = column["name"] in leading
+
+    return {
+        "refreshed_at": timezone.now(),
+        "tables": sorted(
+            tables.values(), key=lambda t: (t["schema"].lower(), t["name"].lower())
+        ),
+    }
+
+
+def table_summary(table: Dict[str, Any]) -> Dict[str, Any]:
+    summary = {
+        key: value for key, value in table.items() if key not in ("columns", "indexes")
+    }
+    summary["column_count"] = len(table["columns"])
+    return summary
+
+
+def search_tables(catalog: Dict[str, Any], search: str = "") -> List[Dict[str, Any]]:
+    """
+    Summaries of the catalog's tables whose qualified name contains
+    `search` (case-insensitive)
+    """
+    search = search.strip().lower()
+    return [
+        table_summary(table)
+        for table in catalog["tables"]
+        if search in table["qualified_name"].lower()
+    ]
+
+
+class SchemaCatalog:
+    """
+    Per-DataSource schema catalog kept in Django's cache, so table browsing
+    and chart setup don't query the source's system views every time.
+
+    A catalog older than TTL is still served (flagged "stale") while one
+    background thread per source rebuilds it; only a missing catalog is
+    built in the request. Editing the source changes its key.
+    """
+
+    def __init__(self, ds_service=None):
+        self.ds_service = ds_service
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[get_catalog_settings()["CACHE"]]
+
+    @staticmethod
+    def key(source: DataSource) -> str:
+        return f"spc:catalog:{source.pk}:{source.updated_at.timestamp()}"
+
+    def get(self, source: DataSource, refresh: bool = False) -> Dict[str, Any]:
+        """
+        The source's catalog plus "stale", building it now if there is none
+        (or refresh is set). Raises CatalogError.
+        """
+        catalog = None if refresh else self.cache.get(self.key(source))
+        if catalog is None:
+            catalog = self.refresh(source)
+        age = (timezone.now() - catalog["refreshed_at"]).total_seconds()
+        stale = age > get_catalog_settings()["TTL"]
+        if stale:
+            self.refresh_in_background(source)
+        return {**catalog, "stale": stale}
+
+    def refresh(self, source: DataSource) -> Dict[str, Any]:
+        catalog = build_catalog(source, self.ds_service)
+        self.cache.set(self.key(source), catalog, get_catalog_settings()["MAX_AGE"])
+        return catalog
+
+    def refresh_in_background(self, source: DataSource):
+        with self._lock:
+            if source.pk in self._refreshing:
+                return
+            self._refreshing.add(source.pk)
+
+        def run():
+            try:
+                self.refresh(source)
+            except CatalogError as e:
+                logger.warning(f"Could not refresh catalog of {source}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(source.pk)
+
+        threading.Thread(target=run, name="spc-catalog", daemon=True).start()
+
+    def table(self, source: DataSource, table_name: str) -> Optional[Dict[str, Any]]:
+        """
+        One table with its columns and indexes, matched like chart table
+        names: schema optional, case-insensitive, exact case preferred
+        """
+        try:
+            schema, name = split_table_name(table_name)
+        except QueryBuildError:
+            return None
+        matches = [
+            table
+            for table in self.get(source)["tables"]
+            if table["name"].lower() == name.lower()
+            and (schema is None or table["schema"].lower() == schema.lower())
+        ]
+        if len(matches) > 1:
+            exact = [t for t in matches if t["name"] == name]
+            default = get_dialect(source).default_schema
+            matches = exact or [t for t in matches if t["schema"] == default]
+        return matches[0] if len(matches) == 1 else None
+
+    def distinct_values(
+        self, source: DataSource, table_name: str, column_name: str, search: str = ""
+    ) -> List[Any]:
+        """
+        Up to VALUES_LIMIT distinct non-null values of a column (e.g. product
+        or operation identifiers), optionally containing `search`. Cached
+        for VALUES_TTL seconds. Raises QueryBuildError for unknown names.
+        """
+        table = self.table(source, table_name)
+        if table is None:
+            raise QueryBuildError(f"Table {table_name!r} not found")
+        column = next(
+            (
+                c["name"]
+                for c in table["columns"]
+                if c["name"].lower() == column_name.strip().lower()
+            ),
+            None,
+        )
+        if column is None:
+            raise QueryBuildError(
+                f"Column {column_name!r} not found in {table['qualified_name']}"
+            )
+
+        catalog_settings = get_catalog_settings()
+        key = (
+            f"spc:catalog-values:{source.pk}:{source.updated_at.timestamp()}:"
+            f"{table['qualified_name']}:{column}:{search}"
+        )
+        values = self.cache.get(key)
+        if values is not None:
+            return values
+
+        dialect = get_dialect(source)
+        p = dialect.placeholder
+        quoted = dialect.quote(column)
+        params = []
+        top = dialect.top()
+        if top:
+            params.append(catalog_settings["VALUES_LIMIT"])
+        where = f"{quoted} IS NOT NULL"
+        if search:
+            where += f" AND CAST({quoted} AS {dialect.text_type}) LIKE {p}"
+            params.append(f"%{search}%")
+        limit = dialect.limit()
+        if limit:
+            params.append(catalog_settings["VALUES_LIMIT"])
+        query = f"""
+            SELECT {top}{quoted} AS value
+            FROM {dialect.quote(table['schema'])}.{dialect.quote(table['name'])}
+            WHERE {where}
+            GROUP BY {quoted}
+            ORDER BY {quoted}
+            {limit}
+        """
+        if self.ds_service is None:
+            from .services import DataSourceService
+
+            self.ds_service = DataSourceService()
+        try:
+            df = self.ds_service.query(source, query, params)
+        except Exception as e:
+            raise CatalogError(str(e))
+        values = df["value"].tolist()
+        self.cache.set(key, values, catalog_settings["VALUES_TTL"])
+        return values
+
+
+schema_catalog = SchemaCatalog()
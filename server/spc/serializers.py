@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import ChartConfig, DataSource
+from .models import ChartConfig, ControlLimitBaseline, DataSource
 
 
 class DataSourceSerializer(serializers.ModelSerializer):
@@ -15,3 +15,9 @@ class ChartConfigSerializer(serializers.ModelSerializer):
         model = ChartConfig
         fields = "__all__"
         read_only_fields = ["owner"]
+
+
+class ControlLimitBaselineSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ControlLimitBaseline
+        fields = "__all__"
@@ -1,11 +1,82 @@
+import logging
+import math
+import re
+import time
+import uuid
+import numpy as np
 import pyodbc
 import psycopg2
 import pandas as pd
-from django.db import connection
+from contextlib import contextmanager
+from datetime import datetime
+from django.conf import settings
+from django.utils import timezone
+from . import instrumentation
 from .models import DataSource
+from .connection_pool import get_pool, get_pool_settings, invalidate_pool
+
+logger = logging.getLogger(__name__)
+
+# Trailing UTC offset of an ISO timestamp, after its time of day
+UTC_OFFSET = re.compile(r"\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}(:?\d{2})?)$")
+
+
+def decode_values(values) -> np.ndarray:
+    """
+    Column of fetched values as float64, with NULLs and non-numeric values
+    as NaN
+    """
+    try:
+        # Floats, ints and Decimals convert straight into the array
+        return np.fromiter(values, dtype=np.float64, count=len(values))
+    except (TypeError, ValueError):
+        series = pd.Series(values, dtype=object)
+        return pd.to_numeric(series, errors="coerce").to_numpy(np.float64)
+
+
+def decode_timestamps(values) -> np.ndarray:
+    """
+    Column of fetched timestamps (datetimes or ISO strings) as naive
+    datetime64[ns] in server time; aware values are converted to the default
+    timezone first
+    """
+    first = next((value for value in values if value is not None), None)
+    if isinstance(first, str):
+        # Text timestamps (COPY CSV, some drivers) drop zero fractions
+        aware = UTC_OFFSET.search(first) is not None
+        stamps = pd.to_datetime(
+            pd.Series(values, dtype=object), utc=aware, format="ISO8601"
+        )
+    else:
+        # Mixed UTC offsets (DST) only parse as UTC
+        aware = isinstance(first, datetime) and first.tzinfo is not None
+        stamps = pd.to_datetime(pd.Series(values, dtype=object), utc=aware)
+    if stamps.dt.tz is not None:
+        stamps = stamps.dt.tz_convert(timezone.get_default_timezone())
+        stamps = stamps.dt.tz_localize(None)
+    return stamps.to_numpy("datetime64[ns]")
+
+
+def decode_series(rows) -> pd.DataFrame:
+    """
+    Fetched (timestamp, value, ...) rows as a typed (timestamp, value)
+    DataFrame
+    """
+    with instrumentation.span("decode"):
+        return pd.DataFrame(
+            {
+                "timestamp": decode_timestamps([row[0] for row in rows]),
+                "value": decode_values([row[1] for row in rows]),
+            },
+            copy=False,
+        )
 
 
 class DataSourceService:
+    def __init__(self, query_timeout: float = None):
+        # Seconds a single query may run on the source before it's cancelled
+        self.query_timeout = query_timeout
+
     @staticmethod
     def get_connection_string(source: DataSource):
         if source.engine == DataSource.Engine.MSSQL:
@@ -20,85 +91,210 @@ class DataSourceService:
             return f"host={source.host} port={source.port} dbname={source.database_name} user={source.username} password={source.password}"
         return ""
 
+    @classmethod
+    def connect(cls, source: DataSource, timeout: int = None):
+        """
+        Opens a new, unpooled DBAPI connection to the source
+        """
+        if timeout is None:
+            timeout = get_pool_settings()["CONNECT_TIMEOUT"]
+        if source.engine == DataSource.Engine.MSSQL:
+            conn_str = cls.get_connection_string(source)
+            return pyodbc.connect(conn_str, timeout=timeout)
+        elif source.engine == DataSource.Engine.POSTGRES:
+            return psycopg2.connect(
+                host=source.host,
+                port=source.port,
+                database=source.database_name,
+                user=source.username,
+                password=source.password,
+                connect_timeout=timeout,
+            )
+        raise ValueError(f"Unsupported engine: {source.engine}")
+
+    @contextmanager
+    def connection(self, source: DataSource):
+        """
+        Checks a connection out of the source's shared pool. Inactive sources
+        are never pooled; they get a one-off connection that is closed after use.
+        """
+        started = time.perf_counter()
+        if not source.is_active:
+            invalidate_pool(source.pk)
+            conn = self.connect(source)
+            instrumentation.record("connect", time.perf_counter() - started)
+            try:
+                yield conn
+            finally:
+                conn.close()
+            return
+
+        pool = get_pool(source, lambda: self.connect(source))
+        with pool.connection() as conn:
+            instrumentation.record("connect", time.perf_counter() - started)
+            yield conn
+
     def test_connection(self, source: DataSource):
         try:
-            if source.engine == DataSource.Engine.MSSQL:
-                conn_str = self.get_connection_string(source)
-                # print(f"Connecting to MSSQL: {conn_str.replace(source.password, '***')}")
-                conn = pyodbc.connect(conn_str, timeout=5)
-                conn.close()
-            elif source.engine == DataSource.Engine.POSTGRES:
-                conn = psycopg2.connect(
-                    host=source.host,
-                    port=source.port,
-                    database=source.database_name,
-                    user=source.username,
-                    password=source.password,
-                    connect_timeout=5,
-                )
-                conn.close()
+            with self.connection(source) as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
             return True, "Connection Successful"
         except Exception as e:
             return False, str(e)
 
     def list_tables(self, source: DataSource):
-        tables = []
+        """
+        Qualified names of the source's tables, from its cached schema
+        catalog (see schema_catalog.py). Raises CatalogError when the catalog
+        can't be read, like DataSourceViewSet.tables answers with a 502.
+        """
+        # Avoid the circular import, the catalog queries through this service
+        from .schema_catalog import CatalogError, schema_catalog
+
         try:
-            if source.engine == DataSource.Engine.MSSQL:
-                conn_str = self.get_connection_string(source)
-                conn = pyodbc.connect(conn_str)
-                cursor = conn.cursor()
-                # Query to list tables in MSSQL
-                cursor.execute(
-                    "SELECT TABLE_SCHEMA, TABLE_NAME FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_TYPE='BASE TABLE'"
-                )
-                for row in cursor.fetchall():
-                    tables.append(f"{row.TABLE_SCHEMA}.{row.TABLE_NAME}")
-                conn.close()
-            elif source.engine == DataSource.Engine.POSTGRES:
-                conn = psycopg2.connect(
-                    host=source.host,
-                    port=source.port,
-                    database=source.database_name,
-                    user=source.username,
-                    password=source.password,
-                )
+            catalog = schema_catalog.get(source)
+        except CatalogError as e:
+            logger.warning(f"Could not list the tables of source {source.pk}: {e}")
+            raise
+        return [
+            table["qualified_name"]
+            for table in catalog["tables"]
+            if table["type"] == "TABLE"
+        ]
+
+    def query(self, source: DataSource, query: str, params=None):
+        """
+        Executes a query and returns a Pandas DataFrame, raising on error
+        """
+        instrumentation.record_sql(query)
+        with self.connection(source) as conn:
+            if self.query_timeout:
+                self.set_query_timeout(source, conn, self.query_timeout)
+            try:
+                with instrumentation.span("query"):
+                    df = pd.read_sql(query, conn, params=params)
+            finally:
+                if self.query_timeout:
+                    self.set_query_timeout(source, conn, None)
+        instrumentation.count_fetched(rows=len(df))
+        return df
+
+    def fetch_rows(self, source: DataSource, query: str, params=None, chunk_size=None):
+        """
+        Executes a query and yields (column names, rows) for every batch of at
+        most chunk_size (SPC_FETCH_CHUNK_SIZE) rows, so memory stays flat
+        however many rows the query returns. Postgres uses a server-side
+        cursor; pyodbc fetches with fetchmany. The connection is held until
+        the generator is exhausted or closed.
+        """
+        if chunk_size is None:
+            chunk_size = getattr(settings, "SPC_FETCH_CHUNK_SIZE", 10000)
+        instrumentation.record_sql(query)
+        with self.connection(source) as conn:
+            if source.engine == DataSource.Engine.POSTGRES:
+                # Named cursors live on the server; rows are sent chunk by chunk
+                cursor = conn.cursor(name=f"spc_stream_{uuid.uuid4().hex}")
+                cursor.itersize = chunk_size
+            else:
                 cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT table_schema, table_name FROM information_schema.tables WHERE table_schema='public'"
-                )
-                for row in cursor.fetchall():
-                    tables.append(f"{row[0]}.{row[1]}")
-                conn.close()
-        except Exception as e:
-            print(f"Error listing tables: {e}")
-        return tables
+            try:
+                if self.query_timeout:
+                    self.set_query_timeout(source, conn, self.query_timeout)
+                with instrumentation.span("query"):
+                    cursor.execute(query, params or [])
+                columns = None
+                while True:
+                    with instrumentation.span("fetch"):
+                        rows = cursor.fetchmany(chunk_size)
+                    instrumentation.count_fetched(rows=len(rows))
+                    if columns is None:
+                        columns = [column[0] for column in cursor.description]
+                    if not rows:
+                        break
+                    yield columns, rows
+            finally:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+                if self.query_timeout:
+                    self.set_query_timeout(source, conn, None)
+
+    def stream(self, source: DataSource, query: str, params=None, chunk_size=None):
+        """
+        Like fetch_rows, yielding each batch as a DataFrame
+        """
+        for columns, rows in self.fetch_rows(source, query, params, chunk_size):
+            yield pd.DataFrame.from_records(
+                [tuple(row) for row in rows], columns=columns
+            )
 
-    def get_data(self, source: DataSource, query: str):
+    def stream_series(
+        self, source: DataSource, query: str, params=None, chunk_size=None
+    ):
         """
-        Executes a query and returns a Pandas DataFrame
+        Streams a (timestamp, value) query as typed chunks: DataFrames whose
+        columns are built straight from the fetched rows as datetime64[ns]
+        (naive, server time) and float64 arrays, without going through
+        object columns and re-coercing them. Values that aren't numeric are
+        NaN.
+
+        Postgres sources whose extraction_mode is COPY_* read through COPY
+        instead of a cursor (see extraction.copy_series).
+        """
+        if source.engine == DataSource.Engine.POSTGRES and (
+            source.extraction_mode != DataSource.ExtractionMode.CURSOR
+        ):
+            yield from self.copy_series(source, query, params, chunk_size)
+            return
+        for _, rows in self.fetch_rows(source, query, params, chunk_size):
+            yield decode_series(rows)
+
+    def copy_series(self, source: DataSource, query: str, params=None, chunk_size=None):
+        """
+        stream_series through COPY (...) TO STDOUT, in the source's
+        extraction mode (binary or CSV)
+        """
+        # Avoid the circular import, extraction decodes with this module
+        from .extraction import copy_series
+
+        if chunk_size is None:
+            chunk_size = getattr(settings, "SPC_FETCH_CHUNK_SIZE", 10000)
+        binary = source.extraction_mode == DataSource.ExtractionMode.COPY_BINARY
+        instrumentation.record_sql(query)
+        with self.connection(source) as conn:
+            try:
+                if self.query_timeout:
+                    self.set_query_timeout(source, conn, self.query_timeout)
+                yield from copy_series(conn, query, params or [], chunk_size, binary)
+            finally:
+                if self.query_timeout:
+                    self.set_query_timeout(source, conn, None)
+
+    @staticmethod
+    def set_query_timeout(source: DataSource, conn, seconds: float = None):
+        """
+        Sets (or clears, with None) the statement timeout on a connection.
+        The server cancels the query when it's exceeded, which also frees the
+        worker thread waiting on it.
+        """
+        if source.engine == DataSource.Engine.MSSQL:
+            conn.timeout = int(math.ceil(seconds)) if seconds else 0
+        elif source.engine == DataSource.Engine.POSTGRES and seconds:
+            # SET LOCAL only lasts until the rollback the pool does on release
+            cursor = conn.cursor()
+            cursor.execute("SET LOCAL statement_timeout = %s", [int(seconds * 1000)])
+            cursor.close()
+
+    def get_data(self, source: DataSource, query: str, params=None):
+        """
+        Executes a query and returns a Pandas DataFrame, logging and raising
+        on error rather than passing off a failed source as an empty one
         """
         try:
-            if source.engine == DataSource.Engine.MSSQL:
-                conn_str = self.get_connection_string(source)
-                conn = pyodbc.connect(conn_str)
-                df = pd.read_sql(query, conn)
-                conn.close()
-                return df
-            elif source.engine == DataSource.Engine.POSTGRES:
-                conn_str = f"postgresql://{source.username}:{source.password}@{source.host}:{source.port}/{source.database_name}"
-                # Pandas read_sql with postgres
-                # We can use psycopg2 connection object too
-                conn = psycopg2.connect(
-                    host=source.host,
-                    port=source.port,
-                    database=source.database_name,
-                    user=source.username,
-                    password=source.password,
-                )
-                df = pd.read_sql(query, conn)
-                conn.close()
-                return df
-        except Exception as e:
-            print(f"Error fetching data: {e}")
-            return pd.DataFrame()  # Empty on error
+            return self.query(source, query, params)
+        except Exception:
+            logger.exception(f"Error fetching data from source {source.pk}")
+            raise
@@ -0,0 +1,37 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .connection_pool import invalidate_pool
+from .models import ChartConfig, DataSource
+from .query_builder import invalidate_schemas
+from .result_cache import result_cache
+from .streaming import hub
+
+
+@receiver(post_save, sender=DataSource)
+@receiver(post_delete, sender=DataSource)
+def invalidate_data_source_pool(sender, instance, **kwargs):
+    # Credentials/host may have changed or the source was deactivated
+    invalidate_pool(instance.pk)
+    invalidate_schemas(instance.pk)
+
+
+@receiver(post_save, sender=DataSource)
+@receiver(post_delete, sender=DataSource)
+def invalidate_data_source_results(sender, instance, **kwargs):
+    result_cache.invalidate_source(instance.pk)
+
+
+@receiver(post_save, sender=ChartConfig)
+@receiver(post_delete, sender=ChartConfig)
+def invalidate_chart_results(sender, instance, **kwargs):
+    result_cache.invalidate_chart(instance.pk)
+
+
+@receiver(post_save, sender=ChartConfig)
+@receiver(post_delete, sender=ChartConfig)
+def reload_chart_stream(sender, instance, **kwargs):
+    # Live viewers switch to the saved configuration once it is committed
+    pk = instance.pk
+    transaction.on_commit(lambda: hub.reload_soon(pk))
@@ -0,0 +1,262 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+import pandas as pd
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from .calculation_service import CalculationService
+from .models import ChartConfig, ChartSnapshot
+from .moments import bucket_starts, bucket_width
+from .query_builder import TIME_BUCKETS
+from .renderers import columns_frame, frame_columns
+from .result_cache import result_cache
+from .streaming import json_safe
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_SETTINGS = {
+    "TICK": 5,  # Seconds the scheduler waits between checks for due charts
+    "WORKERS": 4,  # Charts refreshed concurrently
+    "FULL_REFRESH": 3600,  # Seconds between recomputations of the whole window
+    "MAX_AGE_INTERVALS": 3,  # Snapshots older than this many intervals aren't served
+}
+
+
+def get_snapshot_settings() -> Dict[str, Any]:
+    return {**DEFAULT_SNAPSHOT_SETTINGS, **getattr(settings, "SPC_SNAPSHOTS", {})}
+
+
+def frame(payload: Dict[str, Any]) -> pd.DataFrame:
+    data = payload.get("data")
+    return data if isinstance(data, pd.DataFrame) else pd.DataFrame()
+
+
+def dump_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    A chart payload as stored in ChartSnapshot.payload: plain JSON, with
+    the points in the columnar form of spc.renderers and their column order
+    under "data_columns" (jsonb doesn't keep key order)
+    """
+    header = {key: value for key, value in payload.items() if key != "data"}
+    stored = json.loads(json.dumps(json_safe(header), cls=JSONEncoder))
+    df = payload.get("data")
+    if isinstance(df, pd.DataFrame):
+        stored["data"] = frame_columns(df)
+        stored["data_columns"] = list(df.columns)
+    else:
+        stored["data"] = json_safe(df)
+    return stored
+
+
+def load_payload(stored: Dict[str, Any]) -> Dict[str, Any]:
+    payload = dict(stored)
+    names = payload.pop("data_columns", None)
+    if names is not None:
+        payload["data"] = columns_frame(payload["data"], names)
+    return payload
+
+
+class SnapshotService:
+    """
+    Precomputed payloads of hot charts (precompute_snapshots) for their
+    default window, so dashboards opened together at shift start are served
+    from the stored snapshot instead of each running the chart's queries.
+
+    Time-bucketed charts are refreshed incrementally: only the newest bucket
+    onwards is recomputed (plus the oldest bucket, which the moving window
+    start cuts into) and merged with the previous buckets. The whole window
+    is recomputed every FULL_REFRESH seconds to pick up late rows, and
+    always for COUNT / raw charts, whose subgroups shift with every new row.
+    """
+
+    def __init__(self, calculation_service: CalculationService = None):
+        self.calculation_service = calculation_service or CalculationService()
+
+    def get(self, chart_id: int) -> Optional[Dict[str, Any]]:
+        """
+        The chart's snapshot payload with its freshness under "snapshot", or
+        None when the chart isn't hot or has no current snapshot
+        """
+        snapshot = (
+            ChartSnapshot.objects.select_related("chart")
+            .filter(chart_id=chart_id, chart__precompute_snapshots=True)
+            .exclude(payload__isnull=True)
+            .first()
+        )
+        if snapshot is None or snapshot.config_key != result_cache.key(snapshot.chart):
+            return None
+        age = (timezone.now() - snapshot.computed_at).total_seconds()
+        max_age = snapshot.chart.snapshot_interval * (
+            get_snapshot_settings()["MAX_AGE_INTERVALS"]
+        )
+        if age > max_age:
+            return None
+        payload = load_payload(snapshot.payload)
+        payload["snapshot"] = {
+            "computed_at": snapshot.computed_at.isoformat(),
+            "age": age,
+        }
+        return payload
+
+    def refresh(self, config: ChartConfig) -> ChartSnapshot:
+        """
+        Recomputes the chart's snapshot, incrementally when possible
+        """
+        snapshot, _ = ChartSnapshot.objects.get_or_create(chart=config)
+        key = result_cache.key(config)
+        now = timezone.now()
+        started = time.perf_counter()
+        previous = None
+        full_refresh = timedelta(seconds=get_snapshot_settings()["FULL_REFRESH"])
+        if (
+            snapshot.payload is not None
+            and snapshot.config_key == key
+            and snapshot.full_computed_at is not None
+            and now - snapshot.full_computed_at < full_refresh
+        ):
+            previous = load_payload(snapshot.payload)
+
+        try:
+            payload = self.incremental(config, previous) if previous else None
+            if payload is None:
+                payload = self.calculation_service.compute_chart_data(config)
+                snapshot.full_computed_at = now
+        except Exception as e:
+            logger.exception(f"Snapshot refresh failed for chart {config.pk}")
+            snapshot.error = str(e)
+            snapshot.save(update_fields=["error"])
+            return snapshot
+        if payload["window"].get("stale"):
+            # Keep the previous snapshot rather than one missing source rows
+            snapshot.error = "The chart's measurement cache could not be synced"
+            snapshot.save(update_fields=["error"])
+            return snapshot
+
+        snapshot.config_key = key
+        snapshot.payload = dump_payload(payload)
+        snapshot.computed_at = now
+        snapshot.duration = time.perf_counter() - started
+        snapshot.error = ""
+        snapshot.save()
+        return snapshot
+
+    def incremental(
+        self, config: ChartConfig, previous: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        The previous payload moved to the current window by recomputing its
+        newest and oldest buckets. None when that can't match a full
+        recomputation (not time-bucketed, truncated, window moved past it).
+        """
+        service = self.calculation_service
+        buckets = frame(previous)
+        if (
+            config.aggregation_type not in TIME_BUCKETS
+            or buckets.empty
+            or previous["window"]["truncated"]
+        ):
+            return None
+
+        start_date, end_date = service.chart_window(config)
+        width = bucket_width(config)
+        first = bucket_starts(pd.Timestamp(start_date), width)
+        newest = buckets["timestamp"].iloc[-1]
+        if newest < first:
+            return None
+
+        tail = service.compute_chart_data(config, newest.to_pydatetime(), end_date)
+        if "error" in tail or tail["window"]["truncated"]:
+            return None
+        stale = tail["window"].get("stale", False)
+        parts = [
+            buckets[(buckets["timestamp"] > first) & (buckets["timestamp"] < newest)],
+            frame(tail),
+        ]
+        if first < newest:
+            head = service.compute_chart_data(
+                config, start_date, (first + width).to_pydatetime()
+            )
+            stale = stale or head["window"].get("stale", False)
+            head = frame(head)
+            if not head.empty:
+                parts.insert(0, head[head["timestamp"] == first])
+
+        grouped = pd.concat(
+            [part for part in parts if not part.empty], ignore_index=True
+        )
+        if grouped.empty:
+            return None
+        window = {
+            **tail["window"],
+            "start": start_date,
+            "end": end_date,
+            "stale": stale,
+        }
+        stats = service.grouped_statistics(config, grouped)
+        baseline = service.active_baseline(config)
+        return service.build_payload(
+            config, grouped, stats, grouped["mean"], window, baseline
+        )
+
+    def due(self):
+        """
+        Hot charts whose snapshot is missing or older than their interval
+        """
+        now = timezone.now()
+        due = []
+        configs = ChartConfig.objects.filter(precompute_snapshots=True)
+        for config in configs.select_related("data_source", "snapshot"):
+            snapshot = getattr(config, "snapshot", None)
+            if (
+                snapshot is None
+                or snapshot.computed_at is None
+                or (now - snapshot.computed_at).total_seconds()
+                >= config.snapshot_interval
+            ):
+                due.append(config)
+        return due
+
+    def run_pending(self) -> int:
+        """
+        Refreshes every due chart; returns how many were refreshed
+        """
+        due = self.due()
+        if not due:
+            return 0
+
+        def refresh(config):
+            try:
+                return self.refresh(config)
+            finally:
+                close_old_connections()
+
+        with ThreadPoolExecutor(get_snapshot_settings()["WORKERS"]) as pool:
+            list(pool.map(refresh, due))
+        return len(due)
+
+    def run_forever(self, stop: threading.Event = None):
+        """
+        Scheduler loop, checking for due charts every TICK seconds until
+        `stop` is set. Run one scheduler per deployment
+        (manage.py spc_snapshots).
+        """
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                self.run_pending()
+            except Exception:
+                logger.exception("Snapshot scheduler pass failed")
+            finally:
+                close_old_connections()
+            stop.wait(get_snapshot_settings()["TICK"])
+
+
+snapshot_service = SnapshotService()
@@ -0,0 +1,536 @@
+import asyncio
+import json
+import logging
+import math
+from datetime import timedelta
+from typing import Any, Dict, Optional, Set
+
+import numpy as np
+import pandas as pd
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import weco
+from .calculation_service import PUSHDOWN_TYPES, TIME_BUCKETS, CalculationService
+from .measurement_cache import naive_timestamps
+from .models import ChartConfig
+from .moments import BUCKET_ORIGIN, bucket_starts, bucket_width, merge_moments
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STREAM_SETTINGS = {
+    "POLL_INTERVAL": 5,  # Seconds between polls of a source table
+    "KEEPALIVE": 15,  # Seconds between SSE comments on an idle stream
+    "QUEUE_SIZE": 100,  # Pending events per viewer before the oldest are dropped
+}
+
+
+def in_worker(func):
+    """
+    func as a coroutine run on a worker thread, closing the thread's stale
+    database connections afterwards as request threads do
+    """
+
+    def call(*args):
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(call, thread_sensitive=False)
+
+
+SUBGROUP_FIELDS = ["key", "timestamp", "count", "mean", "m2", "min", "max"]
+INT_FIELDS = {"key", "timestamp"}
+
+
+def get_stream_settings() -> Dict[str, Any]:
+    return {**DEFAULT_STREAM_SETTINGS, **getattr(settings, "SPC_STREAM", {})}
+
+
+def stream_key(config: ChartConfig) -> tuple:
+    """
+    Charts with the same key read exactly the same rows, so they share a poller
+    """
+    return (
+        config.data_source_id,
+        config.table_name,
+        config.datetime_column,
+        config.value_column,
+        config.product_column,
+        config.product_identifier,
+        config.operation_column,
+        config.operation_identifier,
+    )
+
+
+def json_safe(obj):
+    """
+    Converts NaN/inf to null and NumPy / pandas scalars to plain Python so the
+    payload is valid JSON for the browser's EventSource
+    """
+    if isinstance(obj, dict):
+        return {str(k): json_safe(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [json_safe(v) for v in obj]
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    if isinstance(obj, float) and not math.isfinite(obj):
+        return None
+    if obj is pd.NaT:
+        return None
+    return obj
+
+
+def sse(event: str, payload: Dict[str, Any]) -> str:
+    data = json.dumps(json_safe(payload), cls=JSONEncoder)
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+class ChartStream:
+    """
+    Live state of one chart, shared by all of its viewers: the plotted
+    series in the lookback window and the violations already sent.
+
+    Time-bucketed and COUNT charts keep the moments (count, mean, M2, min,
+    max) of each subgroup rather than the raw rows, and fold new rows into
+    them, so a poll touches only the last subgroup and the new ones instead
+    of re-aggregating the window. Raw charts keep their rows, the points.
+    """
+
+    def __init__(self, config: ChartConfig, df: pd.DataFrame):
+        self.config = config
+        self.queues: Set[asyncio.Queue] = set()
+        self.lookback = timedelta(
+            days=config.display_days
+            or getattr(settings, "SPC_DEFAULT_LOOKBACK_DAYS", 30)
+        )
+        self.max_rows = getattr(settings, "SPC_MAX_ROWS", 100000)
+        self.subgrouped = config.aggregation_type in PUSHDOWN_TYPES
+        self.df = None if self.subgrouped else df.iloc[0:0]
+        # Subgroup key (bucket start, or running subgroup number for COUNT)
+        # and timestamp in ns, with the subgroup's moments
+        self.subgroups = {
+            name: np.empty(0, dtype=np.int64 if name in INT_FIELDS else np.float64)
+            for name in SUBGROUP_FIELDS
+        }
+        self.folded = 0
+        self.last = None
+        self.grouped = None
+        self.state = None
+        self._snapshot = None
+        self.reported: Dict[str, Set] = {}
+        self.rules = weco.resolve_rules(config.weco_rules)
+        # Saving the chart (which a new baseline does) restarts the stream
+        self.baseline = CalculationService.active_baseline(config)
+        if not df.empty:
+            self._add(df)
+            self._trim()
+        self._recompute()
+
+    @classmethod
+    def load(cls, config: ChartConfig) -> "ChartStream":
+        start_date, end_date = CalculationService.chart_window(config)
+        max_rows = getattr(settings, "SPC_MAX_ROWS", 100000)
+        df = CalculationService().fetch_raw(config, start_date, end_date, max_rows)
+        if not df.empty:
+            df["timestamp"] = naive_timestamps(df["timestamp"])
+        return cls(config, df)
+
+    @property
+    def last_timestamp(self):
+        return self.last
+
+    def apply(self, rows: pd.DataFrame) -> Optional[Dict[str, Any]]:
+        """
+        Adds new source rows and returns the update event for viewers:
+        new/changed points, statistics and violations not reported before.
+        """
+        if self.last is not None:
+            rows = rows[rows["timestamp"] > self.last]
+        if rows.empty:
+            return None
+
+        touched = self._add(rows)
+        self._trim()
+        statistics, violations = self._recompute()
+
+        if self.grouped is None:
+            points = rows
+        else:
+            points = self.grouped[np.isin(self.subgroups["key"], touched)]
+
+        return {
+            "chart": self.config.pk,
+            "points": points.to_dict(orient="records"),
+            "statistics": statistics,
+            "violations": violations,
+        }
+
+    def _add(self, rows: pd.DataFrame) -> np.ndarray:
+        """
+        Adds rows newer than every row added before; returns the keys of the
+        subgroups they changed or created
+        """
+        self.last = rows["timestamp"].max()
+        if not self.subgrouped:
+            self.df = pd.concat([self.df, rows], ignore_index=True)
+            return np.empty(0)
+
+        # The subgroups are kept in ns, the frames use the source's unit
+        self.unit = rows["timestamp"].dtype
+        values = rows["value"].to_numpy(np.float64)
+        timestamps = rows["timestamp"].to_numpy("datetime64[ns]").view(np.int64)
+        if self.config.aggregation_type == "COUNT":
+            # Every N rows, as aggregate() groups them
+            n = max(self.config.aggregation_size, 1)
+            keys = (self.folded + np.arange(len(values))) // n
+            self.folded += len(values)
+        else:
+            origin = pd.Timestamp(BUCKET_ORIGIN).value
+            width = bucket_width(self.config).value
+            keys = origin + (timestamps - origin) // width * width
+        numeric = ~np.isnan(values)
+        values, timestamps, keys = values[numeric], timestamps[numeric], keys[numeric]
+        if len(values) == 0:
+            return np.empty(0)
+
+        # Only the last subgroup can gain rows; the others are kept as they are
+        current = self.subgroups
+        tail = current["key"] >= keys[0]
+        merged = merge_moments(
+            np.concatenate([current["key"][tail], keys]),
+            np.concatenate([current["count"][tail], np.ones(len(values))]),
+            np.concatenate([current["mean"][tail], values]),
+            np.concatenate([current["m2"][tail], np.zeros(len(values))]),
+            np.concatenate([current["min"][tail], values]),
+            np.concatenate([current["max"][tail], values]),
+        )
+        if self.config.aggregation_type == "COUNT":
+            # Stamped with the subgroup's first row (rows come in time order)
+            new_keys, first = np.unique(keys, return_index=True)
+            starts = np.empty(len(merged[0]), dtype=np.int64)
+            starts[np.isin(merged[0], new_keys)] = timestamps[first]
+            starts[: tail.sum()] = current["timestamp"][tail]
+        else:
+            starts = merged[0]
+        changed = dict(zip(SUBGROUP_FIELDS, (merged[0], starts, *merged[1:])))
+        self.subgroups = {
+            name: np.concatenate([current[name][~tail], changed[name]])
+            for name in SUBGROUP_FIELDS
+        }
+        return merged[0]
+
+    def _trim(self):
+        """
+        Drops rows that fell out of the lookback window or row cap, in whole
+        buckets/subgroups so the remaining aggregates don't shift
+        """
+        cutoff = self.last - self.lookback
+        if not self.subgrouped:
+            df = self.df
+            drop = int((df["timestamp"] < cutoff).sum())
+            drop = max(drop, len(df) - self.max_rows)
+            if drop > 0:
+                self.df = df.iloc[drop:].reset_index(drop=True)
+            return
+
+        if self.config.aggregation_type in TIME_BUCKETS:
+            cutoff = bucket_starts(pd.Series([cutoff]), bucket_width(self.config))[0]
+        subgroups = self.subgroups
+        keep = subgroups["timestamp"] >= pd.Timestamp(cutoff).value
+        # The newest subgroups whose rows fit under the row cap
+        keep &= np.cumsum(subgroups["count"][::-1])[::-1] <= self.max_rows
+        if not keep.all():
+            self.subgroups = {name: subgroups[name][keep] for name in SUBGROUP_FIELDS}
+
+    def _grouped(self) -> pd.DataFrame:
+        """
+        The subgroups in the shape of CalculationService.aggregate
+        """
+        subgroups = self.subgroups
+        count = subgroups["count"]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            std = np.where(count > 1, np.sqrt(subgroups["m2"] / (count - 1)), np.nan)
+        return pd.DataFrame(
+            {
+                "timestamp": subgroups["timestamp"]
+                .view("datetime64[ns]")
+                .astype(self.unit),
+                "mean": subgroups["mean"],
+                "std": std,
+                "count": count.astype(np.int64),
+                "min": subgroups["min"],
+                "max": subgroups["max"],
+                "range": subgroups["max"] - subgroups["min"],
+            }
+        )
+
+    @property
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Payload sent to new viewers, built when one asks for it rather than
+        on every poll
+        """
+        if self._snapshot is None:
+            if self.state is None:
+                self._snapshot = {"data": [], "statistics": {}, "violations": {}}
+            else:
+                data, statistics, limits, hits = self.state
+                self._snapshot = {
+                    "chart": self.config.pk,
+                    "data": data.to_dict(orient="records"),
+                    "statistics": statistics,
+                    "limits": limits,
+                    "violations": {rule: idx.tolist() for rule, idx in hits.items()},
+                    "rules": weco.describe(self.rules),
+                }
+        return self._snapshot
+
+    def _recompute(self):
+        """
+        Returns (statistics, newly seen violations keyed by rule as point
+        timestamps)
+        """
+        config = self.config
+        self._snapshot = None
+        empty = len(self.subgroups["key"]) == 0 if self.subgrouped else self.df.empty
+        if empty:
+            self.grouped = self.state = None
+            return {}, {}
+
+        self.grouped = self._grouped() if self.subgrouped else None
+        if self.grouped is not None:
+            plotted = self.grouped
+            data = self.grouped
+            statistics = CalculationService.grouped_statistics(config, self.grouped)
+            series = self.grouped["mean"]
+        else:
+            plotted = self.df
+            data = self.df
+            statistics = CalculationService.series_statistics(self.df["value"])
+            series = self.df["value"]
+        data, limits = CalculationService.control_limits(data, self.baseline)
+        statistics.update(
+            CalculationService.limits_capability(config, statistics, limits)
+        )
+
+        center, sigma = CalculationService.rule_zones(data, limits)
+        hits = weco.evaluate(series, center, sigma, self.rules)
+        timestamps = plotted["timestamp"].to_numpy()
+        fresh = {}
+        for rule, indices in hits.items():
+            stamps = [pd.Timestamp(ts) for ts in timestamps[indices]]
+            seen = self.reported.get(rule, set())
+            new = [ts for ts in stamps if ts not in seen]
+            self.reported[rule] = set(stamps)
+            if new:
+                fresh[rule] = new
+
+        self.state = (data, statistics, limits, hits)
+        return statistics, fresh
+
+    def publish(self, event: Dict[str, Any], kind: str = "update"):
+        for queue in list(self.queues):
+            if queue.full():
+                # Slow viewer: drop its oldest pending update
+                queue.get_nowait()
+            queue.put_nowait((kind, event))
+
+
+class StreamGroup:
+    """
+    One poller per distinct (data source, table, filter). New rows are fetched
+    once and fanned out to every chart (and every viewer) reading them.
+    """
+
+    def __init__(self, key: tuple, config: ChartConfig):
+        self.key = key
+        self.config = config
+        self.charts: Dict[int, ChartStream] = {}
+        self.watermark = None
+        self.task: Optional[asyncio.Task] = None
+
+    def fetch(self) -> pd.DataFrame:
+        if self.watermark is None:
+            return pd.DataFrame(columns=["timestamp", "value"])
+        end_date = timezone.make_naive(timezone.now())
+        max_rows = getattr(settings, "SPC_MAX_ROWS", 100000)
+        query, params = CalculationService.build_query(
+            self.config,
+            self.watermark.to_pydatetime(),
+            end_date,
+            max_rows,
+            ascending=True,
+            exclusive_start=True,
+        )
+        df = CalculationService().ds_service.query(
+            self.config.data_source, query, params
+        )
+        if df.empty:
+            return df
+        df["timestamp"] = naive_timestamps(df["timestamp"])
+        df["value"] = pd.to_numeric(df["value"], errors="coerce")
+        return df
+
+    def advance(self, timestamp):
+        if timestamp is not None and (
+            self.watermark is None or timestamp > self.watermark
+        ):
+            self.watermark = timestamp
+
+    async def run(self):
+        interval = get_stream_settings()["POLL_INTERVAL"]
+        while self.charts:
+            await asyncio.sleep(interval)
+            try:
+                rows = await in_worker(self.fetch)()
+            except Exception as e:
+                logger.warning(f"Stream poll failed for {self.key}: {e}")
+                continue
+            if rows.empty:
+                continue
+
+            self.advance(rows["timestamp"].max())
+            rows = rows.dropna(subset=["value"])
+            for stream in list(self.charts.values()):
+                event = await in_worker(stream.apply)(rows)
+                if event is not None:
+                    stream.publish(event)
+
+
+class ChartStreamHub:
+    """
+    Per-process registry of live chart streams on the ASGI event loop. Saving
+    or deleting a streamed chart reloads its stream (see spc/signals.py).
+    """
+
+    def __init__(self):
+        self.groups: Dict[tuple, StreamGroup] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.reloads: Set[asyncio.Task] = set()
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def subscribe(self, config: ChartConfig):
+        async with self.lock:
+            self.loop = asyncio.get_running_loop()
+            key = stream_key(config)
+            group = self.groups.get(key)
+            stream = group.charts.get(config.pk) if group is not None else None
+            # Edits saved by another process only reach the next subscriber
+            if stream is None or stream.config.updated_at != config.updated_at:
+                # Loaded first, so a failed load leaves no empty group behind
+                stream = await in_worker(ChartStream.load)(config)
+                group = self._add(config, stream)
+
+            if group.task is None or group.task.done():
+                group.task = asyncio.create_task(group.run())
+
+            queue = asyncio.Queue(maxsize=get_stream_settings()["QUEUE_SIZE"])
+            stream.queues.add(queue)
+            return stream, queue
+
+    async def unsubscribe(self, config: ChartConfig, queue: asyncio.Queue):
+        async with self.lock:
+            found = self._find(config.pk)
+            if found is None:
+                return
+            group, stream = found
+            stream.queues.discard(queue)
+            if not stream.queues:
+                self._remove(group, config.pk)
+
+    def reload_soon(self, chart_id: int):
+        """
+        Schedules reload() on the hub's event loop; safe to call from any thread
+        """
+        loop = self.loop
+        if loop is None or loop.is_closed() or self._find(chart_id) is None:
+            return
+        loop.call_soon_threadsafe(self._start_reload, chart_id)
+
+    def _start_reload(self, chart_id: int):
+        task = asyncio.ensure_future(self.reload(chart_id))
+        # Keep a reference until it is done, the loop only holds a weak one
+        self.reloads.add(task)
+        task.add_done_callback(self.reloads.discard)
+
+    async def reload(self, chart_id: int):
+        """
+        Reloads a streamed chart from its saved configuration and sends its
+        viewers the new snapshot, or a deleted event if it no longer exists.
+        A failed load keeps the current stream.
+        """
+        async with self.lock:
+            found = self._find(chart_id)
+            if found is None:
+                return
+            group, current = found
+            try:
+                config = await ChartConfig.objects.select_related("data_source").aget(
+                    pk=chart_id
+                )
+            except ChartConfig.DoesNotExist:
+                self._remove(group, chart_id)
+                current.publish({"chart": chart_id}, "deleted")
+                return
+            try:
+                stream = await in_worker(ChartStream.load)(config)
+            except Exception as e:
+                logger.warning(f"Reloading the stream of chart {chart_id} failed: {e}")
+                return
+            stream.queues = current.queues
+            if stream_key(config) != group.key:
+                self._remove(group, chart_id)
+            group = self._add(config, stream)
+            if group.task is None or group.task.done():
+                group.task = asyncio.create_task(group.run())
+        stream.publish(stream.snapshot, "snapshot")
+
+    def _find(self, chart_id: int):
+        """
+        (group, stream) of a streamed chart, or None
+        """
+        for group in list(self.groups.values()):
+            stream = group.charts.get(chart_id)
+            if stream is not None:
+                return group, stream
+        return None
+
+    def _add(self, config: ChartConfig, stream: ChartStream) -> StreamGroup:
+        """
+        Puts a loaded stream in the group of its key, taking over the viewers
+        of the stream it replaces
+        """
+        key = stream_key(config)
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = StreamGroup(key, config)
+        elif group.config.pk == config.pk:
+            group.config = config
+        if config.pk in group.charts:
+            stream.queues = group.charts[config.pk].queues
+        group.charts[config.pk] = stream
+        group.advance(stream.last_timestamp)
+        if group.watermark is None:
+            group.watermark = pd.Timestamp(timezone.make_naive(timezone.now()))
+        return group
+
+    def _remove(self, group: StreamGroup, chart_id: int):
+        group.charts.pop(chart_id, None)
+        if not group.charts:
+            if group.task is not None:
+                group.task.cancel()
+            del self.groups[group.key]
+
+
+hub = ChartStreamHub()
@@ -0,0 +1,175 @@
+import io
+from datetime import datetime, timedelta
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+from .models import DataSource
+from .query_builder import get_dialect
+
+# Synthetic measurement tables for benchmarks and local testing: a
+# timestamp, value, product, operation table shaped like a plant's
+# measurement history, with optional drift / shift patterns and the dirty
+# values real sources contain (NULLs, non-numeric text).
+
+JUNK_VALUES = np.array(["n/a", "ERR", "#VALUE!", "--", "overflow"], dtype=object)
+COLUMNS = ["timestamp", "value", "product", "operation"]
+GENERATE_CHUNK_SIZE = 1_000_000
+INSERT_BATCH_SIZE = 10_000
+
+
+def iter_measurements(
+    rows: int,
+    products: int = 5,
+    operations: int = 3,
+    start: datetime = datetime(2024, 1, 1),
+    interval: timedelta = timedelta(seconds=1),
+    mean: float = 25.0,
+    sigma: float = 0.3,
+    drift: float = 0.0,
+    shift: float = 0.0,
+    nan_ratio: float = 0.0,
+    junk_ratio: float = 0.0,
+    seed: int = 42,
+    chunk_size: int = GENERATE_CHUNK_SIZE,
+) -> Iterator[pd.DataFrame]:
+    """
+    Yields the rows oldest first in chunks of timestamp, value, product
+    ("P1".. ) and operation ("10", "20", ..) columns. Each product /
+    operation pair has its own mean; `drift` sigmas are added linearly over
+    the series and `shift` sigmas from its last third on. With junk_ratio
+    the values are text, as a VARCHAR value column returns them.
+    """
+    rng = np.random.default_rng(seed)
+    pairs = products * operations
+    offsets = rng.normal(0.0, sigma, pairs)
+    for first in range(0, rows, chunk_size):
+        n = min(chunk_size, rows - first)
+        index = np.arange(first, first + n)
+        pair = rng.integers(0, pairs, n)
+        values = mean + offsets[pair] + rng.normal(0.0, sigma, n)
+        values += drift * sigma * index / max(rows - 1, 1)
+        values[index >= 2 * rows // 3] += shift * sigma
+        values[rng.random(n) < nan_ratio] = np.nan
+
+        if junk_ratio:
+            text = pd.Series(values).map("{:.6f}".format).to_numpy(dtype=object)
+            text[np.isnan(values)] = None
+            junk = rng.random(n) < junk_ratio
+            text[junk] = rng.choice(JUNK_VALUES, junk.sum())
+            values = text
+
+        yield pd.DataFrame(
+            {
+                "timestamp": pd.Timestamp(start) + index * pd.Timedelta(interval),
+                "value": values,
+                "product": pd.Categorical.from_codes(
+                    pair // operations, [f"P{i + 1}" for i in range(products)]
+                ),
+                "operation": pd.Categorical.from_codes(
+                    pair % operations, [str((i + 1) * 10) for i in range(operations)]
+                ),
+            }
+        )
+
+
+def generate_measurements(rows: int, **options) -> pd.DataFrame:
+    return pd.concat(list(iter_measurements(rows, **options)), ignore_index=True)
+
+
+def write_table(
+    source: DataSource,
+    table: str,
+    chunks: Iterator[pd.DataFrame],
+    text_values: bool = False,
+    index: bool = True,
+    ds_service=None,
+) -> int:
+    """
+    (Re)creates `table` on the source with the columns ts, value, product,
+    operation and loads the chunks into it: COPY on PostgreSQL, batched
+    fast_executemany inserts on MSSQL. The value column is text when
+    text_values. With `index`, adds the covering index charts need
+    (product, operation, ts) INCLUDE (value). Returns the rows written.
+    """
+    if ds_service is None:
+        from .services import DataSourceService
+
+        ds_service = DataSourceService()
+    dialect = get_dialect(source)
+    postgres = source.engine == DataSource.Engine.POSTGRES
+    name = ".".join(dialect.quote(part) for part in table.split("."))
+    value_type = dialect.text_type if text_values else dialect.float_type
+    if postgres:
+        timestamp_type, label_type = "TIMESTAMP", "TEXT"
+    else:
+        timestamp_type, label_type = "DATETIME2", "NVARCHAR(50)"
+
+    written = 0
+    with ds_service.connection(source) as conn:
+        cursor = conn.cursor()
+        _drop(cursor, source, table, name)
+        cursor.execute(
+            f"CREATE TABLE {name} (ts {timestamp_type}, value {value_type}, "
+            f"product {label_type}, operation {label_type})"
+        )
+        if not postgres:
+            cursor.fast_executemany = True
+        for chunk in chunks:
+            if postgres:
+                buffer = io.StringIO()
+                chunk[COLUMNS].to_csv(buffer, header=False, index=False)
+                buffer.seek(0)
+                cursor.copy_expert(
+                    f"COPY {name} (ts, value, product, operation) FROM STDIN "
+                    "WITH (FORMAT csv)",
+                    buffer,
+                )
+            else:
+                rows = chunk[COLUMNS].astype(object)
+                rows = rows.where(rows.notna(), None)
+                records = list(
+                    zip(
+                        rows["timestamp"].map(pd.Timestamp.to_pydatetime),
+                        rows["value"],
+                        rows["product"],
+                        rows["operation"],
+                    )
+                )
+                for i in range(0, len(records), INSERT_BATCH_SIZE):
+                    cursor.executemany(
+                        f"INSERT INTO {name} (ts, value, product, operation) "
+                        "VALUES (?, ?, ?, ?)",
+                        records[i : i + INSERT_BATCH_SIZE],
+                    )
+            written += len(chunk)
+        if index:
+            index_name = dialect.quote(f"ix_{table.split('.')[-1]}_chart")
+            cursor.execute(
+                f"CREATE INDEX {index_name} ON {name} (product, operation, ts) "
+                "INCLUDE (value)"
+            )
+        if postgres:
+            cursor.execute(f"ANALYZE {name}")
+        conn.commit()
+    return written
+
+
+def _drop(cursor, source: DataSource, table: str, name: str):
+    if source.engine == DataSource.Engine.POSTGRES:
+        cursor.execute(f"DROP TABLE IF EXISTS {name}")
+    else:
+        cursor.execute(f"IF OBJECT_ID(?, 'U') IS NOT NULL DROP TABLE {name}", [table])
+
+
+def drop_table(source: DataSource, table: str, ds_service=None):
+    if ds_service is None:
+        from .services import DataSourceService
+
+        ds_service = DataSourceService()
+    dialect = get_dialect(source)
+    name = ".".join(dialect.quote(part) for part in table.split("."))
+    with ds_service.connection(source) as conn:
+        _drop(conn.cursor(), source, table, name)
+        conn.commit()
@@ -1,3 +1,1965 @@
-from django.test import TestCase
+import asyncio
+import json
+import struct
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, Mock, patch
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from authentication.models import User
+from .async_executor import SourceBusy, SourceExecutor
+from .baselines import BaselineError, BaselineService
+from .batch import BatchChartService
+from .calculation_service import CalculationService
+from .connection_pool import ConnectionPool, PoolTimeout, get_pool, invalidate_pool
+from .models import (
+    ChartConfig,
+    DataSource,
+    Measurement,
+    MeasurementCache,
+    RollupBucket,
+    StatisticsBucket,
+)
+from .extraction import (
+    BINARY_SIGNATURE,
+    BINARY_TRAILER,
+    BinaryCopyParser,
+    CSVCopyParser,
+)
+from .control_limits import c4, individuals_limits, subgroup_limits
+from .index_advisor import match_index, parse_postgres_plan, parse_showplan
+from .measurement_cache import MeasurementCacheService, SyncBusy, to_naive
+from .moments import (
+    BucketStatistics,
+    RunningMoments,
+    bucket_starts,
+    bucket_width,
+    moments_frame,
+)
+from .parallel import ParallelChartService
+from .parallel_worker import SHARED_ROWS, attach_frame, compute_chart, share_frame
+from .pipeline import ChunkAggregator
+from .query_builder import (
+    ChartQuery,
+    Dialect,
+    MSSQLDialect,
+    QueryBuildError,
+    split_table_name,
+)
+from .renderers import (
+    PACKED_MAGIC,
+    PACKED_PREFIX,
+    ChartColumnarJSONRenderer,
+    ChartPackedRenderer,
+)
+from .result_cache import result_cache
+from .rollups import RESOLUTIONS, RollupPyramid, rollup_origin
+from .schema_catalog import CatalogError, SchemaCatalog, search_tables
+from .services import DataSourceService, decode_timestamps, decode_values
+from .snapshots import SnapshotService
+from .streaming import ChartStream, ChartStreamHub
+from .synthetic import generate_measurements
+from .views import (
+    ChartDataView,
+    DataSourceViewSet,
+    MetricsView,
+    authenticate_async,
+    chart_data_async,
+)
+from . import downsample, instrumentation, weco
+
+
+class FakeConnection:
+    """
+    DBAPI connection stand-in; `check` runs inside the health check query
+    """
+
+    def __init__(self, healthy=True, check=None):
+        self.healthy = healthy
+        self.check = check
+        self.closed = False
+
+    def cursor(self):
+        return self
+
+    def execute(self, query):
+        if self.check is not None:
+            self.check()
+        if not self.healthy:
+            raise RuntimeError("connection reset")
+
+    def fetchall(self):
+        return [(1,)]
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def pool(self, **options):
+        self.opened = []
+
+        def connect():
+            self.opened.append(FakeConnection())
+            return self.opened[-1]
+
+        return ConnectionPool(connect, **options)
+
+    def test_reuse_and_health_check(self):
+        pool = self.pool()
+        conn = pool.acquire()
+        pool.release(conn)
+        self.assertIs(pool.acquire(), conn)
+
+        conn.healthy = False
+        pool.release(conn)
+        replacement = pool.acquire()
+        self.assertIsNot(replacement, conn)
+        self.assertTrue(conn.closed)
+        stats = pool.as_dict()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+        self.assertEqual((stats["health_check_failures"], stats["in_use"]), (1, 1))
+
+    def test_idle_expiry(self):
+        pool = self.pool(idle_timeout=0.01)
+        conn = pool.acquire()
+        pool.release(conn)
+        time.sleep(0.02)
+
+        self.assertIsNot(pool.acquire(), conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.as_dict()["idle_expired"], 1)
+
+    def test_max_size_blocks_until_release(self):
+        pool = self.pool(max_size=1, checkout_timeout=0.05)
+        conn = pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        self.assertEqual(pool.as_dict()["timeouts"], 1)
+
+        pool.checkout_timeout = 5
+        threading.Timer(0.05, pool.release, args=(conn,)).start()
+        self.assertIs(pool.acquire(), conn)
+        # The timed out checkout waited too
+        self.assertEqual(pool.as_dict()["waits"], 2)
+
+    def test_health_check_does_not_hold_the_lock(self):
+        pool = self.pool(max_size=2)
+        checking, resume = threading.Event(), threading.Event()
+        conn = pool.acquire()
+        conn.check = lambda: (checking.set(), resume.wait(5))
+        pool.release(conn)
+
+        checker = threading.Thread(target=pool.acquire)
+        checker.start()
+        checking.wait(5)
+        # The other slot is handed out while the health check hangs
+        other = pool.acquire()
+        self.assertIsNot(other, conn)
+        pool.release(other)
+        resume.set()
+        checker.join()
+
+    def test_rebuilt_when_source_changes(self):
+        source = SimpleNamespace(pk=-1, updated_at=datetime(2024, 3, 1))
+        pool = get_pool(source, FakeConnection)
+        try:
+            self.assertIs(get_pool(source, FakeConnection), pool)
+            source.updated_at = datetime(2024, 3, 2)
+            rebuilt = get_pool(source, FakeConnection)
+            self.assertIsNot(rebuilt, pool)
+            with self.assertRaises(PoolTimeout):
+                pool.acquire()
+        finally:
+            invalidate_pool(source.pk)
+
+
+class RunningMomentsTests(SimpleTestCase):
+    def test_merge_matches_full_series(self):
+        rng = np.random.default_rng(1)
+        values = rng.normal(25.0, 0.3, 10_000)
+        chunks = np.array_split(values, [3, 700, 701, 5000])
+
+        merged = RunningMoments.merge_all(RunningMoments.from_values(c) for c in chunks)
+        expected = pd.Series(values)
+
+        self.assertEqual(merged.count, len(values))
+        self.assertAlmostEqual(merged.mean, expected.mean(), places=10)
+        self.assertAlmostEqual(merged.std, expected.std(), places=10)
+        self.assertEqual(merged.min, expected.min())
+        self.assertEqual(merged.max, expected.max())
+
+    def test_nan_and_empty(self):
+        moments = RunningMoments.from_values([np.nan, 1.0, np.nan])
+        self.assertEqual(moments.count, 1)
+        self.assertTrue(np.isnan(moments.std))
+        self.assertEqual(RunningMoments().merge(moments).mean, 1.0)
+        self.assertEqual(RunningMoments.merge_all([]).as_statistics()["count"], 0)
+
+
+class DecodeTests(SimpleTestCase):
+    def test_values(self):
+        values = decode_values([1, 2.5, Decimal("3.25"), None, "x", "4"])
+        np.testing.assert_array_equal(values, [1, 2.5, 3.25, np.nan, np.nan, 4])
+        self.assertEqual(decode_values((1.0, 2.0)).dtype, np.float64)
+
+    def test_timestamps(self):
+        naive = [datetime(2024, 3, 1, 12), None, datetime(2024, 3, 1, 13, 0, 0, 5)]
+        stamps = decode_timestamps(naive)
+        self.assertEqual(stamps.dtype, np.dtype("datetime64[ns]"))
+        self.assertTrue(np.isnat(stamps[1]))
+        self.assertEqual(stamps[2], np.datetime64("2024-03-01T13:00:00.000005"))
+
+        with override_settings(TIME_ZONE="Europe/Berlin"):
+            # Offsets differ across the DST change; both end up in local time
+            aware = [
+                datetime(2024, 3, 31, 0, 30, tzinfo=dt_timezone.utc),
+                datetime(2024, 3, 31, 3, 30, tzinfo=dt_timezone(timedelta(hours=2))),
+            ]
+            np.testing.assert_array_equal(
+                decode_timestamps(aware),
+                np.array(["2024-03-31T01:30", "2024-03-31T03:30"], "datetime64[ns]"),
+            )
+
+
+class CopyParserTests(SimpleTestCase):
+    def test_binary(self):
+        rows = [(0, 1.5), (86_400_000_001, float("nan")), (-1, -2.0)]
+        stream = BINARY_SIGNATURE + struct.pack(">ii", 0, 4) + b"ext!"
+        for micros, value in rows:
+            stream += struct.pack(">hiqid", 2, 8, micros, 8, value)
+        stream += BINARY_TRAILER
+
+        parser = BinaryCopyParser(chunk_size=2, aware=False)
+        # Header and one and a bit rows, then the rest
+        buffer = bytearray(stream[:54])
+        frames = parser.parse(buffer)
+        buffer += stream[54:]
+        frames += parser.finish(buffer)
+
+        df = pd.concat(frames, ignore_index=True)
+        self.assertEqual([len(frame) for frame in frames], [1, 2])
+        self.assertEqual(
+            df["timestamp"].tolist(),
+            [
+                pd.Timestamp("2000-01-01"),
+                pd.Timestamp("2000-01-02 00:00:00.000001"),
+                pd.Timestamp("1999-12-31 23:59:59.999999"),
+            ],
+        )
+        np.testing.assert_array_equal(df["value"], [1.5, np.nan, -2.0])
+        with self.assertRaises(ValueError):
+            BinaryCopyParser(1, aware=False).finish(bytearray(stream[:-1]))
+
+    def test_csv(self):
+        parser = CSVCopyParser(chunk_size=1)
+        buffer = bytearray(b"2024-03-31 00:30:00+01,1.5\n2024-03-31 03:30:00.5+02,")
+        frames = parser.parse(buffer)
+        buffer += b"\n2024-03-31 04:00:00+02,bad\n"
+        frames += parser.finish(buffer)
+
+        df = pd.concat(frames, ignore_index=True)
+        self.assertEqual(
+            df["timestamp"].tolist(),
+            [
+                pd.Timestamp("2024-03-30 23:30"),
+                pd.Timestamp("2024-03-31 01:30:00.5"),
+                pd.Timestamp("2024-03-31 02:00"),
+            ],
+        )
+        np.testing.assert_array_equal(df["value"], [1.5, np.nan, np.nan])
+
+
+class ChartFixture:
+    """
+    A chart on a (never connected) source, its measurements as self.df and
+    a fake CalculationService.fetch_chunks serving them
+    """
+
+    def create_chart(self, **fields) -> ChartConfig:
+        owner = User.objects.create(email="spc@example.com")
+        self.source = DataSource.objects.create(
+            name="plant",
+            host="localhost",
+            database_name="mes",
+            username="u",
+            password="p",
+        )
+        return ChartConfig.objects.create(
+            owner=owner, data_source=self.source, **fields
+        )
+
+    @staticmethod
+    def measurements(periods: int, freq: str, seed: int) -> pd.DataFrame:
+        rng = np.random.default_rng(seed)
+        return pd.DataFrame(
+            {
+                "timestamp": pd.date_range("2024-03-01", periods=periods, freq=freq),
+                "value": rng.normal(25.0, 0.3, periods),
+            }
+        )
+
+    def cache_rows(self, df: pd.DataFrame):
+        Measurement.objects.bulk_create(
+            Measurement(
+                chart=self.config,
+                timestamp=timezone.make_aware(ts.to_pydatetime()),
+                value=value,
+            )
+            for ts, value in zip(df["timestamp"], df["value"])
+        )
+
+    def add_in_two_syncs(self, add, split: int):
+        # Exercises merging into existing buckets
+        for part in (self.df.iloc[:split], self.df.iloc[split:]):
+            add(self.config, part)
+
+    def fetch_chunks(self, config, start_date, end_date, max_rows):
+        # Newest max_rows rows of the window, as the source query returns them
+        df = self.df
+        mask = (df["timestamp"] >= start_date) & (df["timestamp"] <= end_date)
+        yield df[mask].iloc[::-1].iloc[:max_rows].reset_index(drop=True)
+
+
+class FakeSchemaSource:
+    """
+    Answers describe_table's INFORMATION_SCHEMA query for one table
+    """
+
+    def __init__(self, schema, table, columns):
+        self.columns = pd.DataFrame(
+            {"table_schema": schema, "table_name": table, "column_name": columns}
+        )
+
+    def query(self, source, query, params):
+        names = self.columns["table_name"].str.lower()
+        return self.columns[names == params[0].lower()].reset_index(drop=True)
+
+
+class QueryBuilderTests(ChartFixture, TestCase):
+    def setUp(self):
+        self.config = self.create_chart(
+            table_name="dbo.Meas",
+            value_column="VALUE",
+            datetime_column="ts",
+            product_column="product",
+            operation_column='op"er]ation',
+            product_identifier="P1",
+            operation_identifier="10",
+        )
+        self.start, self.end = datetime(2024, 3, 1), datetime(2024, 3, 2)
+
+    def chart_query(self, engine, table="Meas", schema="dbo"):
+        self.source.engine = engine
+        self.source.save()
+        self.config.refresh_from_db()
+        columns = ["ts", "value", "product", 'op"er]ation']
+        return ChartQuery(self.config, FakeSchemaSource(schema, table, columns))
+
+    @staticmethod
+    def sql(query):
+        return " ".join(query.split())
+
+    def test_quoting(self):
+        self.assertEqual(Dialect().quote('a"b'), '"a""b"')
+        self.assertEqual(MSSQLDialect().quote("a]b"), "[a]]b]")
+        # A dot stays inside the one identifier
+        self.assertEqual(Dialect().quote("a.b"), '"a.b"')
+        self.assertEqual(MSSQLDialect().quote("a.b"), "[a.b]")
+        self.assertEqual(split_table_name("[dbo].[Meas]"), ("dbo", "Meas"))
+        self.assertEqual(split_table_name('"public"."meas"'), ("public", "meas"))
+        self.assertEqual(split_table_name("meas"), (None, "meas"))
+        with self.assertRaises(QueryBuildError):
+            split_table_name("db.dbo.meas")
+
+        query = self.chart_query(DataSource.Engine.MSSQL)
+        self.assertEqual(query.table, "[dbo].[Meas]")
+        # Matched case-insensitively, emitted as the source spells them
+        self.assertEqual(query.value, "[value]")
+        self.assertEqual(query.operation, '[op"er]]ation]')
+        query = self.chart_query(DataSource.Engine.POSTGRES)
+        self.assertEqual(query.operation, '"op""er]ation"')
+
+    def test_unknown_table_and_columns(self):
+        with self.assertRaises(QueryBuildError):
+            self.chart_query(DataSource.Engine.MSSQL, table="other")
+        with self.assertRaises(QueryBuildError):
+            self.chart_query(DataSource.Engine.MSSQL, schema="sales")
+        self.config.value_column = "value; DROP TABLE Meas --"
+        self.config.save()
+        with self.assertRaises(QueryBuildError):
+            self.chart_query(DataSource.Engine.MSSQL)
+
+    def test_raw_row_cap(self):
+        query, params = self.chart_query(DataSource.Engine.MSSQL).raw(
+            self.start, self.end, 100
+        )
+        self.assertEqual(params, [100, "P1", "10", self.start, self.end])
+        self.assertTrue(self.sql(query).startswith("SELECT TOP (?) [ts] AS timestamp"))
+        self.assertTrue(self.sql(query).endswith("ORDER BY [ts] DESC"))
+        self.assertEqual(query.count("?"), len(params))
+
+        query, params = self.chart_query(DataSource.Engine.POSTGRES).raw(
+            self.start, self.end, 100, ascending=True, exclusive_start=True
+        )
+        self.assertEqual(params, ["P1", "10", self.start, self.end, 100])
+        self.assertIn('"ts" > %s AND "ts" <= %s', self.sql(query))
+        self.assertTrue(self.sql(query).endswith('ORDER BY "ts" ASC LIMIT %s'))
+        self.assertEqual(query.count("%s"), len(params))
+
+        # Uncapped, for streamed fetches
+        query, params = self.chart_query(DataSource.Engine.MSSQL).raw(
+            self.start, self.end, None
+        )
+        self.assertEqual(params, ["P1", "10", self.start, self.end])
+        self.assertNotIn("TOP", query)
+
+    def test_batch_matches_pairs(self):
+        other = ChartConfig(product_identifier="P2", operation_identifier="20")
+        twin = ChartConfig(product_identifier="P1", operation_identifier="10")
+        configs = [self.config, other, twin]
+        pairs = ["P1", "10", "P2", "20"]
+
+        query, params = self.chart_query(DataSource.Engine.MSSQL).batch(
+            configs, self.start, self.end, 500
+        )
+        self.assertEqual(params, [*pairs, *pairs, self.start, self.end, 500])
+        self.assertIn(
+            'CASE WHEN [product] = ? AND [op"er]]ation] = ? THEN 0 '
+            'WHEN [product] = ? AND [op"er]]ation] = ? THEN 1 END AS pair_id',
+            self.sql(query),
+        )
+        self.assertIn(
+            'WHERE (([product] = ? AND [op"er]]ation] = ?) '
+            'OR ([product] = ? AND [op"er]]ation] = ?))',
+            self.sql(query),
+        )
+        # Capped per pair, not for the whole group
+        self.assertIn(
+            "ROW_NUMBER() OVER (PARTITION BY pair_id ORDER BY ts DESC)",
+            self.sql(query),
+        )
+        self.assertTrue(
+            self.sql(query).endswith("WHERE rn <= ? ORDER BY pair_id, ts DESC")
+        )
+        self.assertEqual(query.count("?"), len(params))
+
+        query, params = self.chart_query(DataSource.Engine.POSTGRES).batch(
+            configs, self.start, self.end, 500
+        )
+        self.assertEqual(params, [*pairs, *pairs, self.start, self.end, 500])
+        self.assertIn("WHERE rn <= %s", self.sql(query))
+        self.assertEqual(query.count("%s"), len(params))
+
+    def test_aggregate_row_cap(self):
+        self.config.aggregation_type = "TIME_HOUR"
+        self.config.save()
+        query, params = self.chart_query(DataSource.Engine.MSSQL).aggregate(
+            self.start, self.end, 100
+        )
+        self.assertEqual(params, [100, "P1", "10", self.start, self.end])
+        self.assertTrue(self.sql(query).startswith("SELECT TOP (?) bucket"))
+        self.assertIn("DATEADD(hour, (DATEDIFF(hour, '2000-01-01', [ts])", query)
+
+        query, params = self.chart_query(DataSource.Engine.POSTGRES).aggregate(
+            self.start, self.end, 100
+        )
+        self.assertEqual(params, ["P1", "10", self.start, self.end, 100])
+        self.assertIn("""date_trunc('hour', "ts")""", query)
+        self.assertTrue(self.sql(query).endswith("ORDER BY bucket DESC LIMIT %s"))
+
+        # COUNT subgroups cap the raw rows in the inner query
+        self.config.aggregation_type = "COUNT"
+        self.config.aggregation_size = 5
+        self.config.save()
+        query, params = self.chart_query(DataSource.Engine.POSTGRES).aggregate(
+            self.start, self.end, 100
+        )
+        self.assertEqual(params, ["P1", "10", self.start, self.end, 100])
+        self.assertIn('ORDER BY "ts" DESC LIMIT %s ) AS recent', self.sql(query))
+        self.assertIn("/ 5 AS group_id", query)
+        query, params = self.chart_query(DataSource.Engine.MSSQL).aggregate(
+            self.start, self.end, 100
+        )
+        self.assertEqual(params, [100, "P1", "10", self.start, self.end])
+        self.assertIn("SELECT TOP (?) [ts] AS ts", self.sql(query))
+
+
+class SourceWindowTests(ChartFixture, TestCase):
+    def setUp(self):
+        self.config = self.create_chart(
+            aggregation_type="COUNT", aggregation_size=1, aggregation_pushdown=False
+        )
+        self.df = self.measurements(500, "min", seed=8)
+        self.queries = []
+
+    def build_query(self, config, start_date, end_date, max_rows, *args):
+        self.queries.append((start_date, end_date, max_rows))
+        return "SELECT", [start_date, end_date, max_rows]
+
+    def stream_series(self, source, query, params):
+        rows = next(self.fetch_chunks(self.config, *params))
+        for i in range(0, len(rows), 64):
+            yield rows.iloc[i : i + 64]
+
+    @override_settings(SPC_MAX_ROWS=100, SPC_DEFAULT_LOOKBACK_DAYS=1)
+    def test_window_and_row_cap_pushed_down(self):
+        service = CalculationService()
+        with patch.object(
+            CalculationService, "build_query", self.build_query
+        ), patch.object(DataSourceService, "stream_series", self.stream_series), patch(
+            "django.utils.timezone.now",
+            return_value=timezone.make_aware(datetime(2024, 3, 1, 6)),
+        ):
+            capped = service.compute_chart_data(self.config)
+            full = service.compute_chart_data(
+                self.config, datetime(2024, 3, 1, 7), datetime(2024, 3, 1, 8)
+            )
+
+        self.assertEqual(
+            self.queries,
+            [
+                (datetime(2024, 2, 29, 6), datetime(2024, 3, 1, 6), 100),
+                (datetime(2024, 3, 1, 7), datetime(2024, 3, 1, 8), 100),
+            ],
+        )
+        # The newest 100 rows up to 06:00, oldest first
+        expected = self.df["timestamp"].iloc[261:361].reset_index(drop=True)
+        pd.testing.assert_series_equal(
+            capped["data"]["timestamp"], expected, check_names=False
+        )
+        self.assertTrue(capped["window"]["truncated"])
+        self.assertEqual(len(full["data"]), 61)
+        self.assertFalse(full["window"]["truncated"])
+
+
+class AggregatePushdownTests(ChartFixture, TestCase):
+    def setUp(self):
+        self.config = self.create_chart(
+            aggregation_type="TIME_HOUR", aggregation_size=1
+        )
+        self.df = self.measurements(3000, "53s", seed=9)
+        self.start, self.end = datetime(2024, 3, 1), datetime(2024, 3, 3)
+        self.service = CalculationService()
+
+    def query(self, source, query, params):
+        # What the GROUP BY returns: DECIMAL columns, newest bucket first
+        values = self.df.set_index("timestamp")["value"]
+        grouped = values.groupby(values.index.floor("h")).agg(
+            ["mean", "std", "count", "min", "max"]
+        )
+        grouped = grouped.map(lambda v: Decimal(str(v)))
+        return grouped.iloc[::-1].rename_axis("timestamp").reset_index()
+
+    def compute(self, pushdown=True):
+        self.config.aggregation_pushdown = pushdown
+        with patch.object(
+            CalculationService, "build_aggregate_query", return_value=("SELECT", [])
+        ), patch.object(CalculationService, "fetch_chunks", self.fetch_chunks):
+            return self.service.compute_chart_data(self.config, self.start, self.end)
+
+    def assert_same_payload(self, payload, expected):
+        pd.testing.assert_frame_equal(
+            payload["data"], expected["data"], check_dtype=False
+        )
+        for key, value in expected["statistics"].items():
+            self.assertAlmostEqual(payload["statistics"][key], value, places=9)
+        self.assertEqual(payload["violations"], expected["violations"])
+
+    def test_matches_pandas(self):
+        self.service.ds_service.query = self.query
+        pushed = self.compute()
+        expected = self.compute(pushdown=False)
+
+        self.assertTrue(pushed["window"]["pushdown"])
+        self.assertFalse(expected["window"]["pushdown"])
+        self.assert_same_payload(pushed, expected)
+
+    def test_falls_back_to_pandas(self):
+        self.service.ds_service.query = Mock(side_effect=RuntimeError("date_bin"))
+        with self.assertLogs("spc.calculation_service", "WARNING"):
+            fallback = self.compute()
+
+        self.assertFalse(fallback["window"]["pushdown"])
+        self.assert_same_payload(fallback, self.compute(pushdown=False))
+
+    def test_day_buckets_share_the_origin(self):
+        # 2024-01-01 is a whole number of 3-day buckets after BUCKET_ORIGIN
+        self.config.aggregation_type = "TIME_DAY"
+        self.config.aggregation_size = 3
+        df = self.measurements(2000, "7min", seed=2)
+        df["timestamp"] = pd.date_range("2024-01-02 05:00", periods=2000, freq="7min")
+
+        grouped = CalculationService.aggregate(self.config, df)
+        streamed = ChunkAggregator(self.config).extend([df]).grouped()
+        self.assertEqual(grouped["timestamp"][0], pd.Timestamp("2024-01-01"))
+        pd.testing.assert_frame_equal(grouped, streamed, check_dtype=False)
+
+
+class BucketStatisticsTests(ChartFixture, TestCase):
+    def setUp(self):
+        self.config = self.create_chart(
+            aggregation_type="TIME_HOUR",
+            aggregation_size=1,
+            upper_spec_limit=26.0,
+            lower_spec_limit=24.0,
+        )
+        self.df = self.measurements(2000, "97s", seed=7)
+        self.cache_rows(self.df)
+        self.add_in_two_syncs(BucketStatistics().add, 1234)
+
+    def _window(self, start, end):
+        mask = (self.df["timestamp"] >= start) & (self.df["timestamp"] <= end)
+        return self.df[mask].reset_index(drop=True)
+
+    def test_time_buckets_match_pandas(self):
+        start, end = datetime(2024, 3, 1, 5, 17), datetime(2024, 3, 2, 9, 41)
+        grouped = BucketStatistics().window_buckets(self.config, start, end)
+        expected = CalculationService.aggregate(self.config, self._window(start, end))
+
+        pd.testing.assert_frame_equal(
+            grouped.reset_index(drop=True),
+            expected.reset_index(drop=True),
+            check_dtype=False,
+        )
+
+    def test_streamed_chunks_match_pandas(self):
+        # Newest first, as the source returns them, with a non-numeric value
+        rows = list(zip(self.df["timestamp"][::-1], self.df["value"][::-1]))
+        rows[10] = (rows[10][0], "n/a")
+        # Pending chunk moments are merged every three chunks
+        with patch("spc.pipeline.PENDING_PARTS", 3):
+            chunks = ChunkAggregator(self.config).extend(
+                pd.DataFrame(
+                    {
+                        "timestamp": decode_timestamps([row[0] for row in part]),
+                        "value": decode_values([row[1] for row in part]),
+                    }
+                )
+                for part in (rows[i : i + 300] for i in range(0, len(rows), 300))
+            )
+        expected = CalculationService.aggregate(
+            self.config, self.df.drop(index=len(self.df) - 11)
+        )
+
+        self.assertEqual(chunks.rows, len(self.df))
+        pd.testing.assert_frame_equal(
+            chunks.grouped().reset_index(drop=True),
+            expected.reset_index(drop=True),
+            check_dtype=False,
+        )
+
+    def test_window_moments_match_pandas(self):
+        self.config.aggregation_type = "COUNT"
+        self.config.aggregation_size = 5
+        BucketStatistics().rebuild(self.config)
+
+        start, end = datetime(2024, 3, 1, 2, 3), datetime(2024, 3, 2, 11, 0)
+        stats = BucketStatistics().window_moments(self.config, start, end)
+        expected = CalculationService.series_statistics(
+            self._window(start, end)["value"]
+        )
+
+        self.assertEqual(stats.count, expected["count"])
+        for key, value in stats.as_statistics().items():
+            self.assertAlmostEqual(value, expected[key], places=9)
+
+
+class RollupPyramidTests(ChartFixture, TestCase):
+    def setUp(self):
+        self.config = self.create_chart(
+            aggregation_type="TIME_HOUR", aggregation_size=1, cache_measurements=True
+        )
+        self.df = self.measurements(5000, "307s", seed=11)
+        self.cache_rows(self.df)
+        self.add_in_two_syncs(RollupPyramid().add, 3210)
+
+    def test_windows_match_pandas(self):
+        start, end = datetime(2024, 3, 2, 5, 17, 30), datetime(2024, 3, 16, 9, 41)
+        mask = (self.df["timestamp"] >= start) & (self.df["timestamp"] <= end)
+        window = self.df[mask].set_index("timestamp")["value"]
+        for resolution, width in RESOLUTIONS.items():
+            moments = RollupPyramid().window(self.config, resolution, start, end)
+            grouped = moments_frame(moments)
+            expected = window.resample(
+                width, origin=pd.Timestamp(rollup_origin(resolution))
+            ).agg(["mean", "std", "count", "min", "max"])
+            expected = expected[expected["count"] > 0].reset_index()
+            expected["range"] = expected["max"] - expected["min"]
+
+            pd.testing.assert_frame_equal(grouped, expected, check_dtype=False)
+
+    def test_choose_resolution(self):
+        pyramid = RollupPyramid()
+        end = datetime(2024, 3, 20)
+        # 240 hourly points fit; 1440 don't, 60 daily ones do
+        self.assertIsNone(
+            pyramid.choose(self.config, end - timedelta(days=10), end, 800)
+        )
+        self.assertEqual(
+            pyramid.choose(self.config, end - timedelta(days=60), end, 800), "day"
+        )
+        self.assertEqual(
+            pyramid.choose(self.config, end - timedelta(days=3000), end, 100), "week"
+        )
+
+    def test_rollup_payload(self):
+        start, end = datetime(2024, 3, 1), datetime(2024, 3, 19)
+        with patch.object(MeasurementCacheService, "sync"):
+            data = CalculationService().compute_rollup_data(
+                self.config, "day", start, end
+            )
+
+        self.assertEqual(data["window"]["resolution"], "day")
+        self.assertEqual(len(data["data"]), 18)
+        self.assertEqual(data["limits"]["chart"], "xbar")
+        expected = CalculationService.series_statistics(self.df["value"])
+        for key in ("mean", "std_dev", "min", "max", "count"):
+            self.assertAlmostEqual(data["statistics"][key], expected[key], places=9)
+
+
+class MeasurementCacheTests(ChartFixture, TestCase):
+    def setUp(self):
+        self.config = self.create_chart(
+            aggregation_type="TIME_HOUR", aggregation_size=1, cache_measurements=True
+        )
+        # Two rows per minute, so chunks of 75 split rows sharing a timestamp
+        self.df = self.measurements(600, "min", seed=5)
+        self.df["timestamp"] = self.df["timestamp"].iloc[:300].repeat(2).values
+        self.queries = []
+        self.fail_after = None
+        self.after_chunk = None
+
+    def build_query(
+        self,
+        config,
+        start_date,
+        end_date,
+        max_rows,
+        ascending=False,
+        exclusive_start=False,
+    ):
+        self.queries.append((start_date, end_date, ascending, exclusive_start))
+        return "SELECT", [start_date, end_date, ascending, exclusive_start]
+
+    def stream_series(self, source, query, params):
+        start_date, end_date, ascending, exclusive_start = params
+        ts = self.df["timestamp"]
+        after = ts > start_date if exclusive_start else ts >= start_date
+        rows = self.df[after & (ts <= end_date)]
+        if not ascending:
+            rows = rows.iloc[::-1]
+        for n, i in enumerate(range(0, len(rows), 75)):
+            if n == self.fail_after:
+                raise RuntimeError("connection reset")
+            yield rows.iloc[i : i + 75].reset_index(drop=True)
+            if self.after_chunk:
+                self.after_chunk()
+
+    def sync(self, start, end):
+        with patch.object(
+            CalculationService, "build_query", self.build_query
+        ), patch.object(DataSourceService, "stream_series", self.stream_series):
+            return MeasurementCacheService().sync(self.config, start, end)
+
+    def assert_cached(self, start, end):
+        state = MeasurementCache.objects.get(chart=self.config)
+        ts = self.df["timestamp"]
+        expected = self.df[(ts >= start) & (ts <= end)]
+        self.assertEqual(
+            Measurement.objects.filter(chart=self.config).count(), len(expected)
+        )
+        self.assertEqual(state.row_count, len(expected))
+        self.assertEqual(to_naive(state.low_watermark), start)
+        self.assertEqual(to_naive(state.watermark), expected["timestamp"].max())
+        self.assertEqual(state.sync_token, "")
+        # Buckets and rollups hold the same rows
+        minutes = RollupBucket.objects.filter(chart=self.config, resolution="minute")
+        self.assertEqual(sum(b.count for b in minutes), len(expected))
+        hours = StatisticsBucket.objects.filter(chart=self.config)
+        self.assertEqual(sum(b.count for b in hours), len(expected))
+
+    def test_watermark_advances_with_each_chunk(self):
+        self.fail_after = 3
+        with self.assertRaises(RuntimeError):
+            self.sync(datetime(2024, 3, 1, 1), datetime(2024, 3, 1, 4))
+
+        # Three chunks (225 rows) were read; the last row's minute is held back
+        state = MeasurementCache.objects.get(chart=self.config)
+        self.assertEqual(to_naive(state.watermark), datetime(2024, 3, 1, 2, 51))
+        self.assertEqual(state.row_count, 224)
+        self.assertEqual(state.sync_token, "")
+
+        self.fail_after = None
+        self.assertEqual(
+            self.sync(datetime(2024, 3, 1, 1), datetime(2024, 3, 1, 4)), 138
+        )
+        self.assertEqual(
+            self.queries[-1],
+            (datetime(2024, 3, 1, 2, 51), datetime(2024, 3, 1, 4), True, True),
+        )
+        self.assert_cached(datetime(2024, 3, 1, 1), datetime(2024, 3, 1, 4))
+
+    def test_backfill_below_low_watermark(self):
+        self.sync(datetime(2024, 3, 1, 1), datetime(2024, 3, 1, 4))
+        self.sync(datetime(2024, 3, 1), datetime(2024, 3, 1, 4, 30))
+
+        self.assertEqual(
+            self.queries[1:],
+            [
+                (datetime(2024, 3, 1), datetime(2024, 3, 1, 1), False, False),
+                (datetime(2024, 3, 1, 4), datetime(2024, 3, 1, 4, 30), True, True),
+            ],
+        )
+        self.assert_cached(datetime(2024, 3, 1), datetime(2024, 3, 1, 4, 30))
+
+    def test_source_edit_resyncs(self):
+        self.sync(datetime(2024, 3, 1, 1), datetime(2024, 3, 1, 4))
+        self.config.table_name = "dbo.Measurements_v2"
+        self.config.save()
+        self.sync(datetime(2024, 3, 1, 2), datetime(2024, 3, 1, 3))
+
+        self.assertEqual(
+            self.queries[-1],
+            (datetime(2024, 3, 1, 2), datetime(2024, 3, 1, 3), True, False),
+        )
+        self.assert_cached(datetime(2024, 3, 1, 2), datetime(2024, 3, 1, 3))
+
+    def test_purge(self):
+        self.sync(datetime(2024, 3, 1, 1), datetime(2024, 3, 1, 4))
+        MeasurementCacheService().purge(self.config)
+
+        state = MeasurementCache.objects.get(chart=self.config)
+        self.assertIsNone(state.low_watermark)
+        self.assertIsNone(state.watermark)
+        self.assertEqual(state.row_count, 0)
+        self.assertFalse(Measurement.objects.filter(chart=self.config).exists())
+        self.assertFalse(StatisticsBucket.objects.filter(chart=self.config).exists())
+        self.assertFalse(RollupBucket.objects.filter(chart=self.config).exists())
+
+    def test_purge_stops_running_sync(self):
+        self.after_chunk = lambda: MeasurementCacheService().purge(self.config)
+        self.sync(datetime(2024, 3, 1, 1), datetime(2024, 3, 1, 4))
+
+        state = MeasurementCache.objects.get(chart=self.config)
+        self.assertIsNone(state.watermark)
+        self.assertFalse(Measurement.objects.filter(chart=self.config).exists())
+
+    def test_stale_claim_taken_over(self):
+        MeasurementCache.objects.create(
+            chart=self.config,
+            sync_token="crashed",
+            sync_heartbeat=timezone.now() - timedelta(hours=1),
+        )
+        with self.assertLogs("spc.measurement_cache", "WARNING"):
+            self.sync(datetime(2024, 3, 1, 1), datetime(2024, 3, 1, 4))
+        self.assert_cached(datetime(2024, 3, 1, 1), datetime(2024, 3, 1, 4))
+
+    @override_settings(SPC_CACHE_SYNC_WAIT=0.3)
+    def test_busy_sync_serves_cached_rows(self):
+        # A live backfill holds the claim
+        MeasurementCache.objects.create(
+            chart=self.config, sync_token="backfill", sync_heartbeat=timezone.now()
+        )
+        start, end = datetime(2024, 3, 1, 1), datetime(2024, 3, 1, 4)
+        with self.assertRaises(SyncBusy):
+            self.sync(start, end)
+
+        started = time.monotonic()
+        with patch.object(CalculationService, "build_query", self.build_query):
+            _, stale = CalculationService().sync_cached(self.config, start, end)
+        self.assertTrue(stale)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(self.queries, [])
+        state = MeasurementCache.objects.get(chart=self.config)
+        self.assertEqual(state.sync_token, "backfill")
+
+
+class BatchChartTests(ChartFixture, TestCase):
+    def setUp(self):
+        cache.clear()
+        fields = dict(
+            table_name="meas",
+            operation_identifier="10",
+            aggregation_type="TIME_HOUR",
+            aggregation_pushdown=False,
+        )
+        self.config = self.create_chart(product_identifier="1", **fields)
+        self.other = ChartConfig.objects.create(
+            owner=self.config.owner,
+            data_source=self.source,
+            product_identifier="2",
+            **fields,
+        )
+        self.df = self.measurements(800, "min", seed=5)
+        # Every fourth row is product 2; the source tags rows with the index
+        # of their pair, whatever the product column's type
+        self.df["pair_id"] = (np.arange(800) % 4 == 0).astype(int)
+        self.service = CalculationService()
+        self.service.ds_service.fetch_rows = self.fetch_rows
+        self.limits = []
+
+    def fetch_rows(self, source, query, params, chunk_size=100):
+        # What the source returns: each pair's newest rows, pair by pair, as
+        # driver rows (datetimes, Decimals) in chunks
+        limit = params[-1]
+        self.limits.append(limit)
+        df = self.df.iloc[::-1].groupby("pair_id").head(limit)
+        rows = [
+            (ts.to_pydatetime(), Decimal(str(value)), pair_id)
+            for ts, value, pair_id in df.sort_values(
+                ["pair_id", "timestamp"], ascending=[True, False]
+            ).itertuples(index=False)
+        ]
+        for i in range(0, len(rows), chunk_size):
+            yield ["timestamp", "value", "pair_id"], rows[i : i + chunk_size]
+
+    def batch_query(self, configs, start_date, end_date, max_rows):
+        self.assertEqual(configs, [self.config, self.other])
+        return "SELECT", [max_rows]
+
+    def test_charts_share_one_query(self):
+        start, end = datetime(2024, 3, 1), datetime(2024, 3, 2)
+        with patch.object(CalculationService, "build_batch_query", self.batch_query):
+            results = BatchChartService(self.service).get_charts_data(
+                [self.config.pk, self.other.pk, 0], start, end
+            )
+
+        self.assertEqual(len(self.limits), 1)
+        self.assertIn("error", results[0])
+        for config, rows in ((self.config, 600), (self.other, 200)):
+            self.assertEqual(results[config.pk]["data"]["count"].sum(), rows)
+
+    @override_settings(SPC_MAX_ROWS=300)
+    def test_rows_capped_per_chart(self):
+        start, end = datetime(2024, 3, 1), datetime(2024, 3, 2)
+        with patch.object(CalculationService, "build_batch_query", self.batch_query):
+            fetched = dict(
+                BatchChartService(self.service).fetch_group(
+                    [self.config, self.other], start, end
+                )
+            )
+
+        self.assertEqual(self.limits, [300])
+        # Newest 300 of product 1's 600 rows, all 200 of product 2
+        part = fetched[self.config]
+        self.assertEqual(len(part), 300)
+        self.assertEqual(len(fetched[self.other]), 200)
+        self.assertTrue(part["timestamp"].is_monotonic_increasing)
+        self.assertEqual(part["timestamp"].iloc[-1], self.df["timestamp"].iloc[-1])
+        # Typed like single-chart fetches
+        self.assertEqual(part["timestamp"].dtype, "datetime64[ns]")
+        self.assertEqual(part["value"].dtype, np.float64)
+
+    def test_pushdown_charts_are_fetched_alone(self):
+        ChartConfig.objects.filter(pk__in=[self.config.pk, self.other.pk]).update(
+            aggregation_pushdown=True
+        )
+        start, end = datetime(2024, 3, 1), datetime(2024, 3, 2)
+        with patch.object(
+            CalculationService, "compute_chart_data", return_value={"data": []}
+        ) as compute:
+            BatchChartService(self.service).get_charts_data(
+                [self.config.pk, self.other.pk], start, end
+            )
+
+        self.assertEqual(self.limits, [])
+        self.assertEqual(compute.call_count, 2)
+
+    def test_failed_query_is_not_cached(self):
+        self.service.ds_service.fetch_rows = Mock(side_effect=RuntimeError("timeout"))
+        start, end = datetime(2024, 3, 1), datetime(2024, 3, 2)
+        with patch.object(
+            CalculationService, "build_batch_query", self.batch_query
+        ), self.assertLogs("spc.batch", "ERROR"):
+            results = BatchChartService(self.service).get_charts_data(
+                [self.config.pk, self.other.pk], start, end
+            )
+
+        for config in (self.config, self.other):
+            self.assertEqual(results[config.pk], {"error": "timeout"})
+            self.assertIsNone(result_cache.get(result_cache.key(config, start, end)))
+
+
+class ControlLimitsTests(SimpleTestCase):
+    def test_c4(self):
+        np.testing.assert_allclose(
+            c4([2, 5, 25, 63, 64, 1000]),
+            [0.7979, 0.9400, 0.9896, 0.99602, 0.99608, 0.99975],
+            atol=5e-5,
+        )
+        self.assertTrue(np.isnan(c4([1])[0]))
+
+    def test_textbook_constants(self):
+        rng = np.random.default_rng(5)
+        grouped = pd.DataFrame(
+            {
+                "mean": rng.normal(10.0, 0.5, 50),
+                "std": rng.uniform(0.5, 1.5, 50),
+                "count": 5,
+                "range": rng.uniform(1.0, 3.0, 50),
+            }
+        )
+        columns, summary = subgroup_limits(grouped)
+        r_bar = grouped["range"].mean()
+        # A2, D4 and D3 for subgroups of 5
+        np.testing.assert_allclose(
+            columns["xbar_r_ucl"], summary["center"] + 0.577 * r_bar, rtol=1e-3
+        )
+        np.testing.assert_allclose(columns["r_ucl"], 2.114 * r_bar, rtol=1e-3)
+        np.testing.assert_allclose(columns["r_lcl"], 0.0)
+        np.testing.assert_allclose(columns["r_center"], r_bar)
+
+        moving_range, limits = individuals_limits(pd.Series([1.0, 3.0, 2.0, 2.0]))
+        np.testing.assert_array_equal(moving_range[1:], [2.0, 1.0, 0.0])
+        self.assertAlmostEqual(limits["ucl"], 2.0 + 2.66, places=2)
+        self.assertAlmostEqual(limits["mr_ucl"], 3.267, places=2)
+
+    def test_variable_sizes_and_capability(self):
+        # Subgroup means shifted apart: overall sigma exceeds within sigma
+        grouped = pd.DataFrame(
+            {
+                "mean": [9.0, 11.0, 9.0, 11.0, 10.0],
+                "std": [1.0, 1.0, 1.0, 1.0, np.nan],
+                "count": [4, 10, 4, 30, 1],
+                "range": [2.0, 3.0, 2.0, 4.0, 0.0],
+            }
+        )
+        columns, summary = subgroup_limits(grouped)
+        self.assertAlmostEqual(summary["center"], 522 / 49)
+        self.assertTrue(np.isnan(columns["s_ucl"][4]))
+        self.assertGreater(columns["xbar_s_ucl"][0], columns["xbar_s_ucl"][3])
+
+        config = ChartConfig(
+            aggregation_type="TIME_HOUR", upper_spec_limit=14.0, lower_spec_limit=6.0
+        )
+        chart_data, limits = CalculationService.control_limits(grouped)
+        self.assertIn("xbar_r_ucl", chart_data)
+        stats = CalculationService.limits_capability(
+            config, CalculationService.grouped_statistics(config, grouped), limits
+        )
+        self.assertLess(stats["sigma_within"], stats["sigma_overall"])
+        self.assertGreater(stats["Cpk"], stats["Ppk"])
+
+
+class WecoRulesTests(SimpleTestCase):
+    ALL_RULES = weco.resolve_rules({rule: True for rule in weco.RULES})
+
+    def evaluate(self, values, centre=0.0, sigma=1.0):
+        hits = weco.evaluate(values, centre, sigma, self.ALL_RULES)
+        return {rule: indices.tolist() for rule, indices in hits.items()}
+
+    def test_default_rules_are_western_electric(self):
+        self.assertEqual(sorted(weco.resolve_rules({})), ["1", "2", "5", "6"])
+        rules = weco.resolve_rules({"1": True, "2": {"points": 8}, "3": False})
+        self.assertEqual(rules, {"1": {"sigma": 3.0}, "2": {"points": 8}})
+
+    def test_zone_rules(self):
+        values = np.zeros(20)
+        values[3] = 3.5  # rule 1
+        values[10], values[12] = 2.5, 2.2  # rule 5, second point completes it
+        hits = self.evaluate(values)
+        self.assertEqual(hits["1"], [3])
+        self.assertEqual(hits["5"], [12])
+        self.assertEqual(hits["6"], [])
+
+        values = np.array([0, 1.5, 1.2, -0.1, 1.1, 1.3, 0])
+        self.assertEqual(self.evaluate(values)["6"], [5])
+
+    def test_run_rules(self):
+        values = np.full(12, 0.5)
+        values[:3] = -0.5
+        self.assertEqual(self.evaluate(values)["2"], [11])
+        self.assertEqual(self.evaluate(values)["7"], [])
+        self.assertEqual(self.evaluate(np.full(16, 0.2))["7"], [14, 15])
+        self.assertEqual(self.evaluate(np.tile([1.5, -1.5], 4))["8"], [7])
+
+    def test_trend_and_alternating(self):
+        values = np.array([0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.4])
+        self.assertEqual(self.evaluate(values)["3"], [5])
+        values = np.tile([0.1, -0.1], 8)
+        self.assertEqual(self.evaluate(values)["4"], [13, 14, 15])
+
+    def test_no_sigma_skips_zone_rules(self):
+        hits = self.evaluate(np.ones(10), centre=1.0, sigma=0.0)
+        self.assertEqual(hits["1"], [])
+        self.assertEqual(hits["3"], [])
+
+    def test_sigma_per_point(self):
+        # Subgroups of 1 and 4 measurements: 3 sigma and 1.5 sigma(x)
+        hits = self.evaluate([3.5, 1.7, 3.5], sigma=[1.0, 0.5, 1.0])
+        self.assertEqual(hits["1"], [0, 1, 2])
+        self.assertEqual(self.evaluate([1.7], sigma=[1.0])["1"], [])
+
+    def test_zones_come_from_control_limits(self):
+        # Subgroup means swing far more than the spread within subgroups: the
+        # X̄ limits (sigma within / sqrt(n)) flag every subgroup, unlike zones
+        # estimated from the spread of the plotted means
+        grouped = pd.DataFrame(
+            {
+                "timestamp": pd.date_range("2024-03-01", periods=20, freq="h"),
+                "mean": np.tile([24.0, 26.0], 10),
+                "std": 0.1,
+                "range": 0.2,
+                "count": 5,
+            }
+        )
+        config = ChartConfig(weco_rules={"1": True})
+        stats = {"mean": 25.0, "std_dev": 1.0}
+        payload = CalculationService().build_payload(
+            config, grouped, stats, grouped["mean"], {}
+        )
+        self.assertEqual(payload["violations"]["1"], list(range(20)))
+
+        raw = pd.DataFrame({"timestamp": grouped["timestamp"], "value": 25.0})
+        raw.loc[7, "value"] = 25.5
+        payload = CalculationService().build_payload(
+            config, raw, stats, raw["value"], {}
+        )
+        # Two moving ranges of 0.5: sigma = MR̄ / d2 = (1 / 19) / 1.128
+        self.assertEqual(payload["violations"]["1"], [7])
+
+
+class ChartResultCacheTests(ChartFixture, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.config = self.create_chart()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return {"data": [self.calls]}
+
+    def get(self, start_date=None):
+        return result_cache.get_or_compute(self.config, start_date, None, self.compute)
+
+    def test_hit_and_window_key(self):
+        self.assertEqual(self.get(), {"data": [1]})
+        self.assertEqual(self.get(), {"data": [1]})
+        self.assertEqual(self.get(datetime(2024, 3, 1)), {"data": [2]})
+
+    def test_invalidated_on_save(self):
+        self.get()
+        self.source.save()
+        self.assertEqual(self.get(), {"data": [2]})
+        self.config.save()
+        self.config.refresh_from_db()
+        self.assertEqual(self.get(), {"data": [3]})
+
+    def test_concurrent_misses_are_coalesced(self):
+        started = threading.Event()
+
+        def slow():
+            started.set()
+            time.sleep(0.2)
+            return self.compute()
+
+        leader = threading.Thread(
+            target=result_cache.get_or_compute, args=(self.config, None, None, slow)
+        )
+        leader.start()
+        started.wait()
+        self.assertEqual(self.get(), {"data": [1]})
+        leader.join()
+        self.assertEqual(self.calls, 1)
+
+    def test_source_failure_is_not_cached(self):
+        self.config.aggregation_pushdown = False
+        self.config.save()
+        request = APIRequestFactory().get(f"/api/spc/charts/{self.config.pk}/data/")
+        force_authenticate(request, user=self.config.owner)
+        with patch.object(
+            CalculationService, "build_query", return_value=("SELECT", [])
+        ), patch.object(
+            DataSourceService, "stream_series", side_effect=RuntimeError("timeout")
+        ) as stream_series, self.assertLogs(
+            "spc.calculation_service", "ERROR"
+        ):
+            for _ in range(2):
+                response = ChartDataView.as_view()(request, pk=self.config.pk)
+                self.assertEqual(response.status_code, 502)
+                self.assertEqual(response.data, {"error": "timeout"})
+
+        self.assertEqual(stream_series.call_count, 2)
+
+    def test_stale_cached_chart_is_not_cached(self):
+        self.config.cache_measurements = True
+        self.config.save()
+        with patch.object(
+            MeasurementCacheService, "sync", side_effect=RuntimeError("timeout")
+        ) as sync, self.assertLogs("spc.calculation_service", "WARNING"):
+            for _ in range(2):
+                data = CalculationService().get_chart_data(self.config.pk)
+                self.assertTrue(data["window"]["stale"])
+
+        self.assertEqual(sync.call_count, 2)
+
+
+class FakeCatalogSource:
+    """
+    Answers the catalog queries with canned frames, counting calls
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def query(self, source, query, params=None):
+        self.calls += 1
+        if "reltuples" in query:
+            return pd.DataFrame(
+                {
+                    "table_schema": ["public", "public", "archive"],
+                    "table_name": ["meas", "Meas", "meas"],
+                    "table_type": ["TABLE", "VIEW", "TABLE"],
+                    "row_estimate": [1200.0, -1.0, np.nan],
+                }
+            )
+        if "information_schema.columns" in query:
+            return pd.DataFrame(
+                {
+                    "table_schema": ["public"] * 3,
+                    "table_name": ["meas"] * 3,
+                    "column_name": ["ts", "value", "product"],
+                    "data_type": ["timestamp", "double precision", "text"],
+                    "is_nullable": ["NO", "YES", "YES"],
+                }
+            )
+        return pd.DataFrame(
+            {
+                "table_schema": ["public"] * 3,
+                "table_name": ["meas"] * 3,
+                "index_name": ["meas_pk", "meas_product_ts", "meas_product_ts"],
+                "is_unique": [True, False, False],
+                "column_name": ["ts", "product", "ts"],
+                "key_ordinal": [1, 1, 2],
+            }
+        )
+
+
+class SchemaCatalogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.source = DataSource.objects.create(
+            name="plant",
+            engine=DataSource.Engine.POSTGRES,
+            host="localhost",
+            database_name="mes",
+            username="u",
+            password="p",
+        )
+        self.fake = FakeCatalogSource()
+        self.catalog = SchemaCatalog(ds_service=self.fake)
+
+    def test_catalog(self):
+        catalog = self.catalog.get(self.source)
+        self.assertFalse(catalog["stale"])
+        self.assertEqual(
+            [t["qualified_name"] for t in search_tables(catalog, "MEAS")],
+            ["archive.meas", "public.meas", "public.Meas"],
+        )
+        self.assertEqual(
+            [t["row_estimate"] for t in catalog["tables"]], [None, 1200, None]
+        )
+
+        table = self.catalog.table(self.source, "public.MEAS")
+        self.assertIsNone(table)  # Two tables differ only in case
+        table = self.catalog.table(self.source, "public.meas")
+        self.assertEqual(table["indexes"][1]["columns"], ["product", "ts"])
+        self.assertEqual(
+            {c["name"]: c["indexed"] for c in table["columns"]},
+            {"ts": True, "value": False, "product": True},
+        )
+        # Served from the cache afterwards
+        self.assertEqual(self.fake.calls, 3)
+
+    def test_stale_catalog_is_served_while_refreshing(self):
+        self.catalog.get(self.source)
+        with override_settings(SPC_SCHEMA_CATALOG={"TTL": 0}):
+            with patch.object(SchemaCatalog, "refresh_in_background") as refresh:
+                self.assertTrue(self.catalog.get(self.source)["stale"])
+                refresh.assert_called_once()
+        self.assertEqual(self.fake.calls, 3)
+
+    def test_unreachable_source(self):
+        self.fake.query = Mock(side_effect=RuntimeError("login failed"))
+        with patch("spc.schema_catalog.schema_catalog", self.catalog), patch(
+            "spc.views.schema_catalog", self.catalog
+        ):
+            with self.assertRaises(CatalogError), self.assertLogs(
+                "spc.services", "WARNING"
+            ):
+                DataSourceService().list_tables(self.source)
+
+            request = APIRequestFactory().get(f"/api/spc/sources/{self.source.pk}/")
+            force_authenticate(request, user=User(email="spc@example.com"))
+            view = DataSourceViewSet.as_view({"get": "tables"})
+            response = view(request, pk=self.source.pk)
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(response.data, {"error": "login failed"})
+
+    def test_get_data_raises_source_errors(self):
+        service = DataSourceService()
+        with patch.object(
+            service, "query", side_effect=RuntimeError("login failed")
+        ), self.assertLogs("spc.services", "ERROR"):
+            with self.assertRaises(RuntimeError):
+                service.get_data(self.source, "SELECT 1")
+
+
+SHOWPLAN = """<?xml version="1.0" encoding="utf-16"?>
+<ShowPlanXML xmlns="http://schemas.microsoft.com/sqlserver/2004/07/showplan">
+  <BatchSequence><Batch><Statements>
+    <StmtSimple StatementEstRows="120">
+      <QueryPlan>
+        <RelOp PhysicalOp="Top" EstimateRows="120">
+          <Top>
+            <RelOp PhysicalOp="Clustered Index Scan" EstimateRows="120"
+                EstimatedRowsRead="2500000" TableCardinality="2500000">
+              <IndexScan>
+                <Object Schema="[dbo]" Table="[Meas]" Index="[PK_Meas]" />
+              </IndexScan>
+            </RelOp>
+          </Top>
+        </RelOp>
+      </QueryPlan>
+    </StmtSimple>
+  </Statements></Batch></BatchSequence>
+</ShowPlanXML>"""
+
+
+class IndexAdvisorTests(SimpleTestCase):
+    def test_showplan_scans(self):
+        returned, *scans = parse_showplan(SHOWPLAN)
+        self.assertEqual(returned["estimated_rows"], 120)
+        self.assertEqual(len(scans), 1)
+        self.assertEqual(scans[0]["operator"], "Clustered Index Scan")
+        self.assertEqual((scans[0]["schema"], scans[0]["table"]), ("dbo", "Meas"))
+        self.assertEqual(scans[0]["index"], "PK_Meas")
+        self.assertEqual(scans[0]["estimated_rows_read"], 2500000)
+
+    def test_postgres_plan_scans(self):
+        plan = [
+            {
+                "Plan": {
+                    "Node Type": "Limit",
+                    "Plan Rows": 50,
+                    "Plans": [
+                        {
+                            "Node Type": "Bitmap Heap Scan",
+                            "Relation Name": "meas",
+                            "Plan Rows": 50,
+                            "Plans": [
+                                {
+                                    "Node Type": "Bitmap Index Scan",
+                                    "Index Name": "ix_meas",
+                                    "Plan Rows": 50,
+                                }
+                            ],
+                        }
+                    ],
+                }
+            }
+        ]
+        returned, *scans = parse_postgres_plan(plan)
+        self.assertEqual(returned["estimated_rows"], 50)
+        self.assertEqual(
+            [(s["table"], s["index"]) for s in scans], [("meas", "ix_meas")]
+        )
+
+    def test_match_index(self):
+        indexes = [
+            {"name": "ix_ts", "columns": ["ts"]},
+            {"name": "ix_op_product_ts", "columns": ["Operation", "Product", "TS"]},
+        ]
+        index, quality = match_index(indexes, ["product", "operation"], "ts")
+        self.assertEqual((index["name"], quality), ("ix_op_product_ts", "seek"))
+
+        index, quality = match_index(indexes[:1], ["product", "operation"], "ts")
+        self.assertEqual((index["name"], quality), ("ix_ts", "partial"))
+
+        self.assertEqual(match_index([], ["product", "operation"], "ts"), (None, None))
+
+
+class SourceExecutorTests(ChartFixture, TestCase):
+    @override_settings(SPC_ASYNC={"SOURCE_CONCURRENCY": 1})
+    def test_busy_source_and_deadline(self):
+        executor = SourceExecutor()
+        release = threading.Event()
+
+        async def scenario():
+            running = asyncio.create_task(executor.run(1, release.wait, 5, timeout=0.1))
+            await asyncio.sleep(0.02)
+            with self.assertRaises(SourceBusy):
+                await executor.run(1, time.sleep, 0, timeout=0.02)
+            with self.assertRaises(asyncio.TimeoutError):
+                await running
+            # The overrun call keeps its slot until its thread returns
+            self.assertEqual(executor.semaphore(1)._value, 0)
+            release.set()
+            await asyncio.sleep(0.05)
+            return await executor.run(1, sum, [1, 2], timeout=1)
+
+        self.assertEqual(asyncio.run(scenario()), 3)
+        self.assertEqual(executor.semaphore(1)._value, 1)
+
+    @override_settings(SPC_ASYNC={"SOURCE_CONCURRENCY": 1})
+    def test_cancelled_waiter_keeps_no_slot(self):
+        executor = SourceExecutor()
+        release = threading.Event()
+
+        async def scenario():
+            running = asyncio.create_task(executor.run(1, release.wait, 5))
+            await asyncio.sleep(0.02)
+            waiting = asyncio.create_task(executor.run(1, time.sleep, 0))
+            await asyncio.sleep(0.02)
+            waiting.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+            release.set()
+            await running
+
+        asyncio.run(scenario())
+        self.assertEqual(executor.semaphore(1)._value, 1)
+
+    @override_settings(SPC_ASYNC={"SOURCE_CONCURRENCY": 1})
+    def test_slots_outlive_event_loops(self):
+        # async_to_sync runs every WSGI request on a loop of its own
+        executor = SourceExecutor()
+        release = threading.Event()
+
+        async def contended():
+            return await asyncio.gather(
+                executor.run(1, time.sleep, 0.02), executor.run(1, sum, [1, 2])
+            )
+
+        for _ in range(2):
+            self.assertEqual(async_to_sync(contended)(), [None, 3])
+
+        async def abandoned():
+            with self.assertRaises(asyncio.TimeoutError):
+                await executor.run(1, release.wait, 5, timeout=0.05)
+
+        # The loop is closed before the call returns; its slot still frees up
+        asyncio.run(abandoned())
+        self.assertEqual(executor.semaphore(1)._value, 0)
+        release.set()
+        for _ in range(100):
+            if executor.semaphore(1)._value:
+                break
+            time.sleep(0.01)
+        self.assertEqual(executor.semaphore(1)._value, 1)
+
+    def test_async_view_status(self):
+        config = self.create_chart()
+        request = RequestFactory().get(f"/api/spc/charts/{config.pk}/data/async/")
+        for error, status_code in (
+            (SourceBusy("Data source 1 is busy"), 503),
+            (asyncio.TimeoutError(), 504),
+            (RuntimeError("login failed"), 502),
+        ):
+            with patch(
+                "spc.views.authenticate_async", AsyncMock(return_value=config.owner)
+            ), patch("spc.views.source_executor.run", AsyncMock(side_effect=error)):
+                response = async_to_sync(chart_data_async)(request, config.pk)
+            self.assertEqual(response.status_code, status_code)
+            self.assertIn("error", json.loads(response.content))
+
+    def test_query_token_only_for_streams(self):
+        config = self.create_chart()
+        token = Token.objects.create(user=config.owner)
+        request = RequestFactory().get("/", {"token": token.key})
+        request.auser = AsyncMock(return_value=AnonymousUser())
+        # Query strings are logged; only EventSource clients need the token there
+        self.assertIsNone(async_to_sync(authenticate_async)(request))
+        self.assertEqual(
+            async_to_sync(authenticate_async)(request, query_token=True), config.owner
+        )
+        request = RequestFactory().get("/", HTTP_AUTHORIZATION=f"Token {token.key}")
+        self.assertEqual(async_to_sync(authenticate_async)(request), config.owner)
+
+
+class ChartStreamTests(ChartFixture, TestCase):
+    def setUp(self):
+        self.config = self.create_chart(
+            aggregation_type="TIME_HOUR",
+            aggregation_size=1,
+            aggregation_pushdown=False,
+            display_days=1,
+        )
+        self.df = self.measurements(3000, "67s", seed=5)
+
+    def test_apply_and_trim(self):
+        old, new = self.df.iloc[:2000], self.df.iloc[2000:2100]
+        stream = ChartStream(self.config, old.copy())
+        event = stream.apply(new)
+
+        # Only the buckets the new rows fell into are sent
+        width = bucket_width(self.config)
+        touched = set(bucket_starts(new["timestamp"], width))
+        self.assertEqual({p["timestamp"] for p in event["points"]}, touched)
+        # Rows before the lookback are dropped in whole buckets
+        cutoff = bucket_starts(
+            pd.Series([new["timestamp"].max() - timedelta(days=1)]), width
+        ).iloc[0]
+        kept = self.df.iloc[:2100]
+        kept = kept[kept["timestamp"] >= cutoff].reset_index(drop=True)
+        pd.testing.assert_frame_equal(
+            stream.grouped, CalculationService.aggregate(self.config, kept)
+        )
+        expected = ChartStream(self.config, kept.copy())
+        self.assertAlmostEqual(
+            event["statistics"]["mean"], expected.snapshot["statistics"]["mean"]
+        )
+
+        # Rows already applied are ignored
+        self.assertIsNone(stream.apply(new))
+
+    def test_count_subgroups_fold_across_polls(self):
+        self.config.aggregation_type = "COUNT"
+        self.config.aggregation_size = 7
+        stream = ChartStream(self.config, self.df.iloc[:1000].copy())
+        # Polls that end part way through a subgroup
+        for start in range(1000, 1300, 50):
+            stream.apply(self.df.iloc[start : start + 50])
+
+        cutoff = self.df["timestamp"].iloc[1299] - timedelta(days=1)
+        expected = CalculationService.aggregate(self.config, self.df.iloc[:1300])
+        expected = expected[expected["timestamp"] >= cutoff].reset_index(drop=True)
+        pd.testing.assert_frame_equal(stream.grouped, expected)
+
+    def test_publish_drops_oldest_for_slow_viewers(self):
+        stream = ChartStream(self.config, self.df.iloc[:100].copy())
+        queue = asyncio.Queue(maxsize=2)
+        stream.queues.add(queue)
+        for n in range(3):
+            stream.publish({"n": n})
+        self.assertEqual(queue.get_nowait(), ("update", {"n": 1}))
+        self.assertEqual(queue.get_nowait(), ("update", {"n": 2}))
+
+
+class ChartStreamReloadTests(ChartFixture, TransactionTestCase):
+    """
+    Real commits, so the signal's on_commit hook runs and the stream loads
+    from a thread of its own
+    """
+
+    def setUp(self):
+        self.config = self.create_chart(
+            aggregation_type="TIME_HOUR",
+            aggregation_size=1,
+            aggregation_pushdown=False,
+            display_days=1,
+        )
+        self.df = self.measurements(3000, "67s", seed=5)
+
+    @override_settings(SPC_STREAM={"POLL_INTERVAL": 60})
+    def test_saving_the_chart_reloads_its_stream(self):
+        hub = ChartStreamHub()
+        config = ChartConfig.objects.select_related("data_source").get(
+            pk=self.config.pk
+        )
+
+        def edit():
+            config.aggregation_type = "TIME_DAY"
+            config.save()
+
+        async def scenario():
+            stream, queue = await hub.subscribe(config)
+            # The day before noon on 2024-03-02, hour by hour
+            self.assertEqual(len(stream.snapshot["data"]), 24)
+            # Saved from a request thread, as a view would
+            await sync_to_async(edit)()
+            kind, snapshot = await asyncio.wait_for(queue.get(), timeout=5)
+            self.assertEqual(kind, "snapshot")
+            self.assertEqual(len(snapshot["data"]), 2)
+            self.assertEqual(
+                hub._find(config.pk)[1].config.aggregation_type, "TIME_DAY"
+            )
+
+            await sync_to_async(config.delete)()
+            kind, event = await asyncio.wait_for(queue.get(), timeout=5)
+            self.assertEqual((kind, event), ("deleted", {"chart": self.config.pk}))
+            self.assertEqual(hub.groups, {})
+
+        with patch("spc.signals.hub", hub), patch.object(
+            CalculationService, "fetch_chunks", self.fetch_chunks
+        ), patch(
+            "django.utils.timezone.now",
+            return_value=timezone.make_aware(datetime(2024, 3, 2, 12, 0)),
+        ):
+            async_to_sync(scenario)()
+
+
+class SharedFrameTests(SimpleTestCase):
+    def test_round_trip(self):
+        df = pd.DataFrame(
+            {
+                "timestamp": pd.date_range("2024-01-01", periods=5, freq="min"),
+                "value": [1.0, 2.5, np.nan, 4.0, -1.0],
+            }
+        )
+        shm, spec = share_frame(df)
+        try:
+            attached_shm, attached = attach_frame(spec)
+            pd.testing.assert_frame_equal(attached, df)
+            del attached
+            attached_shm.close()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def test_raw_rows_are_not_sent_back(self):
+        config = ChartConfig(aggregation_type="RAW", aggregation_pushdown=False)
+        df = ChartFixture.measurements(500, "min", seed=6)
+        start, end = datetime(2024, 3, 1), datetime(2024, 3, 2)
+
+        shm, spec = share_frame(df)
+        try:
+            payload = compute_chart(config, spec, start, end)[0]
+        finally:
+            shm.close()
+            shm.unlink()
+        # Only the moving range comes back from the worker
+        marker, columns = payload["data"]
+        self.assertEqual(marker, SHARED_ROWS)
+        self.assertEqual(list(columns), ["moving_range"])
+
+        class InlinePool:
+            def submit(self, func, *args):
+                future = Future()
+                future.set_result(func(*args))
+                return future
+
+        [(_, payload, _)] = ParallelChartService(processes=1).compute_frames(
+            [(config, df, 0.0, (start, end))], InlinePool()
+        )
+        expected = CalculationService().compute_chart_data(config, start, end, df)
+        pd.testing.assert_frame_equal(payload["data"], expected["data"])
+
+
+class SnapshotTests(ChartFixture, TestCase):
+    def setUp(self):
+        self.config = self.create_chart(
+            aggregation_type="TIME_HOUR",
+            aggregation_size=1,
+            aggregation_pushdown=False,
+            precompute_snapshots=True,
+            snapshot_interval=600,
+        )
+        self.df = self.measurements(4000, "67s", seed=3)
+
+    def at(self, *args):
+        return patch(
+            "django.utils.timezone.now",
+            return_value=timezone.make_aware(datetime(*args)),
+        )
+
+    @override_settings(SPC_DEFAULT_LOOKBACK_DAYS=1)
+    def test_incremental_refresh_matches_full(self):
+        service = SnapshotService()
+        with patch.object(CalculationService, "fetch_chunks", self.fetch_chunks):
+            with self.at(2024, 3, 3, 12, 30):
+                service.refresh(self.config)
+            # Later, with the window start inside a bucket
+            with self.at(2024, 3, 3, 13, 10):
+                snapshot = service.refresh(self.config)
+                expected = CalculationService().compute_chart_data(self.config)
+
+        self.assertEqual(
+            snapshot.full_computed_at, timezone.make_aware(datetime(2024, 3, 3, 12, 30))
+        )
+        with self.at(2024, 3, 3, 13, 12):
+            payload = service.get(self.config.pk)
+        pd.testing.assert_frame_equal(
+            payload["data"], expected["data"], check_dtype=False
+        )
+        for key, value in expected["statistics"].items():
+            self.assertAlmostEqual(payload["statistics"][key], value, places=9)
+        self.assertEqual(payload["violations"], expected["violations"])
+        self.assertIn("computed_at", payload["snapshot"])
+
+        # Editing the chart invalidates its snapshot
+        self.config.save()
+        with self.at(2024, 3, 3, 13, 12):
+            self.assertIsNone(service.get(self.config.pk))
+
+    def test_payload_stored_as_json(self):
+        self.config.aggregation_type = "COUNT"
+        self.config.save()
+        with patch.object(CalculationService, "fetch_chunks", self.fetch_chunks):
+            with self.at(2024, 3, 3, 12, 30):
+                snapshot = SnapshotService().refresh(self.config)
+                expected = CalculationService().compute_chart_data(self.config)
+
+        snapshot.refresh_from_db()
+        self.assertEqual(snapshot.payload["data_columns"], list(expected["data"]))
+        # Subgroups of one measurement have no spread
+        self.assertIsNone(snapshot.payload["data"]["std"][0])
+        with self.at(2024, 3, 3, 12, 31):
+            payload = SnapshotService().get(self.config.pk)
+        # Columnar timestamps are in milliseconds
+        expected["data"]["timestamp"] = expected["data"]["timestamp"].dt.floor("ms")
+        pd.testing.assert_frame_equal(
+            payload["data"], expected["data"], check_dtype=False
+        )
+        self.assertEqual(
+            payload["window"]["start"], expected["window"]["start"].isoformat()
+        )
+
+
+class BaselineTests(ChartFixture, TestCase):
+    def setUp(self):
+        self.config = self.create_chart(
+            aggregation_type="TIME_HOUR",
+            aggregation_size=1,
+            aggregation_pushdown=False,
+            display_days=1,
+            upper_spec_limit=27.0,
+            lower_spec_limit=23.0,
+        )
+        self.df = self.measurements(3 * 1440, "min", seed=4)
+        # The process shifts by 1.0 (3 sigma) on the third day
+        self.df.loc[2 * 1440 :, "value"] += 1.0
+
+    def test_frozen_limits(self):
+        service = CalculationService()
+        with patch.object(CalculationService, "fetch_chunks", self.fetch_chunks):
+            key = result_cache.key(self.config)
+            baseline = BaselineService(service).compute(
+                self.config, datetime(2024, 3, 1), datetime(2024, 3, 2, 23, 59)
+            )
+            self.config.refresh_from_db()
+            self.assertNotEqual(result_cache.key(self.config), key)
+            # Display window only: the shifted third day
+            with patch(
+                "django.utils.timezone.now",
+                return_value=timezone.make_aware(datetime(2024, 3, 4)),
+            ):
+                frozen = service.compute_chart_data(self.config)
+            free = service.compute_chart_data(
+                self.config, datetime(2024, 3, 3), datetime(2024, 3, 4), frozen=False
+            )
+            with self.assertRaises(BaselineError):
+                BaselineService(service).compute(
+                    self.config, datetime(2023, 1, 1), datetime(2023, 1, 2)
+                )
+
+        self.assertEqual((baseline.version, baseline.subgroups), (1, 48))
+        self.assertAlmostEqual(baseline.center, 25.0, delta=0.05)
+        self.assertEqual(len(frozen["data"]), 24)
+        limits = frozen["limits"]
+        self.assertEqual(limits["baseline"]["version"], 1)
+        self.assertAlmostEqual(limits["center"], baseline.center)
+        self.assertAlmostEqual(limits["window"]["center"], 26.0, delta=0.05)
+        np.testing.assert_allclose(
+            frozen["data"]["xbar_s_ucl"],
+            baseline.limits["center"] + 3 * (baseline.limits["sigma_s"] / np.sqrt(60)),
+        )
+        # Every hour is beyond the frozen limits, none beyond its own
+        self.assertEqual(len(frozen["violations"]["1"]), 24)
+        self.assertEqual(free["violations"]["1"], [])
+        # Cpk uses the frozen within sigma
+        self.assertAlmostEqual(
+            frozen["statistics"]["sigma_within"], baseline.sigma_within
+        )
+
+        BaselineService(service).release(self.config)
+        self.assertIsNone(CalculationService.active_baseline(self.config))
+
+    def test_unsaved_chart(self):
+        # As spc_benchmark computes them: no pk, so no baseline to look up
+        config = ChartConfig(
+            data_source=self.source,
+            aggregation_type="TIME_HOUR",
+            aggregation_size=1,
+            aggregation_pushdown=False,
+        )
+        with patch.object(CalculationService, "fetch_chunks", self.fetch_chunks):
+            payload = CalculationService().compute_chart_data(
+                config, datetime(2024, 3, 1), datetime(2024, 3, 1, 23, 59)
+            )
+        self.assertEqual(len(payload["data"]), 24)
+        self.assertNotIn("baseline", payload["limits"])
+
+
+class SyntheticDataTests(SimpleTestCase):
+    def test_dirty_values(self):
+        df = generate_measurements(
+            20000, products=2, operations=2, nan_ratio=0.05, junk_ratio=0.05
+        )
+        self.assertEqual(len(df), 20000)
+        self.assertTrue(df["timestamp"].is_monotonic_increasing)
+        self.assertEqual(df.groupby(["product", "operation"], observed=True).ngroups, 4)
+
+        values = decode_values(df["value"].to_numpy(dtype=object))
+        # NULLs and junk both decode to NaN, about 10% of the rows
+        self.assertAlmostEqual(np.isnan(values).mean(), 0.0975, delta=0.01)
+        self.assertAlmostEqual(np.nanmean(values), 25.0, delta=0.2)
+
+
+class ChartRendererTests(SimpleTestCase):
+    def setUp(self):
+        self.payload = {
+            "statistics": {"mean": 1.5, "std_dev": np.nan},
+            "data": pd.DataFrame(
+                {
+                    "timestamp": pd.date_range("2024-03-01", periods=3, freq="h"),
+                    "mean": [1.0, np.nan, 2.0],
+                    "count": [4, 1, 3],
+                }
+            ),
+        }
+
+    def test_columnar(self):
+        body = json.loads(ChartColumnarJSONRenderer().render(self.payload))
+        self.assertEqual(body["statistics"], {"mean": 1.5, "std_dev": None})
+        self.assertEqual(body["data"]["length"], 3)
+        self.assertEqual(body["data"]["mean"], [1.0, None, 2.0])
+        self.assertEqual(body["data"]["count"], [4, 1, 3])
+        self.assertEqual(body["data"]["timestamp"][1], 1709254800000)
+
+    def test_packed_round_trip(self):
+        body = ChartPackedRenderer().render(self.payload)
+        magic, size = PACKED_PREFIX.unpack_from(body)
+        header = json.loads(body[PACKED_PREFIX.size : PACKED_PREFIX.size + size])
+        base = PACKED_PREFIX.size + size
+
+        self.assertEqual(magic, PACKED_MAGIC)
+        self.assertEqual(base % 8, 0)
+        self.assertEqual(header["length"], 3)
+        columns = {
+            c["name"]: np.frombuffer(
+                body,
+                dtype=c["dtype"],
+                count=header["length"],
+                offset=base + c["offset"],
+            )
+            for c in header["columns"]
+        }
+        np.testing.assert_array_equal(columns["mean"], [1.0, np.nan, 2.0])
+        np.testing.assert_array_equal(columns["count"], [4, 1, 3])
+        self.assertEqual(columns["timestamp"][0], 1709251200000)
+
+
+class DownsampleTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.df = pd.DataFrame(
+            {
+                "timestamp": pd.date_range("2024-03-01", periods=10_000, freq="s"),
+                "value": rng.normal(0.0, 1.0, 10_000),
+            }
+        )
+
+    def test_methods_respect_budget(self):
+        x = np.arange(len(self.df), dtype=float)
+        y = self.df["value"].to_numpy()
+        for method in downsample.METHODS.values():
+            keep = method(x, y, 200)
+            self.assertLessEqual(len(keep), 202)
+            self.assertEqual((keep[0], keep[-1]), (0, len(y) - 1))
+            self.assertTrue((np.diff(keep) > 0).all())
+        self.assertIn(int(np.argmax(y)), downsample.min_max(x, y, 200))
+
+    def test_violations_survive(self):
+        payload = {"data": self.df, "violations": {"1": [4321, 4322], "2": []}}
+        reduced = downsample.downsample_payload(payload, 100)
+        data = reduced["data"]
+        self.assertLess(len(data), 110)
+        self.assertEqual(
+            data["value"].iloc[reduced["violations"]["1"]].tolist(),
+            self.df["value"].iloc[[4321, 4322]].tolist(),
+        )
+        self.assertEqual(reduced["window"]["downsampled"]["total"], 10_000)
+
+
+class InstrumentationTests(SimpleTestCase):
+    def setUp(self):
+        instrumentation.metrics.reset()
+
+    def fake_chart_data(self, chart_id, start_date=None, end_date=None, **options):
+        instrumentation.record_sql("SELECT ts, value\n  FROM m WHERE a = ?")
+        with instrumentation.span("query"):
+            instrumentation.count_fetched(rows=3)
+        with instrumentation.span("statistics"):
+            pass
+        return {"data": [], "statistics": {}}
+
+    @override_settings(SPC_INSTRUMENTATION={"SLOW_REQUEST_SECONDS": 0, "LOG_SQL": True})
+    def test_chart_data_view(self):
+        request = APIRequestFactory().get(
+            "/api/spc/charts/7/data/?start_date=2024-01-01"
+        )
+        force_authenticate(request, user=User(email="spc@example.com"))
+        with patch.object(CalculationService, "get_chart_data", self.fake_chart_data):
+            response = ChartDataView.as_view()(request, pk=7)
+            with self.assertLogs("spc.slow", "WARNING") as logs:
+                response.render()
+
+        timing = response["Server-Timing"]
+        for stage in ("query;dur=", "statistics;dur=", "render;dur=", "total;dur="):
+            self.assertIn(stage, timing)
+        self.assertIn("chart 7", logs.output[0])
+        self.assertIn("3 rows", logs.output[0])
+        self.assertIn("\n  SELECT ts, value FROM m WHERE a = ?", logs.output[0])
+
+        text = instrumentation.metrics.render()
+        self.assertIn('spc_stage_seconds_count{stage="query"} 1', text)
+        self.assertIn('spc_requests_total{view="chart-data",status="200"} 1', text)
+        self.assertIn('spc_request_seconds_count{view="chart-data"} 1', text)
+        self.assertIn("spc_rows_fetched_total 3", text)
+        self.assertIn("spc_slow_requests_total 1", text)
+
+    @override_settings(SPC_INSTRUMENTATION={"METRICS_TOKEN": "s3cret"})
+    def test_metrics_access(self):
+        def get(user=None, **headers):
+            request = APIRequestFactory().get("/api/spc/metrics/", **headers)
+            if user is not None:
+                force_authenticate(request, user=user)
+            response = MetricsView.as_view()(request)
+            response.render()
+            return response
+
+        self.assertEqual(get().status_code, 401)
+        self.assertEqual(get(HTTP_AUTHORIZATION="Bearer guess").status_code, 401)
+        self.assertEqual(get(user=User(email="spc@example.com")).status_code, 403)
+
+        for response in (
+            get(user=User(email="admin@example.com", is_staff=True)),
+            get(HTTP_AUTHORIZATION="Bearer s3cret"),
+        ):
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response["Content-Type"].startswith("text/plain"))
+            self.assertIn(b"# TYPE spc_requests_total counter", response.content)
+
+    def test_spans_without_trace(self):
+        with instrumentation.span("decode"):
+            pass
+        self.assertIsNone(instrumentation.current_trace())
+        self.assertIn(
+            'spc_stage_seconds_count{stage="decode"} 1',
+            instrumentation.metrics.render(),
+        )
@@ -2,9 +2,15 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     ChartDataView,
+    ChartBaselineView,
+    ChartBatchDataView,
+    ChartIndexAdviceView,
     ChartConfigListCreateView,
     ChartConfigDetailView,
     DataSourceViewSet,
+    MetricsView,
+    chart_data_async,
+    chart_stream,
 )
 
 router = DefaultRouter()
@@ -13,6 +19,20 @@ router.register(r"datasources", DataSourceViewSet)
 urlpatterns = [
     path("", include(router.urls)),
     path("charts/", ChartConfigListCreateView.as_view(), name="chart-list"),
+    path("charts/data/", ChartBatchDataView.as_view(), name="chart-batch-data"),
     path("charts/<int:pk>/", ChartConfigDetailView.as_view(), name="chart-detail"),
     path("charts/<int:pk>/data/", ChartDataView.as_view(), name="chart-data"),
+    path("charts/<int:pk>/data/async/", chart_data_async, name="chart-data-async"),
+    path("charts/<int:pk>/stream/", chart_stream, name="chart-stream"),
+    path(
+        "charts/<int:pk>/baseline/",
+        ChartBaselineView.as_view(),
+        name="chart-baseline",
+    ),
+    path(
+        "charts/<int:pk>/index-advice/",
+        ChartIndexAdviceView.as_view(),
+        name="chart-index-advice",
+    ),
+    path("metrics/", MetricsView.as_view(), name="metrics"),
 ]
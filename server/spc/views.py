@@ -1,30 +1,317 @@
-from rest_framework import generics, views, status
+import asyncio
+import hmac
+from datetime import datetime, time
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework import generics, views, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
-from .models import ChartConfig
+from rest_framework.permissions import BasePermission, IsAuthenticated
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+from . import instrumentation
+from .models import ChartConfig, DataSource
+from .serializers import (
+    ChartConfigSerializer,
+    ControlLimitBaselineSerializer,
+    DataSourceSerializer,
+)
+from .services import DataSourceService
+from .connection_pool import pool_stats as get_pool_stats
+from .query_builder import QueryBuildError
+from .schema_catalog import (
+    CatalogError,
+    get_catalog_settings,
+    schema_catalog,
+    search_tables,
+)
 from .calculation_service import CalculationService
+from .baselines import BaselineError, baseline_service
+from .downsample import METHODS as DOWNSAMPLE_METHODS, downsample_payload
+from .batch import BatchChartService, get_batch_settings
+from .index_advisor import IndexAdvisor
+from .rollups import RESOLUTIONS
+from .async_executor import SourceBusy, get_async_settings, source_executor
+from .renderers import (
+    CHART_RENDERERS,
+    ChartColumnarJSONRenderer,
+    ChartJSONRenderer,
+    PrometheusRenderer,
+    render_chart_payload,
+)
+from .snapshots import snapshot_service
+from .streaming import get_stream_settings, hub, sse
+
+
+def parse_date_param(value):
+    """
+    Accepts an ISO 8601 datetime or a plain date (midnight) and returns a naive
+    datetime in server time. Returns None when the parameter is absent, raises
+    ValueError when it can't be parsed.
+    """
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date: {value}")
+        parsed = datetime.combine(day, time.min)
+    if timezone.is_aware(parsed):
+        parsed = timezone.make_naive(parsed)
+    return parsed
+
+
+def parse_window_params(params):
+    """
+    Returns (start_date, end_date) from the start_date / end_date query
+    parameters, raising ValueError when they are invalid or inverted
+    """
+    start_date = parse_date_param(params.get("start_date"))
+    end_date = parse_date_param(params.get("end_date"))
+    if start_date and end_date and start_date > end_date:
+        raise ValueError("start_date must be before end_date")
+    return start_date, end_date
+
+
+def parse_downsample_params(params):
+    """
+    Returns (points, method) from the optional points / downsample query
+    parameters, or (None, None) when no point budget was requested
+    """
+    if not params.get("points"):
+        return None, None
+    try:
+        points = int(params["points"])
+    except ValueError:
+        raise ValueError(f"Invalid points: {params['points']}")
+    method = params.get("downsample", "lttb")
+    if points < 3:
+        raise ValueError("points must be at least 3")
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"downsample must be one of: {', '.join(DOWNSAMPLE_METHODS)}")
+    return points, method
+
+
+def parse_resolution_param(params, points=None):
+    """
+    Returns the rollup resolution from the optional resolution query
+    parameter: minute, hour, day, week, "auto" (the default with a point
+    budget) or None for the chart's own series ("chart", the default
+    without one)
+    """
+    resolution = params.get("resolution") or ("auto" if points else "chart")
+    if resolution == "chart":
+        return None
+    if resolution != "auto" and resolution not in RESOLUTIONS:
+        choices = ", ".join(["auto", "chart", *RESOLUTIONS])
+        raise ValueError(f"resolution must be one of: {choices}")
+    return resolution
 
 
 class ChartDataView(views.APIView):
+    """
+    Points are sent as records by default, as columns for
+    Accept: application/vnd.spc.columnar+json and as packed binary column
+    buffers for Accept: application/vnd.spc.packed (see spc/renderers.py).
+    ?points=N reduces the plotted points to about N (downsample=lttb|minmax),
+    keeping every rule violation; statistics still cover all the data.
+    Cached charts are then plotted from their rollups at the finest
+    resolution that fits the budget when their own series wouldn't
+    (?resolution= picks one, or "chart" to always downsample instead).
+    Hot charts' default window is served from their precomputed snapshot,
+    whose freshness is under "snapshot". The time spent in each stage is
+    sent as a Server-Timing header (see spc/instrumentation.py).
+    """
+
     permission_classes = [IsAuthenticated]
+    renderer_classes = CHART_RENDERERS
 
     def get(self, request, pk):
-        # Service handles fetching logic
-        service = CalculationService()
-        data = service.get_chart_data(pk)
+        with instrumentation.trace("chart-data", f"chart {pk}") as trace:
+            response = self.chart_response(request, pk)
+        return instrumentation.instrument_response(trace, response)
+
+    def chart_response(self, request, pk):
+        try:
+            start_date, end_date = parse_window_params(request.query_params)
+            points, method = parse_downsample_params(request.query_params)
+            resolution = parse_resolution_param(request.query_params, points)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = None
+        if start_date is None and end_date is None and resolution in (None, "auto"):
+            data = snapshot_service.get(pk)
+            if data is not None:
+                instrumentation.note("snapshot", "hit")
+        if data is None:
+            # Service handles fetching logic
+            service = CalculationService()
+            try:
+                data = service.get_chart_data(
+                    pk,
+                    start_date=start_date,
+                    end_date=end_date,
+                    points=points,
+                    resolution=resolution,
+                )
+            except Exception as e:
+                return Response({"error": str(e)}, status=status.HTTP_502_BAD_GATEWAY)
 
         if "error" in data:
             return Response(data, status=status.HTTP_404_NOT_FOUND)
 
+        if points:
+            with instrumentation.span("downsample"):
+                data = downsample_payload(data, points, method)
         return Response(data)
 
 
+class ChartBaselineView(views.APIView):
+    """
+    The chart's frozen control limits (see spc/baselines.py). GET returns
+    the active baseline, POST computes a new one from the start_date /
+    end_date period (default: the last SPC_DEFAULT_LOOKBACK_DAYS) and
+    DELETE releases it, so limits are estimated from each window again.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get_config(self, pk):
+        return ChartConfig.objects.select_related("data_source").get(id=pk)
+
+    def get(self, request, pk):
+        try:
+            config = self.get_config(pk)
+        except ChartConfig.DoesNotExist:
+            return Response(
+                {"error": "Chart configuration not found"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        baseline = CalculationService.active_baseline(config)
+        if baseline is None:
+            return Response(
+                {"error": "The chart has no active baseline"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        return Response(ControlLimitBaselineSerializer(baseline).data)
+
+    def post(self, request, pk):
+        try:
+            config = self.get_config(pk)
+        except ChartConfig.DoesNotExist:
+            return Response(
+                {"error": "Chart configuration not found"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        try:
+            start_date, end_date = parse_window_params(request.data)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            baseline = baseline_service.compute(
+                config, start_date, end_date, user=request.user
+            )
+        except BaselineError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+        return Response(
+            ControlLimitBaselineSerializer(baseline).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+    def delete(self, request, pk):
+        try:
+            config = self.get_config(pk)
+        except ChartConfig.DoesNotExist:
+            return Response(
+                {"error": "Chart configuration not found"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        baseline_service.release(config)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ChartIndexAdviceView(views.APIView):
+    """
+    Index diagnostics for the chart's source query: the estimated plan's
+    scans, rows read vs returned, and a recommended covering index
+    (see spc/index_advisor.py)
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        try:
+            config = ChartConfig.objects.select_related("data_source").get(id=pk)
+        except ChartConfig.DoesNotExist:
+            return Response(
+                {"error": "Chart configuration not found"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        try:
+            advice = IndexAdvisor().advise(config)
+        except QueryBuildError as e:
+            return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+        return Response(advice)
+
+
+class ChartBatchDataView(views.APIView):
+    """
+    Data for several charts in one request: ?ids=1,2,3 plus the usual
+    start_date / end_date window. Charts on the same table share one query.
+    """
+
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [ChartJSONRenderer, ChartColumnarJSONRenderer]
+
+    def get(self, request):
+        try:
+            chart_ids = [
+                int(i) for i in request.query_params.get("ids", "").split(",") if i
+            ]
+            start_date, end_date = parse_window_params(request.query_params)
+            points, method = parse_downsample_params(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        max_charts = get_batch_settings()["MAX_CHARTS"]
+        if not chart_ids:
+            return Response(
+                {"error": "ids is required"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(chart_ids) > max_charts:
+            return Response(
+                {"error": f"At most {max_charts} charts per request"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        charts = BatchChartService().get_charts_data(
+            dict.fromkeys(chart_ids), start_date=start_date, end_date=end_date
+        )
+        if points:
+            charts = {
+                chart_id: (
+                    data
+                    if "error" in data
+                    else downsample_payload(data, points, method)
+                )
+                for chart_id, data in charts.items()
+            }
+        return Response({"charts": charts})
+
+
 # Also need basic CRUD for ChartConfig if not using Admin Panel for everything
 # But user said "user with create access... should be able to setup an SPC chart"
 # So we DO need an API for creating ChartConfig from Frontend.
 
-from .serializers import ChartConfigSerializer
-
 
 class ChartConfigListCreateView(generics.ListCreateAPIView):
     permission_classes = [IsAuthenticated]
@@ -43,11 +330,18 @@ class ChartConfigDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = ChartConfig.objects.all()
 
 
-from rest_framework import viewsets
-from rest_framework.decorators import action
-from .models import DataSource
-from .serializers import DataSourceSerializer
-from .services import DataSourceService
+class CatalogPagination(PageNumberPagination):
+    """
+    ?page= / ?page_size= paging of the schema catalog listings
+    """
+
+    page_size_query_param = "page_size"
+
+    def get_page_size(self, request):
+        catalog_settings = get_catalog_settings()
+        self.page_size = catalog_settings["PAGE_SIZE"]
+        self.max_page_size = catalog_settings["MAX_PAGE_SIZE"]
+        return super().get_page_size(request)
 
 
 class DataSourceViewSet(viewsets.ModelViewSet):
@@ -61,3 +355,237 @@ class DataSourceViewSet(viewsets.ModelViewSet):
         service = DataSourceService()
         success, message = service.test_connection(source)
         return Response({"success": success, "message": message})
+
+    def paginated(self, items, **extra):
+        paginator = CatalogPagination()
+        page = paginator.paginate_queryset(items, self.request, view=self)
+        response = paginator.get_paginated_response(page)
+        response.data.update(extra)
+        return response
+
+    @action(detail=True, methods=["get"])
+    def tables(self, request, pk=None):
+        """
+        Tables and views of the source from its cached schema catalog:
+        ?search= filters on the qualified name, ?refresh=1 rebuilds the
+        catalog first. Paginated.
+        """
+        source = self.get_object()
+        refresh = request.query_params.get("refresh") in ("1", "true")
+        try:
+            catalog = schema_catalog.get(source, refresh=refresh)
+        except CatalogError as e:
+            return Response({"error": str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+        return self.paginated(
+            search_tables(catalog, request.query_params.get("search", "")),
+            refreshed_at=catalog["refreshed_at"],
+            stale=catalog["stale"],
+        )
+
+    @action(detail=True, methods=["get"], url_path=r"tables/(?P<table_name>[^/]+)")
+    def table(self, request, pk=None, table_name=None):
+        """
+        One table's columns (type, nullable, indexed) and indexes
+        """
+        source = self.get_object()
+        try:
+            table = schema_catalog.table(source, table_name)
+        except CatalogError as e:
+            return Response({"error": str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+        if table is None:
+            return Response(
+                {"error": f"Table {table_name!r} not found"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        return Response(table)
+
+    @action(detail=True, methods=["get"])
+    def values(self, request, pk=None):
+        """
+        Distinct values of ?column= in ?table= (product or operation
+        identifiers when setting up a chart), optionally containing
+        ?search=. Paginated.
+        """
+        source = self.get_object()
+        table_name = request.query_params.get("table")
+        column_name = request.query_params.get("column")
+        if not table_name or not column_name:
+            return Response(
+                {"error": "table and column are required"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            values = schema_catalog.distinct_values(
+                source, table_name, column_name, request.query_params.get("search", "")
+            )
+        except QueryBuildError as e:
+            return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
+        except CatalogError as e:
+            return Response({"error": str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+        return self.paginated(
+            values, truncated=len(values) >= get_catalog_settings()["VALUES_LIMIT"]
+        )
+
+    @action(detail=False, methods=["get"])
+    def pool_stats(self, request):
+        return Response(get_pool_stats())
+
+
+async def authenticate_async(request, query_token=False):
+    """
+    Token (Authorization header) or session authentication for the plain
+    async views. query_token also accepts ?token= when there is no session,
+    for EventSource clients that can't set headers; query strings end up in
+    access logs, so only the SSE endpoint allows it.
+    """
+    auth = get_authorization_header(request).split()
+    if len(auth) == 2 and auth[0].lower() == b"token":
+        return await token_user(auth[1].decode())
+
+    user = await request.auser()
+    if user.is_authenticated:
+        return user
+    if query_token and request.GET.get("token"):
+        return await token_user(request.GET["token"])
+    return None
+
+
+async def token_user(key):
+    try:
+        user, _ = await sync_to_async(TokenAuthentication().authenticate_credentials)(
+            key
+        )
+        return user
+    except AuthenticationFailed:
+        return None
+
+
+async def chart_data_async(request, pk):
+    """
+    Async variant of ChartDataView. The blocking source queries and pandas
+    work run on the shared source thread pool, bounded per DataSource and by
+    SPC_ASYNC["QUERY_TIMEOUT"], so slow sources don't hold server workers.
+    Requires an ASGI server (see backend/asgi.py).
+    """
+    if await authenticate_async(request) is None:
+        return JsonResponse(
+            {"detail": "Authentication credentials were not provided."}, status=401
+        )
+    try:
+        start_date, end_date = parse_window_params(request.GET)
+        points, method = parse_downsample_params(request.GET)
+        resolution = parse_resolution_param(request.GET, points)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    try:
+        config = await ChartConfig.objects.only("data_source_id").aget(pk=pk)
+    except ChartConfig.DoesNotExist:
+        return JsonResponse({"error": "Chart configuration not found"}, status=404)
+
+    timeout = get_async_settings()["QUERY_TIMEOUT"]
+    service = CalculationService(query_timeout=timeout)
+    try:
+        data = await source_executor.run(
+            config.data_source_id,
+            service.get_chart_data,
+            pk,
+            start_date,
+            end_date,
+            points,
+            resolution,
+            timeout=timeout,
+        )
+    except SourceBusy as e:
+        return JsonResponse({"error": str(e)}, status=503)
+    except asyncio.TimeoutError:
+        return JsonResponse(
+            {"error": f"Chart data query exceeded {timeout} seconds"}, status=504
+        )
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=502)
+
+    if "error" in data:
+        return JsonResponse(data, status=404)
+
+    if points:
+        data = downsample_payload(data, points, method)
+    body, content_type = render_chart_payload(data, request.headers.get("Accept", ""))
+    return HttpResponse(body, content_type=content_type)
+
+
+async def chart_stream(request, pk):
+    """
+    Server-Sent Events stream of a chart: a snapshot event, then update events
+    carrying only new points, refreshed statistics and new WECO violations.
+    Saving the chart sends a new snapshot event; deleting it ends the stream.
+    Requires an ASGI server (see backend/asgi.py).
+    """
+    if await authenticate_async(request, query_token=True) is None:
+        return JsonResponse(
+            {"detail": "Authentication credentials were not provided."}, status=401
+        )
+    try:
+        config = await ChartConfig.objects.select_related("data_source").aget(pk=pk)
+    except ChartConfig.DoesNotExist:
+        return JsonResponse({"error": "Chart configuration not found"}, status=404)
+
+    try:
+        stream, queue = await hub.subscribe(config)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=502)
+    keepalive = get_stream_settings()["KEEPALIVE"]
+
+    async def events():
+        try:
+            yield sse("snapshot", stream.snapshot)
+            while True:
+                try:
+                    kind, event = await asyncio.wait_for(queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield sse(kind, event)
+                if kind == "deleted":
+                    return
+        finally:
+            await hub.unsubscribe(config, queue)
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+class MetricsAccess(BasePermission):
+    """
+    Staff users, or scrapers sending SPC_INSTRUMENTATION["METRICS_TOKEN"] as
+    a bearer token
+    """
+
+    def has_permission(self, request, view):
+        if request.user and request.user.is_staff:
+            return True
+        token = instrumentation.get_instrumentation_settings()["METRICS_TOKEN"]
+        if not token:
+            return False
+        expected = f"Bearer {token}".encode()
+        return hmac.compare_digest(get_authorization_header(request), expected)
+
+
+class MetricsView(views.APIView):
+    """
+    Chart request metrics of this process in the Prometheus text format
+    (see spc/instrumentation.py). Disabled with SPC_INSTRUMENTATION METRICS.
+    """
+
+    permission_classes = [MetricsAccess]
+    renderer_classes = [PrometheusRenderer]
+
+    def get(self, request):
+        if not instrumentation.get_instrumentation_settings()["METRICS"]:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response(
+            instrumentation.metrics.render(),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
@@ -0,0 +1,172 @@
+import numpy as np
+from typing import Any, Dict
+
+# Nelson rule number -> (description, default parameters). Rules 1, 2, 5 and 6
+# are the original Western Electric rules and are enabled when a chart has no
+# weco_rules configured.
+RULES = {
+    "1": ("One point beyond {sigma} sigma", {"sigma": 3.0}),
+    "2": (
+        "{points} points in a row on the same side of the centre line",
+        {"points": 9},
+    ),
+    "3": ("{points} points in a row steadily increasing or decreasing", {"points": 6}),
+    "4": ("{points} points in a row alternating up and down", {"points": 14}),
+    "5": ("2 of 3 points beyond {sigma} sigma on the same side", {"sigma": 2.0}),
+    "6": ("4 of 5 points beyond {sigma} sigma on the same side", {"sigma": 1.0}),
+    "7": ("{points} points in a row within 1 sigma", {"points": 15}),
+    "8": ("{points} points in a row beyond 1 sigma on either side", {"points": 8}),
+}
+
+DEFAULT_RULES = ["1", "2", "5", "6"]
+
+
+def resolve_rules(weco_rules: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    Turns a ChartConfig.weco_rules value into {rule: parameters} for the
+    enabled rules. Entries are either a bool or a dict of parameter overrides
+    (with an optional "enabled" key), e.g. {"1": true, "2": {"points": 8}}.
+    """
+    if not weco_rules:
+        return {rule: dict(RULES[rule][1]) for rule in DEFAULT_RULES}
+
+    enabled = {}
+    for rule, value in weco_rules.items():
+        rule = str(rule)
+        if rule not in RULES:
+            continue
+        if isinstance(value, dict):
+            if not value.get("enabled", True):
+                continue
+            params = {**RULES[rule][1], **value}
+            params.pop("enabled", None)
+        elif value:
+            params = dict(RULES[rule][1])
+        else:
+            continue
+        enabled[rule] = params
+    return enabled
+
+
+def window_count(mask: np.ndarray, k: int) -> np.ndarray:
+    """
+    Number of True values in the window of k points ending at each index
+    (windows that would start before the series are left at 0).
+    """
+    n = len(mask)
+    if k <= 0 or n < k:
+        return np.zeros(n, dtype=np.int32)
+    if k > 255:
+        out = np.zeros(n, dtype=np.int32)
+        csum = np.cumsum(mask, dtype=np.int32)
+        out[k - 1 :] = csum[k - 1 :]
+        out[k:] -= csum[:-k]
+        return out
+    # Summing k shifted views is several times faster than a cumsum for the
+    # short windows the rules use; the loop is over the window, not the points.
+    out = np.zeros(n, dtype=np.uint8)
+    acc = out[k - 1 :]
+    for j in range(k):
+        acc += mask[j : n - k + 1 + j]
+    return out
+
+
+def run_of(mask: np.ndarray, k: int) -> np.ndarray:
+    """
+    True where the last k points all satisfy mask
+    """
+    n = len(mask)
+    out = np.zeros(n, dtype=bool)
+    if k <= 0 or n < k:
+        return out
+    acc = mask[k - 1 :].copy()
+    for j in range(1, k):
+        acc &= mask[k - 1 - j : n - j]
+    out[k - 1 :] = acc
+    return out
+
+
+def _beyond(z: np.ndarray, sigma: float, of: int, need: int) -> np.ndarray:
+    above = z > sigma
+    below = z < -sigma
+    return (above & (window_count(above, of) >= need)) | (
+        below & (window_count(below, of) >= need)
+    )
+
+
+def _trend(values: np.ndarray, points: int) -> np.ndarray:
+    # points in a row increasing == points - 1 consecutive positive steps
+    out = np.zeros(len(values), dtype=bool)
+    if len(values) < 2:
+        return out
+    diff = np.diff(values)
+    steps = points - 1
+    out[1:] = run_of(diff > 0, steps) | run_of(diff < 0, steps)
+    return out
+
+
+def _alternating(values: np.ndarray, points: int) -> np.ndarray:
+    # points in a row alternating == points - 2 consecutive sign flips
+    out = np.zeros(len(values), dtype=bool)
+    if len(values) < 3:
+        return out
+    diff = np.diff(values)
+    flips = (diff[1:] * diff[:-1]) < 0
+    out[2:] = run_of(flips, points - 2)
+    return out
+
+
+def evaluate(
+    values, centre: float, sigma, rules: Dict[str, Dict[str, Any]]
+) -> Dict[str, np.ndarray]:
+    """
+    Evaluates the enabled rules over a series (subgroup means) and returns
+    {rule: array of indices of the points that complete a violation}. The
+    zones are drawn around `centre` in units of `sigma`, one value or one
+    per point (subgroup means of varying size). Every rule is a handful of
+    NumPy passes; there is no per-point Python loop.
+    """
+    x = np.asarray(values, dtype=float)
+    results = {}
+
+    sigma = np.asarray(np.nan if sigma is None else sigma, dtype=float)
+    centre = np.nan if centre is None else centre
+    if np.isfinite(centre) and np.all(np.isfinite(sigma) & (sigma > 0)):
+        z = (x - centre) / sigma
+        abs_z = np.abs(z)
+    else:
+        # Zone rules are meaningless without a spread
+        z = abs_z = None
+
+    for rule, params in rules.items():
+        if rule == "1":
+            hits = None if z is None else abs_z > params["sigma"]
+        elif rule == "2":
+            hits = (
+                None
+                if z is None
+                else run_of(z > 0, params["points"]) | run_of(z < 0, params["points"])
+            )
+        elif rule == "3":
+            hits = _trend(x, params["points"])
+        elif rule == "4":
+            hits = _alternating(x, params["points"])
+        elif rule == "5":
+            hits = None if z is None else _beyond(z, params["sigma"], 3, 2)
+        elif rule == "6":
+            hits = None if z is None else _beyond(z, params["sigma"], 5, 4)
+        elif rule == "7":
+            hits = None if z is None else run_of(abs_z < 1, params["points"])
+        elif rule == "8":
+            hits = None if z is None else run_of(abs_z > 1, params["points"])
+        else:
+            continue
+        results[rule] = (
+            np.empty(0, dtype=np.intp) if hits is None else np.flatnonzero(hits)
+        )
+
+    return results
+
+
+def describe(rules: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+    return {rule: RULES[rule][0].format(**params) for rule, params in rules.items()}